@@ -0,0 +1,218 @@
+"""
+Content-addressed store for uploaded inputs on Server B
+
+Every upload is stored once under its SHA-256 as <root>/<sha[:2]>/<sha>; each task
+that uses the content holds a reference to it. Before sending a file the AI server
+asks for the blob by hash, and only uploads the bytes when Server B does not have
+them yet, so resubmitting the same layout transfers (almost) nothing.
+
+- References are per task id, so releasing the same task twice (e.g. a cancelled
+  task that is later deleted) is harmless. A blob is removed when its last
+  reference is released.
+- References are kept in memory like task_status; blobs left over from a previous
+  run have no references and are removed by sweep() once they are old enough.
+- Blobs are shared between tasks: processing must treat its input as read-only.
+- Uploads may be sent gzip- or zstd-compressed; they are decompressed while being
+  written (the hash is always of the uncompressed content), with limits on the
+  total size and the compression ratio so a small upload cannot fill the disk.
+"""
+
+import os
+import re
+import gzip
+import zlib
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed to accept zstd-compressed uploads
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+# Below this many decompressed bytes the compression ratio is not checked
+RATIO_MIN_BYTES = 64 * 1024 * 1024
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobMismatch(ValueError):
+    """Uploaded bytes do not match the SHA-256 the client announced"""
+
+
+class UnsupportedEncoding(ValueError):
+    """Upload compressed with an encoding this server cannot decompress"""
+
+
+class UploadTooLarge(ValueError):
+    """Decompressed upload exceeds the size or compression ratio limit"""
+
+
+class CorruptUpload(ValueError):
+    """Compressed upload that cannot be decompressed"""
+
+
+# Raised by the decompressors on truncated or corrupt data (gzip.BadGzipFile is an OSError)
+_DECOMPRESS_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def decompressing_reader(src, encoding: Optional[str]):
+    """File-like reader that decompresses src on the fly (src itself when encoding is None)"""
+    if not encoding:
+        return src
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=src, mode='rb')
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise UnsupportedEncoding("zstd uploads need the zstandard package on Server B")
+        return zstandard.ZstdDecompressor().stream_reader(src, read_across_frames=True)
+    raise UnsupportedEncoding(f"Unsupported upload encoding: {encoding}")
+
+
+def is_digest(value: str) -> bool:
+    return bool(_DIGEST_RE.match(value or ''))
+
+
+class BlobStore:
+    """Uploaded inputs stored by SHA-256 with per-task reference counting"""
+
+    def __init__(self, root: Path, max_bytes: int, max_ratio: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_ratio = max_ratio
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # digest -> task ids holding a reference
+        self._holders: Dict[str, Set[str]] = {}
+        self.stats = {'full': 0, 'deduplicated': 0, 'bytes_full': 0, 'bytes_deduplicated': 0, 'bytes_wire': 0}
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _hold(self, digest: str, task_id: str):
+        self._holders.setdefault(digest, set()).add(task_id)
+
+    def acquire(self, digest: str, task_id: str) -> Optional[int]:
+        """Reference an existing blob for task_id; returns its size, or None if Server B does not have it"""
+        path = self.path(digest)
+        with self._lock:
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                return None
+            # Keep blobs that are still being reused out of the sweeper's reach
+            os.utime(path)
+            self._hold(digest, task_id)
+            self.stats['deduplicated'] += 1
+            self.stats['bytes_deduplicated'] += size
+        return size
+
+    def _check_size(self, size: int, received: int, encoding: Optional[str]):
+        if size > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        if encoding and size > RATIO_MIN_BYTES and size > self.max_ratio * max(received, 1):
+            raise UploadTooLarge(f"Compression ratio exceeds {self.max_ratio:g} "
+                                 f"({received} bytes expand to more than {size})")
+
+    def add_file(self, src, task_id: str, expected: Optional[str] = None,
+                 encoding: Optional[str] = None) -> Tuple[str, int]:
+        """
+        Copy an uploaded file into the store while hashing it and reference it for task_id
+
+        With encoding ("gzip" or "zstd") the upload is decompressed while it is copied.
+        Raises BlobMismatch if expected is given and the content hashes differently,
+        UploadTooLarge if it decompresses past the limits and CorruptUpload if it
+        cannot be decompressed.
+        """
+        hasher = hashlib.sha256()
+        tmp = self.root / f"upload-{uuid.uuid4().hex}.tmp"
+        src.seek(0)
+        reader = decompressing_reader(src, encoding)
+        try:
+            with open(tmp, 'wb') as f:
+                while True:
+                    try:
+                        chunk = reader.read(CHUNK_SIZE)
+                    except _DECOMPRESS_ERRORS as e:
+                        if not encoding:
+                            raise
+                        raise CorruptUpload(f"Could not decompress {encoding} upload: {e}") from e
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    self._check_size(f.tell(), src.tell(), encoding)
+                size = f.tell()
+            digest = hasher.hexdigest()
+            if expected and digest != expected:
+                raise BlobMismatch(f"Content hash {digest} does not match announced sha256 {expected}")
+            path = self.path(digest)
+            with self._lock:
+                if path.exists():
+                    os.utime(path)
+                else:
+                    path.parent.mkdir(exist_ok=True)
+                    os.replace(tmp, path)
+                self._hold(digest, task_id)
+                self.stats['full'] += 1
+                self.stats['bytes_full'] += size
+                self.stats['bytes_wire'] += src.tell()
+        finally:
+            tmp.unlink(missing_ok=True)
+        return digest, size
+
+    def release(self, digest: str, task_id: str) -> bool:
+        """Drop task_id's reference; the blob is removed with its last reference. Returns whether it was removed"""
+        with self._lock:
+            holders = self._holders.get(digest)
+            if holders is None:
+                return False
+            holders.discard(task_id)
+            if holders:
+                return False
+            del self._holders[digest]
+            self.path(digest).unlink(missing_ok=True)
+            return True
+
+    def sweep(self, cutoff: float) -> int:
+        """Remove unreferenced blobs and stale temporary files last used before cutoff"""
+        removed = 0
+        for path in list(self.root.glob('*/*')) + list(self.root.glob('*.tmp')):
+            try:
+                with self._lock:
+                    if path.name in self._holders or path.stat().st_mtime >= cutoff:
+                        continue
+                    path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def render(self) -> List[str]:
+        """Prometheus lines: uploads and bytes by mode, and blobs currently referenced"""
+        with self._lock:
+            stats = dict(self.stats)
+            referenced = len(self._holders)
+            references = sum(len(holders) for holders in self._holders.values())
+        return [
+            "# HELP drc_server_b_uploads_total Uploads by mode (full: bytes sent, deduplicated: existing blob reused by hash)",
+            "# TYPE drc_server_b_uploads_total counter",
+            f'drc_server_b_uploads_total{{mode="full"}} {stats["full"]}',
+            f'drc_server_b_uploads_total{{mode="deduplicated"}} {stats["deduplicated"]}',
+            "# HELP drc_server_b_upload_bytes_total Input bytes received, and bytes not sent because the blob already existed",
+            "# TYPE drc_server_b_upload_bytes_total counter",
+            f'drc_server_b_upload_bytes_total{{mode="full"}} {stats["bytes_full"]}',
+            f'drc_server_b_upload_bytes_total{{mode="deduplicated"}} {stats["bytes_deduplicated"]}',
+            "# HELP drc_server_b_upload_wire_bytes_total Bytes of full uploads as received (compressed when the client compresses)",
+            "# TYPE drc_server_b_upload_wire_bytes_total counter",
+            f"drc_server_b_upload_wire_bytes_total {stats['bytes_wire']}",
+            "# HELP drc_server_b_blobs Input blobs currently referenced by tasks",
+            "# TYPE drc_server_b_blobs gauge",
+            f"drc_server_b_blobs {referenced}",
+            "# HELP drc_server_b_blob_references Task references to input blobs",
+            "# TYPE drc_server_b_blob_references gauge",
+            f"drc_server_b_blob_references {references}",
+        ]
@@ -0,0 +1,94 @@
+"""
+Processing executor for Server B whose size can change while it runs
+
+Uploads queue their processing here instead of each starting its own thread, so
+the number of tasks processed at once is bounded and can be adjusted by the
+autoscaler on the AI server (POST /api/v1/executor).
+
+- Growing starts threads right away for queued tasks.
+- Shrinking never interrupts a running task: surplus threads exit when their
+  current task finishes (or immediately when idle).
+- A size of 0 means unbounded: every task starts on its own thread immediately,
+  which is how Server B behaved before the executor existed.
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Callable, Dict
+
+
+class ResizableExecutor:
+    """FIFO thread pool with an adjustable number of worker threads"""
+
+    def __init__(self, workers: int, name: str = "server-b-processing"):
+        self.name = name
+        self._workers = max(0, workers)
+        self._cond = threading.Condition()
+        # (submitted_at, fn, args) in arrival order
+        self._queue: deque = deque()
+        self._threads = 0
+        self._busy = 0
+        self._serial = 0
+        self.resizes = 0
+
+    def _limit(self) -> float:
+        return self._workers or float('inf')
+
+    def _spawn_locked(self):
+        """Start threads for queued tasks up to the size limit (caller holds the lock)"""
+        while self._queue and self._threads < self._limit() and self._threads - self._busy < len(self._queue):
+            self._threads += 1
+            self._serial += 1
+            threading.Thread(target=self._run, name=f"{self.name}-{self._serial}", daemon=True).start()
+
+    def submit(self, fn: Callable, *args):
+        with self._cond:
+            self._queue.append((time.time(), fn, args))
+            self._spawn_locked()
+            self._cond.notify()
+
+    def resize(self, workers: int):
+        """Change the number of tasks processed at once (0 = unbounded)"""
+        with self._cond:
+            if max(0, workers) == self._workers:
+                return
+            self._workers = max(0, workers)
+            self.resizes += 1
+            self._spawn_locked()
+            # Idle threads above the new size wake up and exit
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and self._threads <= self._limit():
+                    if not self._workers:
+                        # Unbounded: threads only live as long as there is work
+                        self._threads -= 1
+                        return
+                    self._cond.wait()
+                if self._threads > self._limit():
+                    self._threads -= 1
+                    return
+                _, fn, args = self._queue.popleft()
+                self._busy += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Processing task failed: {e}")
+            finally:
+                with self._cond:
+                    self._busy -= 1
+
+    def stats(self) -> Dict:
+        with self._cond:
+            oldest = time.time() - self._queue[0][0] if self._queue else 0.0
+            return {
+                'workers': self._workers,
+                'threads': self._threads,
+                'busy': self._busy,
+                'queued': len(self._queue),
+                'oldest_queued_seconds': round(oldest, 3),
+                'resizes': self.resizes,
+            }
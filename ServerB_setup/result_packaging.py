@@ -0,0 +1,228 @@
+"""
+Result packaging for Server B
+
+Builds the results ZIP with a per-type compression policy and parallel member
+compression, written as a stream so the download endpoint can send it without
+a temporary ZIP file on disk.
+
+- Policy: PNG (and other already-compressed formats) are STORED, GDS uses
+  DEFLATE level 9, everything else DEFLATE level 6. Override with
+  SERVER_B_ZIP_POLICY, e.g. "png=stored,gds=deflate:9,default=deflate:6".
+- Members are compressed in a thread pool (zlib releases the GIL), a bounded
+  number ahead of the member currently being written, and emitted in order.
+- Because every member is fully compressed before its local header is written,
+  CRC and sizes are known up front; no data descriptors are needed and the
+  output is readable by any unzip tool. ZIP64 records are added only when
+  sizes or offsets exceed 4 GiB.
+
+Only STORED and DEFLATE are used so that the AI server can extract the archive
+with the standard library zipfile module on any supported Python version.
+"""
+
+import os
+import time
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+STORED = 0
+DEFLATED = 8
+
+CHUNK_SIZE = 1024 * 1024
+_ZIP32_LIMIT = 0xFFFFFFFF
+
+
+def parse_policy(spec: str) -> Dict[str, Tuple[int, int]]:
+    """Parse "png=stored,gds=deflate:9,default=deflate:6" into {suffix: (method, level)}"""
+    policy = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        suffix, _, rule = item.strip().partition('=')
+        method, _, level = rule.strip().lower().partition(':')
+        if method == 'stored':
+            policy[suffix.strip().lower().lstrip('.')] = (STORED, 0)
+        elif method == 'deflate':
+            policy[suffix.strip().lower().lstrip('.')] = (DEFLATED, int(level or 6))
+        else:
+            raise ValueError(f"Unsupported ZIP compression method: {method}")
+    policy.setdefault('default', (DEFLATED, 6))
+    return policy
+
+
+PACKAGING_CONFIG = {
+    'policy': parse_policy(os.getenv(
+        'SERVER_B_ZIP_POLICY',
+        'png=stored,jpg=stored,jpeg=stored,zip=stored,gz=stored,zst=stored,gds=deflate:9,default=deflate:6')),
+    'workers': int(os.getenv('SERVER_B_PACKAGING_WORKERS', str(os.cpu_count() or 1))),
+    # "stream": build the ZIP while it is downloaded; "file": write it to disk when processing completes
+    'mode': os.getenv('SERVER_B_PACKAGING_MODE', 'stream'),
+}
+
+
+def compression_for(name: str, policy: Optional[Dict[str, Tuple[int, int]]] = None) -> Tuple[int, int]:
+    """Return (method, level) for an archive member name"""
+    policy = policy or PACKAGING_CONFIG['policy']
+    suffix = Path(name).suffix.lower().lstrip('.')
+    return policy.get(suffix, policy['default'])
+
+
+def _dos_datetime(timestamp: float) -> Tuple[int, int]:
+    t = time.localtime(timestamp)
+    year = max(1980, t.tm_year)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def _prepare_member(path: Path, arcname: str, method: int, level: int) -> Dict:
+    """Compress one member (runs in the packaging pool)"""
+    crc = 0
+    size = 0
+    data = None
+    if method == DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        parts = []
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                parts.append(compressor.compress(chunk))
+        parts.append(compressor.flush())
+        data = b''.join(parts)
+        compressed_size = len(data)
+    else:
+        # STORED members are streamed from disk; only the CRC is computed here
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        compressed_size = size
+    return {
+        'path': path,
+        'arcname': arcname,
+        'method': method,
+        'crc': crc,
+        'file_size': size,
+        'compressed_size': compressed_size,
+        'data': data,
+        'mtime': path.stat().st_mtime,
+    }
+
+
+def _local_header(member: Dict) -> bytes:
+    name = member['arcname'].encode('utf-8')
+    zip64 = member['file_size'] >= _ZIP32_LIMIT or member['compressed_size'] >= _ZIP32_LIMIT
+    extra = struct.pack('<HHQQ', 0x0001, 16, member['file_size'], member['compressed_size']) if zip64 else b''
+    dos_time, dos_date = _dos_datetime(member['mtime'])
+    return struct.pack(
+        '<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, 0x0800, member['method'], dos_time, dos_date,
+        member['crc'],
+        _ZIP32_LIMIT if zip64 else member['compressed_size'],
+        _ZIP32_LIMIT if zip64 else member['file_size'],
+        len(name), len(extra)
+    ) + name + extra
+
+
+def _central_header(member: Dict, offset: int) -> bytes:
+    name = member['arcname'].encode('utf-8')
+    fields = []
+    file_size, compressed_size, header_offset = member['file_size'], member['compressed_size'], offset
+    if file_size >= _ZIP32_LIMIT:
+        fields.append(file_size)
+        file_size = _ZIP32_LIMIT
+    if compressed_size >= _ZIP32_LIMIT:
+        fields.append(compressed_size)
+        compressed_size = _ZIP32_LIMIT
+    if header_offset >= _ZIP32_LIMIT:
+        fields.append(header_offset)
+        header_offset = _ZIP32_LIMIT
+    extra = struct.pack(f'<HH{len(fields)}Q', 0x0001, 8 * len(fields), *fields) if fields else b''
+    version = 45 if fields else 20
+    dos_time, dos_date = _dos_datetime(member['mtime'])
+    return struct.pack(
+        '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, 0x0800, member['method'],
+        dos_time, dos_date, member['crc'], compressed_size, file_size,
+        len(name), len(extra), 0, 0, 0, 0o100644 << 16, header_offset
+    ) + name + extra
+
+
+def _end_records(count: int, cd_offset: int, cd_size: int) -> bytes:
+    records = b''
+    if count >= 0xFFFF or cd_offset >= _ZIP32_LIMIT or cd_size >= _ZIP32_LIMIT:
+        zip64_offset = cd_offset + cd_size
+        records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        records += struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1)
+    records += struct.pack(
+        '<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+        min(cd_size, _ZIP32_LIMIT), min(cd_offset, _ZIP32_LIMIT), 0)
+    return records
+
+
+def iter_zip(files: Iterable[Tuple[Path, str]], workers: Optional[int] = None,
+             policy: Optional[Dict[str, Tuple[int, int]]] = None) -> Iterator[bytes]:
+    """
+    Yield a ZIP archive of (path, arcname) pairs as byte chunks
+
+    Members are compressed in parallel, at most 2 * workers ahead of the one
+    being written, so memory stays bounded on large batches.
+    """
+    files = list(files)
+    workers = max(1, workers or PACKAGING_CONFIG['workers'])
+    ahead = 2 * workers
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zip-pack")
+    futures = []
+    central: List[bytes] = []
+    offset = 0
+
+    def submit(index):
+        path, arcname = files[index]
+        method, level = compression_for(arcname, policy)
+        futures.append(executor.submit(_prepare_member, Path(path), arcname, method, level))
+
+    try:
+        for index in range(min(ahead, len(files))):
+            submit(index)
+        for index in range(len(files)):
+            member = futures[index].result()
+            futures[index] = None
+            if index + ahead < len(files):
+                submit(index + ahead)
+
+            central.append(_central_header(member, offset))
+            header = _local_header(member)
+            yield header
+            offset += len(header)
+            if member['data'] is not None:
+                yield member['data']
+            else:
+                with open(member['path'], 'rb') as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        yield chunk
+            offset += member['compressed_size']
+
+        cd_offset = offset
+        cd = b''.join(central)
+        yield cd
+        yield _end_records(len(central), cd_offset, len(cd))
+    finally:
+        # Stop compressing ahead if the client disconnected mid-download
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        executor.shutdown(wait=False)
+
+
+def write_zip(files: Iterable[Tuple[Path, str]], dest: Path, workers: Optional[int] = None,
+              policy: Optional[Dict[str, Tuple[int, int]]] = None) -> int:
+    """Write the ZIP to dest atomically, returning its size"""
+    tmp = dest.with_name(dest.name + '.tmp')
+    size = 0
+    with open(tmp, 'wb') as f:
+        for chunk in iter_zip(files, workers, policy):
+            f.write(chunk)
+            size += len(chunk)
+    os.replace(tmp, dest)
+    return size
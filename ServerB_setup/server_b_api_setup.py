@@ -6,22 +6,44 @@ This file provides a complete template for setting up the API server on Server B
 import os
 import json
 import time
-import zipfile
+import shutil
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Dict, Optional, List
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, status
+import threading
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Header, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
 from dotenv import load_dotenv
 
+from result_packaging import PACKAGING_CONFIG, iter_zip, write_zip
+from blob_store import BlobMismatch, BlobStore, CorruptUpload, UnsupportedEncoding, UploadTooLarge, is_digest
+from processing_pool import ResizableExecutor
+from violations import read_violations
+
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Processing threads wake long-poll and SSE status requests through this loop
+    status_watchers.bind(asyncio.get_running_loop())
+    # Periodically remove expired task files so the result volume does not fill up
+    stop = threading.Event()
+    sweeper = threading.Thread(target=retention_sweeper, args=(stop,), daemon=True)
+    sweeper.start()
+    yield
+    stop.set()
+
 app = FastAPI(
     title="Server B API for DRC Processing",
     description="API server for receiving AI processing requests and returning results",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Security
@@ -33,18 +55,259 @@ SERVER_B_CONFIG = {
     'host': os.getenv('SERVER_B_HOST', '0.0.0.0'),
     'api_key': os.getenv('SERVER_B_API_KEY', 'server-b-api-key-change-me'),
     'upload_dir': Path(os.getenv('SERVER_B_UPLOAD_DIR', 'uploads')),
+    # Uploaded inputs are stored here by SHA-256, once per distinct content
+    'blob_dir': Path(os.getenv('SERVER_B_BLOB_DIR', os.path.join(os.getenv('SERVER_B_UPLOAD_DIR', 'uploads'), 'blobs'))),
+    # Limits for (decompressed) uploads: total size, and compression ratio of compressed uploads
+    'max_upload_bytes': int(os.getenv('SERVER_B_MAX_UPLOAD_BYTES', str(16 * 1024 ** 3))),
+    'max_compression_ratio': float(os.getenv('SERVER_B_MAX_COMPRESSION_RATIO', '200')),
     'results_dir': Path(os.getenv('SERVER_B_RESULTS_DIR', 'results')),
     'processing_dir': Path(os.getenv('SERVER_B_PROCESSING_DIR', 'processing')),
-    'callback_url': os.getenv('CALLBACK_URL', None)  # Optional callback to AI server
+    'callback_url': os.getenv('CALLBACK_URL', None),  # Optional callback to AI server
+    # Mock processing knobs (used by load tests; remove with the mock processing)
+    'mock_processing_seconds': float(os.getenv('SERVER_B_MOCK_PROCESSING_SECONDS', '5')),
+    'mock_result_count': int(os.getenv('SERVER_B_MOCK_RESULT_COUNT', '1')),
+    'mock_file_bytes': int(os.getenv('SERVER_B_MOCK_FILE_BYTES', '0')),
+    # Bounded thread pool for blocking disk I/O inside async handlers
+    'io_workers': int(os.getenv('SERVER_B_IO_WORKERS', '8')),
+    # Tasks processed at once (0 = unbounded); the AI server's autoscaler can change it at runtime
+    'processing_workers': int(os.getenv('SERVER_B_PROCESSING_WORKERS', '0')),
+    # Completed tasks (and any leftover files) older than this are removed by the sweeper
+    'retention_seconds': int(os.getenv('SERVER_B_RETENTION_SECONDS', str(24 * 3600))),
+    'sweep_interval': int(os.getenv('SERVER_B_SWEEP_INTERVAL', '600')),
+    # Upper bound for ?wait= on the status endpoint, and the SSE keep-alive comment interval
+    'max_status_wait': float(os.getenv('SERVER_B_MAX_STATUS_WAIT', '60')),
+    'sse_keepalive': float(os.getenv('SERVER_B_SSE_KEEPALIVE', '15'))
 }
 
 # Ensure directories exist
 for dir_path in [SERVER_B_CONFIG['upload_dir'], SERVER_B_CONFIG['results_dir'], SERVER_B_CONFIG['processing_dir']]:
     dir_path.mkdir(exist_ok=True)
 
+blob_store = BlobStore(SERVER_B_CONFIG['blob_dir'], SERVER_B_CONFIG['max_upload_bytes'],
+                       SERVER_B_CONFIG['max_compression_ratio'])
+
 # Task status storage (in production, use a database)
 task_status = {}
 
+# Statuses after which a task no longer changes
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+# Set by the cancel endpoint; the processing thread checks it between steps and while waiting
+cancel_events: Dict[str, threading.Event] = {}
+# Serializes status transitions so a cancelled task is never moved back to processing/completed
+status_lock = threading.Lock()
+
+class StatusWatchers:
+    """
+    Per-task asyncio events for long-poll and SSE status requests
+
+    Status changes happen on processing threads, so notify() hands the wake-up to the
+    event loop with call_soon_threadsafe; waiters never poll or sleep.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # task_id -> [event, number of waiters]
+        self._events: Dict[str, list] = {}
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def notify(self, task_id: str):
+        """Wake everyone waiting on task_id (callable from any thread)"""
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake, task_id)
+
+    def _wake(self, task_id: str):
+        entry = self._events.pop(task_id, None)
+        if entry:
+            entry[0].set()
+
+    async def wait(self, task_id: str, timeout: float) -> bool:
+        """Wait until the next change of task_id; False on timeout"""
+        entry = self._events.setdefault(task_id, [asyncio.Event(), 0])
+        entry[1] += 1
+        try:
+            await asyncio.wait_for(entry[0].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._events.get(task_id) is entry:
+                del self._events[task_id]
+
+status_watchers = StatusWatchers()
+
+def set_task_status(task_id: str, info: Dict, unless_cancelled: bool = False) -> bool:
+    """
+    Replace a task's status and wake its watchers (the dict is replaced, never mutated in place)
+
+    With unless_cancelled=True nothing is written if the task was cancelled; returns
+    whether the status was written.
+    """
+    with status_lock:
+        if unless_cancelled and task_status.get(task_id, {}).get('status') == 'cancelled':
+            return False
+        task_status[task_id] = info
+    status_watchers.notify(task_id)
+    return True
+
+def public_status(info: Dict) -> Dict:
+    """Status response without internal fields"""
+    status_info = info.copy()
+    status_info.pop('input_file', None)
+    status_info.pop('input_sha256', None)
+    return status_info
+
+# Disk I/O runs here so that uploads and downloads never block the event loop
+io_executor = ThreadPoolExecutor(max_workers=SERVER_B_CONFIG['io_workers'], thread_name_prefix="server-b-io")
+
+# Processing runs here; tasks wait in "received" status until a worker thread is free
+processing_executor = ResizableExecutor(SERVER_B_CONFIG['processing_workers'])
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking function in the bounded I/O thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
+
+def remove_task_files(task_id: str):
+    """Remove a task's result directory and ZIP file, and release its reference to the input blob"""
+    task_results_dir = SERVER_B_CONFIG['results_dir'] / task_id
+    if task_results_dir.exists():
+        shutil.rmtree(task_results_dir)
+    zip_file = SERVER_B_CONFIG['results_dir'] / f"{task_id}_results.zip"
+    if zip_file.exists():
+        zip_file.unlink()
+    # The input may be shared with other tasks; it is removed with its last reference
+    input_sha256 = task_status.get(task_id, {}).get('input_sha256')
+    if input_sha256:
+        blob_store.release(input_sha256, task_id)
+
+def sweep_expired_tasks(now: Optional[float] = None) -> Dict[str, int]:
+    """
+    Remove finished tasks older than the retention period, then any files in the
+    upload/results/processing dirs that no task refers to (e.g. after a restart,
+    since task_status is kept in memory)
+    """
+    now = now or time.time()
+    cutoff = now - SERVER_B_CONFIG['retention_seconds']
+    removed = {'tasks': 0, 'orphans': 0}
+
+    for task_id, info in list(task_status.items()):
+        if info.get('status') not in TERMINAL_STATUSES:
+            continue
+        timings = info.get('timings', {})
+        finished_at = timings.get('completed_at') or timings.get('cancelled_at') or timings.get('received_at', now)
+        if finished_at < cutoff:
+            remove_task_files(task_id)
+            task_status.pop(task_id, None)
+            status_watchers.notify(task_id)
+            removed['tasks'] += 1
+
+    active = set(task_status)
+    for directory in (SERVER_B_CONFIG['upload_dir'], SERVER_B_CONFIG['results_dir'], SERVER_B_CONFIG['processing_dir']):
+        for path in directory.iterdir():
+            if path == blob_store.root:
+                continue
+            try:
+                if any(path.name.startswith(task_id) for task_id in active) or path.stat().st_mtime >= cutoff:
+                    continue
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+                removed['orphans'] += 1
+            except FileNotFoundError:
+                continue
+    removed['orphans'] += blob_store.sweep(cutoff)
+    return removed
+
+def retention_sweeper(stop: threading.Event):
+    """Background thread: run sweep_expired_tasks every sweep_interval seconds"""
+    while not stop.wait(SERVER_B_CONFIG['sweep_interval']):
+        try:
+            removed = sweep_expired_tasks()
+            if removed['tasks'] or removed['orphans']:
+                print(f"清理過期任務: {removed}")
+        except Exception as e:
+            print(f"清理過期任務失敗: {e}")
+
+# Latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+class StageHistograms:
+    """In-process latency histograms per processing stage, exposed on /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict] = {}
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            data = self._data.setdefault(stage, {'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'sum': 0.0})
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    data['buckets'][i] += 1
+            data['count'] += 1
+            data['sum'] += seconds
+
+    def render(self, name: str, help_text: str) -> List[str]:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage in sorted(self._data):
+                data = self._data[stage]
+                for bound, count in zip(LATENCY_BUCKETS, data['buckets']):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{float(bound):g}"}} {count}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {data["count"]}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {data["sum"]}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {data["count"]}')
+        return lines
+
+stage_histograms = StageHistograms()
+
+class CancelStats:
+    """Cancelled tasks by the stage they were stopped in, and the mock processing time they no longer use"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancelled: Dict[str, int] = {}
+        self.reclaimed_seconds = 0.0
+
+    def record(self, stage: str, timings: Dict):
+        # Processing that had not finished yet is capacity handed back to other tasks
+        reclaimed = 0.0
+        if 'processed_at' not in timings:
+            started = timings.get('started_at')
+            cancelled = timings.get('cancelled_at', time.time())
+            elapsed = max(0.0, cancelled - started) if started else 0.0
+            reclaimed = max(0.0, SERVER_B_CONFIG['mock_processing_seconds'] - elapsed)
+        with self._lock:
+            self.cancelled[stage] = self.cancelled.get(stage, 0) + 1
+            self.reclaimed_seconds += reclaimed
+
+    def render(self) -> List[str]:
+        lines = ["# HELP drc_server_b_cancelled_total Tasks cancelled, by the stage processing stopped in",
+                 "# TYPE drc_server_b_cancelled_total counter"]
+        with self._lock:
+            lines += [f'drc_server_b_cancelled_total{{stage="{stage}"}} {count}'
+                      for stage, count in sorted(self.cancelled.items())]
+            lines += ["# HELP drc_server_b_reclaimed_processing_seconds_total Processing time not spent because of cancellations",
+                      "# TYPE drc_server_b_reclaimed_processing_seconds_total counter",
+                      f"drc_server_b_reclaimed_processing_seconds_total {self.reclaimed_seconds}"]
+        return lines
+
+cancel_stats = CancelStats()
+
+def record_stage(task_id: str, stage: str, start: float, end: float):
+    """Record a stage span: structured log line keyed by trace id plus histogram sample"""
+    trace_id = task_status.get(task_id, {}).get('trace_id') or task_id
+    duration = max(0.0, end - start)
+    stage_histograms.observe(stage, duration)
+    print(json.dumps({'trace_id': trace_id, 'task_id': task_id, 'stage': stage,
+                      'start': round(start, 6), 'duration_ms': round(duration * 1000, 3)}))
+
 def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify API key authentication"""
     if credentials.credentials != SERVER_B_CONFIG['api_key']:
@@ -55,78 +318,142 @@ def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)
         )
     return credentials.credentials
 
+def result_members(task_id: str, manifest: Dict) -> List[tuple]:
+    """(path, arcname) pairs that make up a task's results ZIP"""
+    results_dir = SERVER_B_CONFIG['results_dir'] / task_id
+    members = [(results_dir / file_info['filename'], file_info['filename']) for file_info in manifest['files']]
+    members.append((results_dir / f"{task_id}_manifest.json", f"{task_id}_manifest.json"))
+    return members
+
+def stream_results_zip(task_id: str, manifest: Dict):
+    """Stream the results ZIP and record how long packaging took"""
+    start = time.time()
+    yield from iter_zip(result_members(task_id, manifest))
+    record_stage(task_id, 'packaging_stream', start, time.time())
+
+def abandon_cancelled_task(task_id: str, stage: str):
+    """Called by the processing thread once it sees a cancellation: remove the task's files and record it"""
+    remove_task_files(task_id)
+    info = task_status.get(task_id, {})
+    cancelled_at = info.get('timings', {}).get('cancelled_at')
+    if cancelled_at:
+        record_stage(task_id, 'cancel', cancelled_at, time.time())
+    cancel_stats.record(stage, info.get('timings', {}))
+    print(f"任務 {task_id} 已取消 ({stage})")
+
 def simulate_processing(task_id: str, input_file_path: Path):
     """
     Simulate the actual processing that Server B would do
     Replace this with your actual processing logic
+
+    Real processing should check cancel_event between steps (or wait on it) and
+    call abandon_cancelled_task when it is set. input_file_path is a blob that other
+    tasks with the same content share, so it must not be modified or moved.
     """
+    cancel_event = cancel_events.setdefault(task_id, threading.Event())
+    try:
+        process_task(task_id, input_file_path, cancel_event)
+    finally:
+        cancel_events.pop(task_id, None)
+
+def process_task(task_id: str, input_file_path: Path, cancel_event: threading.Event):
+    """Mock processing steps with cancellation checks in between"""
     print(f"開始處理任務 {task_id}...")
     
-    # Update task status
-    task_status[task_id] = {
+    # Stage timestamps (epoch seconds) are returned to the caller in the status response
+    previous = task_status.get(task_id, {})
+    timings = dict(previous.get('timings', {}))
+    timings['started_at'] = time.time()
+    if 'received_at' in timings:
+        record_stage(task_id, 'queue', timings['received_at'], timings['started_at'])
+    
+    # Update task status (keeping input_file so that cleanup can find it)
+    if not set_task_status(task_id, {
         'status': 'processing',
         'message': 'Processing started',
-        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
-    }
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'input_file': previous.get('input_file'),
+        'input_sha256': previous.get('input_sha256'),
+        'trace_id': previous.get('trace_id'),
+        'timings': timings
+    }, unless_cancelled=True):
+        abandon_cancelled_task(task_id, 'received')
+        return
     
-    # Simulate processing time (replace with actual processing)
-    time.sleep(5)
+    # Simulate processing time (replace with actual processing); returns early when cancelled
+    if cancel_event.wait(SERVER_B_CONFIG['mock_processing_seconds']):
+        abandon_cancelled_task(task_id, 'processing')
+        return
+    timings['processed_at'] = time.time()
+    record_stage(task_id, 'processing', timings['started_at'], timings['processed_at'])
     
     # Create mock results
     results_dir = SERVER_B_CONFIG['results_dir'] / task_id
     results_dir.mkdir(exist_ok=True)
     
-    # Generate mock output files
+    # Generate mock output files (one PNG/GDS pair per result)
     output_files = []
+    result_count = max(1, SERVER_B_CONFIG['mock_result_count'])
+    padding = 'x' * SERVER_B_CONFIG['mock_file_bytes']
     
-    # Create a mock PNG file
-    png_file = results_dir / f"{task_id}_output.png"
-    with open(png_file, 'w') as f:
-        f.write(f"Mock PNG content for task {task_id}")
-    output_files.append({
-        'filename': png_file.name,
-        'type': 'png',
-        'description': 'Generated layout image'
-    })
-    
-    # Create a mock GDS file
-    gds_file = results_dir / f"{task_id}_layout.gds"
-    with open(gds_file, 'w') as f:
-        f.write(f"Mock GDS content for task {task_id}")
-    output_files.append({
-        'filename': gds_file.name,
-        'type': 'gds',
-        'description': 'Generated layout file'
-    })
+    for i in range(1, result_count + 1):
+        suffix = '' if result_count == 1 else f"_{i:03d}"
+        
+        # Create a mock PNG file
+        png_file = results_dir / f"{task_id}_output{suffix}.png"
+        with open(png_file, 'w') as f:
+            f.write(f"Mock PNG content for task {task_id}{padding}")
+        output_files.append({
+            'filename': png_file.name,
+            'type': 'png',
+            'description': 'Generated layout image'
+        })
+        
+        # Create a mock GDS file
+        gds_file = results_dir / f"{task_id}_layout{suffix}.gds"
+        with open(gds_file, 'w') as f:
+            f.write(f"Mock GDS content for task {task_id}{padding}")
+        output_files.append({
+            'filename': gds_file.name,
+            'type': 'gds',
+            'description': 'Generated layout file'
+        })
     
     # Create manifest
     manifest = {
         'task_id': task_id,
         'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
         'files': output_files,
-        'total_count': len(output_files)
+        'total_count': len(output_files),
+        # Per-violation coordinates from the model output (used to merge tiled jobs)
+        'violations': read_violations(input_file_path)
     }
     
     manifest_file = results_dir / f"{task_id}_manifest.json"
     with open(manifest_file, 'w', encoding='utf-8') as f:
         json.dump(manifest, f, ensure_ascii=False, indent=2)
     
-    # Create ZIP file with all results
+    # In "stream" mode the ZIP is built while it is downloaded; in "file" mode it is written now
     zip_file = SERVER_B_CONFIG['results_dir'] / f"{task_id}_results.zip"
-    with zipfile.ZipFile(zip_file, 'w') as zf:
-        for file_info in output_files:
-            file_path = results_dir / file_info['filename']
-            zf.write(file_path, file_info['filename'])
-        zf.write(manifest_file, manifest_file.name)
+    if PACKAGING_CONFIG['mode'] == 'file':
+        write_zip(result_members(task_id, manifest), zip_file)
+    timings['completed_at'] = time.time()
+    record_stage(task_id, 'packaging', timings['processed_at'], timings['completed_at'])
     
     # Update task status to completed
-    task_status[task_id] = {
+    if not set_task_status(task_id, {
         'status': 'completed',
         'message': 'Processing completed successfully',
         'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
         'manifest': manifest,
-        'zip_file': zip_file.name
-    }
+        'zip_file': zip_file.name,
+        'input_file': previous.get('input_file'),
+        'input_sha256': previous.get('input_sha256'),
+        'trace_id': previous.get('trace_id'),
+        'timings': timings
+    }, unless_cancelled=True):
+        abandon_cancelled_task(task_id, 'packaging')
+        return
     
     print(f"任務 {task_id} 處理完成")
 
@@ -137,58 +464,167 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (active and queued task counts are used by the main system for load-based routing)"""
+    statuses = [t['status'] for t in list(task_status.values())]
+    executor = processing_executor.stats()
     return {
         "status": "healthy",
         "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
-        "active_tasks": len([t for t in task_status.values() if t['status'] == 'processing'])
+        "active_tasks": statuses.count('processing'),
+        "queued_tasks": statuses.count('received'),
+        "processing_workers": executor['workers'],
+        "oldest_queued_seconds": executor['oldest_queued_seconds'],
+        # Workers that download results over FTPS need "file" (stream mode never writes the ZIP)
+        "packaging_mode": PACKAGING_CONFIG['mode']
     }
 
+@app.get("/api/v1/executor")
+async def get_executor(
+    api_key: str = Depends(verify_api_key)
+):
+    """Processing executor size, busy threads and queued tasks"""
+    return processing_executor.stats()
+
+@app.post("/api/v1/executor")
+async def resize_executor(
+    workers: int = Form(..., ge=0),
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Change how many tasks are processed at once (0 = unbounded)
+
+    Used by the autoscaler on the AI server. Shrinking lets running tasks finish;
+    the surplus threads exit afterwards.
+    """
+    previous = processing_executor.stats()['workers']
+    processing_executor.resize(workers)
+    if workers != previous:
+        print(f"Processing executor resized: {previous} -> {workers}")
+    return processing_executor.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms and task counts by status"""
+    lines = stage_histograms.render("drc_server_b_stage_duration_seconds", "Per-stage latency on Server B")
+    counts: Dict[str, int] = {}
+    for info in list(task_status.values()):
+        counts[info['status']] = counts.get(info['status'], 0) + 1
+    lines += ["# HELP drc_server_b_tasks Tasks known to Server B by status", "# TYPE drc_server_b_tasks gauge"]
+    lines += [f'drc_server_b_tasks{{status="{name}"}} {count}' for name, count in sorted(counts.items())]
+    lines += cancel_stats.render()
+    lines += blob_store.render()
+    executor = processing_executor.stats()
+    lines += ["# HELP drc_server_b_processing_workers Tasks processed at once (0 = unbounded)",
+              "# TYPE drc_server_b_processing_workers gauge",
+              f"drc_server_b_processing_workers {executor['workers']}",
+              "# HELP drc_server_b_processing_busy Executor threads processing a task",
+              "# TYPE drc_server_b_processing_busy gauge",
+              f"drc_server_b_processing_busy {executor['busy']}",
+              "# HELP drc_server_b_processing_queued Tasks waiting for an executor thread",
+              "# TYPE drc_server_b_processing_queued gauge",
+              f"drc_server_b_processing_queued {executor['queued']}",
+              "# HELP drc_server_b_processing_resizes_total Executor size changes",
+              "# TYPE drc_server_b_processing_resizes_total counter",
+              f"drc_server_b_processing_resizes_total {executor['resizes']}"]
+    return "\n".join(lines) + "\n"
+
+@app.get("/api/v1/blobs/{sha256}")
+async def get_blob_info(
+    sha256: str,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Whether an input with this SHA-256 is already stored (404 if not)
+    """
+    if not is_digest(sha256):
+        raise HTTPException(status_code=400, detail="sha256 must be 64 lowercase hex characters")
+    try:
+        size = (await run_io(blob_store.path(sha256).stat)).st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    return {"sha256": sha256, "size": size}
+
 @app.post("/api/v1/upload")
 async def upload_file(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
     task_id: str = Form(...),
     timestamp: Optional[str] = Form(None),
+    sha256: Optional[str] = Form(None),
+    filename: Optional[str] = Form(None),
+    encoding: Optional[str] = Form(None),
+    x_trace_id: Optional[str] = Header(None),
     api_key: str = Depends(verify_api_key)
 ):
     """
     Receive file upload from AI server
+
+    Upload by hash: with sha256 and no file, the task uses the input already stored
+    under that hash, or the request fails with 404 "Blob not found" and the client
+    sends the file. A file sent together with sha256 must match it.
+
+    With encoding=gzip or encoding=zstd the file is compressed; it is decompressed
+    while being stored, and sha256 refers to the uncompressed content.
     """
     try:
-        print(f"收到上傳請求: {file.filename} (Task ID: {task_id})")
+        received_at = time.time()
+        if sha256 is not None and not is_digest(sha256):
+            raise HTTPException(status_code=400, detail="sha256 must be 64 lowercase hex characters")
+        if file is None and sha256 is None:
+            raise HTTPException(status_code=400, detail="Either file or sha256 is required")
+        filename = file.filename if file is not None else (filename or 'input')
+        print(f"收到上傳請求: {filename} (Task ID: {task_id}, Trace ID: {x_trace_id}, "
+              f"{'完整檔案' if file is not None else 'hash ' + sha256[:12]})")
         
-        # Save uploaded file
-        upload_path = SERVER_B_CONFIG['upload_dir'] / f"{task_id}_{file.filename}"
+        # Store the input by content hash (identical inputs share one file)
+        if file is None:
+            size = await run_io(blob_store.acquire, sha256, task_id)
+            if size is None:
+                raise HTTPException(status_code=404, detail="Blob not found")
+            digest = sha256
+        else:
+            try:
+                digest, size = await run_io(blob_store.add_file, file.file, task_id, sha256, encoding)
+            except (BlobMismatch, CorruptUpload) as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except UnsupportedEncoding as e:
+                raise HTTPException(status_code=415, detail=str(e))
+            except UploadTooLarge as e:
+                raise HTTPException(status_code=413, detail=str(e))
+        upload_path = blob_store.path(digest)
         
-        with open(upload_path, 'wb') as f:
-            content = await file.read()
-            f.write(content)
+        # A task re-uploaded with different content no longer needs its previous input
+        previous_sha256 = task_status.get(task_id, {}).get('input_sha256')
+        if previous_sha256 and previous_sha256 != digest:
+            await run_io(blob_store.release, previous_sha256, task_id)
         
         # Initialize task status
-        task_status[task_id] = {
+        set_task_status(task_id, {
             'status': 'received',
             'message': 'File uploaded successfully, queued for processing',
             'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-            'input_file': str(upload_path)
-        }
+            'input_file': str(upload_path),
+            'input_sha256': digest,
+            'trace_id': x_trace_id,
+            'timings': {'received_at': received_at}
+        })
+        record_stage(task_id, 'upload', received_at, time.time())
         
-        # Start processing in background (in production, use proper task queue)
-        import threading
-        processing_thread = threading.Thread(
-            target=simulate_processing,
-            args=(task_id, upload_path)
-        )
-        processing_thread.daemon = True
-        processing_thread.start()
+        # Queue processing on the executor (it starts as soon as a worker thread is free)
+        cancel_events[task_id] = threading.Event()
+        processing_executor.submit(simulate_processing, task_id, upload_path)
         
         return {
             "success": True,
             "message": "File uploaded and processing started",
             "task_id": task_id,
-            "filename": file.filename,
-            "size": len(content)
+            "filename": filename,
+            "size": size,
+            "sha256": digest,
+            "deduplicated": file is None
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"上傳失敗: {e}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
@@ -196,21 +632,26 @@ async def upload_file(
 @app.get("/api/v1/status/{task_id}")
 async def get_task_status(
     task_id: str,
+    wait: float = Query(0, ge=0),
     api_key: str = Depends(verify_api_key)
 ):
     """
     Check task processing status
+
+    With ?wait=N (seconds, capped at SERVER_B_MAX_STATUS_WAIT) this is a long poll:
+    the response is held until the task's status changes or N seconds pass.
+    Finished tasks answer immediately.
     """
     try:
         if task_id not in task_status:
             raise HTTPException(status_code=404, detail="Task not found")
         
-        status_info = task_status[task_id].copy()
+        if wait > 0 and task_status[task_id]['status'] not in TERMINAL_STATUSES:
+            await status_watchers.wait(task_id, min(wait, SERVER_B_CONFIG['max_status_wait']))
+            if task_id not in task_status:
+                raise HTTPException(status_code=404, detail="Task not found")
         
-        # Remove internal fields
-        status_info.pop('input_file', None)
-        
-        return status_info
+        return public_status(task_status[task_id])
         
     except HTTPException:
         raise
@@ -218,6 +659,44 @@ async def get_task_status(
         print(f"檢查狀態失敗: {e}")
         raise HTTPException(status_code=500, detail=f"Status check failed: {str(e)}")
 
+async def status_event_stream(task_id: str):
+    """Yield an SSE event for every status change until the task finishes or is deleted"""
+    last = None
+    while True:
+        info = task_status.get(task_id)
+        if info is None:
+            yield "event: deleted\ndata: {}\n\n"
+            return
+        if info is not last:
+            last = info
+            yield f"event: status\ndata: {json.dumps(public_status(info), ensure_ascii=False)}\n\n"
+            if info['status'] in TERMINAL_STATUSES:
+                return
+            # Re-check before waiting: the status may have changed while the event was sent
+            continue
+        if not await status_watchers.wait(task_id, SERVER_B_CONFIG['sse_keepalive']):
+            yield ": keep-alive\n\n"
+
+@app.get("/api/v1/status/{task_id}/events")
+async def stream_task_status(
+    task_id: str,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Server-Sent Events stream of status changes
+
+    Sends the current status first, then one "status" event per transition, and
+    closes after the task completes or fails.
+    """
+    if task_id not in task_status:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    return StreamingResponse(
+        status_event_stream(task_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.get("/api/v1/download/{task_id}")
 async def download_results(
     task_id: str,
@@ -237,13 +716,21 @@ async def download_results(
         
         zip_file_path = SERVER_B_CONFIG['results_dir'] / status_info['zip_file']
         
-        if not zip_file_path.exists():
+        if await run_io(zip_file_path.is_file):
+            return FileResponse(
+                path=zip_file_path,
+                filename=status_info['zip_file'],
+                media_type='application/zip'
+            )
+        
+        # No prebuilt ZIP: compress the result files in parallel while streaming the response
+        if not await run_io((SERVER_B_CONFIG['results_dir'] / task_id).is_dir):
             raise HTTPException(status_code=404, detail="Result file not found")
         
-        return FileResponse(
-            path=zip_file_path,
-            filename=status_info['zip_file'],
-            media_type='application/zip'
+        return StreamingResponse(
+            stream_results_zip(task_id, status_info['manifest']),
+            media_type='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{status_info["zip_file"]}"'}
         )
         
     except HTTPException:
@@ -252,6 +739,51 @@ async def download_results(
         print(f"下載失敗: {e}")
         raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
 
+@app.post("/api/v1/cancel/{task_id}")
+async def cancel_task(
+    task_id: str,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Cancel a task that has not finished yet
+
+    The status becomes "cancelled" immediately (waking long-poll and SSE waiters); the
+    processing thread stops at its next check and removes the task's files.
+    """
+    try:
+        with status_lock:
+            if task_id not in task_status:
+                raise HTTPException(status_code=404, detail="Task not found")
+            info = task_status[task_id]
+            if info['status'] in TERMINAL_STATUSES:
+                return {"success": False, "task_id": task_id, "status": info['status'],
+                        "message": f"Task already {info['status']}"}
+            timings = dict(info.get('timings', {}))
+            timings['cancelled_at'] = time.time()
+            task_status[task_id] = {
+                **info,
+                'status': 'cancelled',
+                'message': 'Task cancelled',
+                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'timings': timings
+            }
+        status_watchers.notify(task_id)
+        
+        event = cancel_events.get(task_id)
+        if event is not None:
+            event.set()
+        else:
+            # No processing thread (e.g. it already exited): clean up here
+            await run_io(abandon_cancelled_task, task_id, info['status'])
+        
+        return {"success": True, "task_id": task_id, "status": "cancelled", "message": "Task cancelled"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"取消任務失敗: {e}")
+        raise HTTPException(status_code=500, detail=f"Cancel task failed: {str(e)}")
+
 @app.get("/api/v1/tasks")
 async def list_tasks(
     api_key: str = Depends(verify_api_key)
@@ -281,19 +813,12 @@ async def delete_task(
         if task_id not in task_status:
             raise HTTPException(status_code=404, detail="Task not found")
         
-        # Clean up files
-        task_results_dir = SERVER_B_CONFIG['results_dir'] / task_id
-        if task_results_dir.exists():
-            import shutil
-            shutil.rmtree(task_results_dir)
-        
-        # Remove ZIP file
-        zip_file = SERVER_B_CONFIG['results_dir'] / f"{task_id}_results.zip"
-        if zip_file.exists():
-            zip_file.unlink()
+        # Clean up files (results, ZIP and uploaded input)
+        await run_io(remove_task_files, task_id)
         
         # Remove from status
         del task_status[task_id]
+        status_watchers.notify(task_id)
         
         return {"success": True, "message": f"Task {task_id} deleted successfully"}
         
@@ -0,0 +1,31 @@
+"""
+Violations reported by the AI model, carried into the result manifest
+
+The model output uploaded by the AI server has one line per violation:
+    VIOLATION {"rule": "width", "x": ..., "y": ..., "bbox": [x0, y0, x1, y1]}
+with absolute layout coordinates. They are copied into the manifest's
+"violations" list, which the AI server uses to drop duplicates found in the
+halo of neighbouring tiles when it merges a tiled job.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List
+
+VIOLATION_PREFIX = 'VIOLATION '
+
+
+def read_violations(path: Path) -> List[Dict]:
+    """Violations listed in a model output file; malformed lines are skipped"""
+    violations = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.startswith(VIOLATION_PREFIX):
+                continue
+            try:
+                violation = json.loads(line[len(VIOLATION_PREFIX):])
+            except ValueError:
+                continue
+            if isinstance(violation, dict) and ('bbox' in violation or ('x' in violation and 'y' in violation)):
+                violations.append(violation)
+    return violations
@@ -0,0 +1,143 @@
+"""
+Event loop 安全的檔案 I/O
+
+FastAPI 的 async handler 直接呼叫 open().write()、Path.read_text()、Path.exists()
+時會卡住整個 event loop，同時間所有 WebSocket 與其他請求都要等它完成。
+此模組將這些阻塞的磁碟操作交給一個有上限的 thread pool 執行：
+
+  - run_io(func, *args)：在 I/O thread pool 中執行任意阻塞函式
+  - StaticAssetCache：index.html 等靜態檔案常駐記憶體，附 ETag，並預先壓縮成
+    gzip 與 brotli (有安裝 brotli 套件時)，依 Accept-Encoding 回傳
+
+下載大型結果檔仍使用 Starlette 的 FileResponse；ASGI server 支援 pathsend 擴充時
+會直接以 sendfile 傳送，否則以 thread pool 分段讀取，不會阻塞 event loop。
+"""
+
+import os
+import gzip
+import time
+import asyncio
+import hashlib
+import functools
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli 為選用套件，未安裝時只提供 gzip
+    brotli = None
+
+IO_CONFIG = {
+    # I/O thread pool 的大小，限制同時進行的磁碟操作數量
+    'max_workers': int(os.getenv('ASYNC_IO_WORKERS', '8')),
+    # 靜態檔案每隔幾秒檢查一次 mtime，有變更時重新載入
+    'asset_recheck_seconds': float(os.getenv('ASSET_RECHECK_SECONDS', '2')),
+}
+
+_executor = ThreadPoolExecutor(max_workers=IO_CONFIG['max_workers'], thread_name_prefix="drc-io")
+
+
+async def run_io(func, *args, **kwargs):
+    """在有上限的 I/O thread pool 中執行阻塞函式"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+class _Asset:
+    def __init__(self, path: Path, mtime: float, body: bytes):
+        self.path = path
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+        self.media_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        if self.media_type.startswith('text/'):
+            self.media_type += '; charset=utf-8'
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies: Dict[Optional[str], bytes] = {None: body}
+        # 太小的檔案壓縮後反而變大，只保留原始內容
+        if len(body) >= 512:
+            self.bodies['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body, quality=11)
+
+    def etag(self, encoding: Optional[str]) -> str:
+        # 不同壓縮格式的內容位元組不同，ETag 也要不同
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+
+def _load_asset(path: Path) -> Optional[_Asset]:
+    try:
+        mtime = path.stat().st_mtime
+        return _Asset(path, mtime, path.read_bytes())
+    except FileNotFoundError:
+        return None
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set:
+    """解析 Accept-Encoding，回傳可接受的編碼名稱 (忽略 q=0 的項目)"""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if name.strip():
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def _choose_encoding(accept_encoding: Optional[str], available) -> Optional[str]:
+    """依 Accept-Encoding 選擇壓縮格式 (brotli 優先)"""
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in ('br', 'gzip'):
+        if encoding in available and (encoding in accepted or '*' in accepted):
+            return encoding
+    return None
+
+
+class StaticAssetCache:
+    """常駐記憶體的靜態檔案快取，回應附 ETag 與預先壓縮的內容"""
+
+    def __init__(self, recheck_seconds: Optional[float] = None):
+        self.recheck_seconds = IO_CONFIG['asset_recheck_seconds'] if recheck_seconds is None else recheck_seconds
+        self._assets: Dict[Path, _Asset] = {}
+
+    async def get(self, path: Path) -> Optional[_Asset]:
+        asset = self._assets.get(path)
+        if asset is not None and time.monotonic() - asset.checked_at < self.recheck_seconds:
+            return asset
+        if asset is not None:
+            try:
+                mtime = (await run_io(path.stat)).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            if mtime == asset.mtime:
+                asset.checked_at = time.monotonic()
+                return asset
+        asset = await run_io(_load_asset, path)
+        if asset is None:
+            self._assets.pop(path, None)
+        else:
+            self._assets[path] = asset
+        return asset
+
+    async def response(self, request, path: Path):
+        """回傳 Response；檔案不存在時回傳 None，由呼叫端決定 404 內容"""
+        asset = await self.get(path)
+        if asset is None:
+            return None
+        encoding = _choose_encoding(request.headers.get('accept-encoding'), asset.bodies)
+        headers = {'ETag': asset.etag(encoding), 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if_none_match = request.headers.get('if-none-match', '')
+        if asset.etag(encoding) in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return Response(content=asset.bodies[encoding], media_type=asset.media_type, headers=headers)
@@ -0,0 +1,296 @@
+"""
+依佇列深度自動調整 Celery worker 與 Server B executor 的大小
+
+worker 的行程數原本在啟動時就固定，只能以尖峰負載配置或在尖峰時排隊。這個控制器
+每 AUTOSCALE_INTERVAL 秒讀取：
+  - 各 lane 的 Celery 佇列深度與最舊訊息的等待時間 (scheduling.get_lane_stats)
+  - 每個 Celery worker 的 pool 大小、執行中與已預取的任務 (celery inspect)
+  - 每台 Server B 的 executor 大小、處理中與排隊的任務 (/health)
+再以 ScalingPolicy 決定新的大小，透過 pool_grow / pool_shrink 調整 Celery prefork pool，
+透過 POST /api/v1/executor 調整 Server B executor。
+
+hysteresis：
+  - 擴充：有工作在等待、需求 (執行中 + 等待中) 超過目前大小，而且最舊的工作已等待
+    AUTOSCALE_UP_WAIT 秒以上或等待數達到目前大小的 AUTOSCALE_UP_BACKLOG_RATIO 倍；
+    直接擴充到需求 (每次最多 AUTOSCALE_MAX_STEP)
+  - 縮減：連續 AUTOSCALE_DOWN_ROUNDS 次評估的需求都低於目前大小，而且距離上次調整已超過
+    AUTOSCALE_DOWN_COOLDOWN 秒，才縮到這段期間的最高需求
+  - 大小一律限制在 AUTOSCALE_CELERY_MIN/MAX、AUTOSCALE_SERVER_B_MIN/MAX 之間
+
+每次評估的結果寫入 Redis (drc:autoscale:*)，由 main.py 的 /metrics 輸出；調整時另外印出一行 JSON log。
+同時只有一個控制器生效 (Redis 上的 leader key)，可以多啟動幾個作為備援：
+    python autoscaler.py
+Celery worker 需使用 prefork pool，且不要同時加上 --autoscale (兩者會互相覆蓋)。
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from scheduling import LANES, get_lane_stats
+from server_b_pool import parse_urls
+
+AUTOSCALE_CONFIG = {
+    'interval': float(os.getenv('AUTOSCALE_INTERVAL', '10')),
+    # 每個 Celery worker 的 prefork 行程數範圍
+    'celery_min': int(os.getenv('AUTOSCALE_CELERY_MIN', '1')),
+    'celery_max': int(os.getenv('AUTOSCALE_CELERY_MAX', '8')),
+    # 每台 Server B 同時處理的任務數範圍
+    'server_b_min': int(os.getenv('AUTOSCALE_SERVER_B_MIN', '1')),
+    'server_b_max': int(os.getenv('AUTOSCALE_SERVER_B_MAX', '8')),
+    'up_wait_seconds': float(os.getenv('AUTOSCALE_UP_WAIT', '15')),
+    'up_backlog_ratio': float(os.getenv('AUTOSCALE_UP_BACKLOG_RATIO', '1')),
+    'down_rounds': int(os.getenv('AUTOSCALE_DOWN_ROUNDS', '6')),
+    'down_cooldown_seconds': float(os.getenv('AUTOSCALE_DOWN_COOLDOWN', '120')),
+    'max_step': int(os.getenv('AUTOSCALE_MAX_STEP', '4')),
+    'inspect_timeout': float(os.getenv('AUTOSCALE_INSPECT_TIMEOUT', '2')),
+    'server_b_urls': parse_urls(os.getenv('API_SERVER_B_URLS', '')) or parse_urls(
+        os.getenv('API_SERVER_B_URL', 'http://your-server-b-hostname:8001')),
+    'server_b_key': os.getenv('API_SERVER_B_KEY', 'your-api-key'),
+    'key_prefix': os.getenv('AUTOSCALE_KEY_PREFIX', 'drc:autoscale'),
+}
+
+
+def _key(name: str) -> str:
+    return f"{AUTOSCALE_CONFIG['key_prefix']}:{name}"
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class ScalingPolicy:
+    """單一資源 (一個 Celery worker 的 pool 或一台 Server B 的 executor) 的擴縮決策"""
+
+    def __init__(self, minimum: int, maximum: int, config: Optional[Dict] = None):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.config = config or AUTOSCALE_CONFIG
+        self.last_change = float('-inf')
+        # 需求連續低於目前大小的評估次數，以及這段期間的最高需求
+        self.low_rounds = 0
+        self.low_peak = 0
+
+    def decide(self, current: int, busy: int, backlog: int, oldest_age: float, now: float) -> Tuple[int, str]:
+        """回傳 (新的大小, 'up' / 'down' / 'hold')"""
+        config = self.config
+        demand = busy + backlog
+        target = current
+        if current < self.minimum or current > self.maximum:
+            # 超出範圍 (包括沒有上限的 Server B executor，current 為 0) 時先拉回範圍內
+            target = min(self.maximum, max(self.minimum, current, busy))
+        elif backlog > 0 and demand > current and (
+                oldest_age >= config['up_wait_seconds'] or backlog >= config['up_backlog_ratio'] * max(current, 1)):
+            target = min(self.maximum, demand, current + config['max_step'])
+        elif demand < current:
+            self.low_rounds += 1
+            self.low_peak = max(self.low_peak, demand)
+            if self.low_rounds >= config['down_rounds'] and now - self.last_change >= config['down_cooldown_seconds']:
+                target = max(self.minimum, self.low_peak, current - config['max_step'])
+        else:
+            self.low_rounds = 0
+            self.low_peak = 0
+
+        if target == current:
+            return current, 'hold'
+        self.last_change = now
+        self.low_rounds = 0
+        self.low_peak = 0
+        return target, 'up' if target > current else 'down'
+
+
+class Autoscaler:
+    """定期評估並調整所有 Celery worker 與 Server B 的大小"""
+
+    def __init__(self, redis_client, celery_app, server_b_urls: List[str], dry_run: bool = False):
+        self.redis = redis_client
+        self.celery_app = celery_app
+        self.server_b_urls = server_b_urls
+        self.dry_run = dry_run
+        self.policies: Dict[str, ScalingPolicy] = {}
+        self.node_id = f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    def _policy(self, resource: str, kind: str) -> ScalingPolicy:
+        if resource not in self.policies:
+            self.policies[resource] = ScalingPolicy(AUTOSCALE_CONFIG[f'{kind}_min'], AUTOSCALE_CONFIG[f'{kind}_max'])
+        return self.policies[resource]
+
+    # --- 讀取狀態 ---
+
+    def _inspect_workers(self) -> Dict[str, Dict]:
+        """每個 prefork worker 的 pool 大小、執行中與已預取的任務數，以及消費的 lane"""
+        inspect = self.celery_app.control.inspect(timeout=AUTOSCALE_CONFIG['inspect_timeout'])
+        stats = inspect.stats() or {}
+        active = inspect.active() or {}
+        reserved = inspect.reserved() or {}
+        queues = inspect.active_queues() or {}
+        workers = {}
+        for name, info in stats.items():
+            processes = info.get('pool', {}).get('processes')
+            if processes is None:
+                # 只有 prefork pool 支援 pool_grow / pool_shrink
+                continue
+            workers[name] = {
+                'current': len(processes),
+                'busy': len(active.get(name, [])),
+                'reserved': len(reserved.get(name, [])),
+                'lanes': [q['name'] for q in queues.get(name, []) if q.get('name') in LANES],
+            }
+        return workers
+
+    def _server_b_health(self, url: str) -> Optional[Dict]:
+        try:
+            response = requests.get(f"{url}/health", timeout=AUTOSCALE_CONFIG['inspect_timeout'])
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Autoscaler 無法取得 Server B 狀態 ({url}): {e}")
+            return None
+
+    # --- 調整 ---
+
+    def _resize_celery(self, name: str, current: int, target: int):
+        control = self.celery_app.control
+        resize = control.pool_grow if target > current else control.pool_shrink
+        replies = resize(abs(target - current), destination=[name], reply=True,
+                         timeout=AUTOSCALE_CONFIG['inspect_timeout'])
+        for reply in replies or []:
+            result = reply.get(name, {})
+            if 'error' in result:
+                raise RuntimeError(result['error'])
+
+    def _resize_server_b(self, url: str, target: int):
+        response = requests.post(f"{url}/api/v1/executor", data={'workers': target},
+                                 headers={'Authorization': f"Bearer {AUTOSCALE_CONFIG['server_b_key']}"},
+                                 timeout=AUTOSCALE_CONFIG['inspect_timeout'])
+        response.raise_for_status()
+
+    async def _apply(self, kind: str, resource: str, snapshot: Dict, now: float) -> Dict:
+        """以 policy 評估單一資源，需要時調整大小；回傳寫入 Redis 的狀態"""
+        policy = self._policy(resource, kind)
+        target, direction = policy.decide(snapshot['current'], snapshot['busy'], snapshot['backlog'],
+                                          snapshot['oldest_age'], now)
+        if direction != 'hold':
+            print(json.dumps({'autoscale': kind, 'resource': resource, 'direction': direction,
+                              'from': snapshot['current'], 'to': target, 'busy': snapshot['busy'],
+                              'backlog': snapshot['backlog'], 'oldest_age': round(snapshot['oldest_age'], 1),
+                              'dry_run': self.dry_run}, ensure_ascii=False))
+        if direction != 'hold' and not self.dry_run:
+            try:
+                if kind == 'celery':
+                    await asyncio.to_thread(self._resize_celery, resource, snapshot['current'], target)
+                else:
+                    await asyncio.to_thread(self._resize_server_b, resource, target)
+            except Exception as e:
+                print(f"Autoscaler 調整 {resource} 失敗: {e}")
+                direction = 'failed'
+                target = snapshot['current']
+        return {'kind': kind, 'resource': resource, 'direction': direction, 'size': target,
+                'demand': snapshot['busy'] + snapshot['backlog'], **snapshot}
+
+    async def _celery_snapshots(self) -> Dict[str, Dict]:
+        lane_stats = await get_lane_stats(self.redis)
+        workers = await asyncio.to_thread(self._inspect_workers)
+        # 同一條 lane 的等待工作由消費它的 worker 平均分擔
+        consumers = {lane: sum(1 for w in workers.values() if lane in w['lanes']) for lane in LANES}
+        snapshots = {}
+        for name, worker in workers.items():
+            backlog = worker['reserved'] + sum(-(-lane_stats[lane]['depth'] // consumers[lane])
+                                               for lane in worker['lanes'])
+            oldest = max([lane_stats[lane]['oldest_age_seconds'] for lane in worker['lanes']] or [0.0])
+            snapshots[name] = {'current': worker['current'], 'busy': worker['busy'],
+                               'backlog': backlog, 'oldest_age': oldest}
+        return snapshots
+
+    async def _server_b_snapshots(self) -> Dict[str, Dict]:
+        healths = await asyncio.gather(*(asyncio.to_thread(self._server_b_health, url) for url in self.server_b_urls))
+        snapshots = {}
+        for url, health in zip(self.server_b_urls, healths):
+            if not health or 'processing_workers' not in health:
+                continue
+            # processing_workers 為 0 代表 executor 沒有上限，第一次評估時就會被限制在範圍內
+            snapshots[url] = {'current': health['processing_workers'], 'busy': health['active_tasks'],
+                              'backlog': health['queued_tasks'],
+                              'oldest_age': health.get('oldest_queued_seconds', 0.0)}
+        return snapshots
+
+    async def _is_leader(self) -> bool:
+        ttl = max(1, int(3 * AUTOSCALE_CONFIG['interval']))
+        if await self.redis.set(_key('leader'), self.node_id, nx=True, ex=ttl):
+            return True
+        if _decode(await self.redis.get(_key('leader'))) == self.node_id:
+            await self.redis.expire(_key('leader'), ttl)
+            return True
+        return False
+
+    async def tick(self) -> List[Dict]:
+        """評估一次所有資源；不是 leader 時不做任何事"""
+        if not await self._is_leader():
+            return []
+        now = time.time()
+        results = []
+        for kind, snapshots in (('celery', await self._celery_snapshots()),
+                                ('server_b', await self._server_b_snapshots())):
+            for resource, snapshot in snapshots.items():
+                results.append(await self._apply(kind, resource, snapshot, now))
+        await self._record(results)
+        return results
+
+    async def _record(self, results: List[Dict]):
+        pipe = self.redis.pipeline()
+        for result in results:
+            pipe.hincrby(_key('decisions'), f"{result['kind']}:{result['direction']}", 1)
+        pipe.set(_key('state'), json.dumps({'updated_at': time.time(), 'resources': results}),
+                 ex=max(1, int(3 * AUTOSCALE_CONFIG['interval'])))
+        await pipe.execute()
+
+    async def run(self):
+        print(f"Autoscaler 已啟動 ({self.node_id})，每 {AUTOSCALE_CONFIG['interval']:g} 秒評估一次")
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Autoscaler 評估失敗: {e}")
+            await asyncio.sleep(AUTOSCALE_CONFIG['interval'])
+
+
+async def get_autoscale_stats(redis_client) -> Dict:
+    """最近一次評估的各資源狀態與累計的決策次數 (非同步，供 /metrics 使用)"""
+    raw = await redis_client.get(_key('state'))
+    decisions = await redis_client.hgetall(_key('decisions')) or {}
+    return {
+        'resources': json.loads(raw)['resources'] if raw else [],
+        'decisions': {_decode(k): int(v) for k, v in decisions.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Celery / Server B autoscaler")
+    parser.add_argument('--once', action='store_true', help="只評估一次並印出結果")
+    parser.add_argument('--dry-run', action='store_true', help="只記錄決策，不實際調整")
+    args = parser.parse_args()
+
+    # 只有實際執行控制器時才需要 Celery 與 Redis 連線
+    from celery_app import celery_app
+    from redis_pool import new_async_redis
+
+    autoscaler = Autoscaler(new_async_redis(decode_responses=True), celery_app,
+                            AUTOSCALE_CONFIG['server_b_urls'], dry_run=args.dry_run)
+    if args.once:
+        print(json.dumps(asyncio.run(autoscaler.tick()), indent=2, ensure_ascii=False))
+        return
+    try:
+        asyncio.run(autoscaler.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
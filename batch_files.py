@@ -0,0 +1,123 @@
+"""
+批次結果的摘要與分頁檔案清單
+
+任務完成時推送給前端的訊息只包含批次摘要 (各類型檔案數量、ZIP 與檔案清單的網址)，
+不再內嵌完整的檔案清單。完整清單在結果寫入完成時存成任務目錄下的
+{task_id}_files.json，前端透過 GET /batches/{task_id}/files 分頁讀取：
+
+    ?offset=0&limit=100&type=png
+
+回傳 {"task_id", "total", "offset", "limit", "next_offset", "files": [...]}，
+next_offset 為 null 代表已經是最後一頁。
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from json_codec import dumpb, loads
+from result_store import task_dir, files_index_name, result_url
+
+BATCH_CONFIG = {
+    'page_size': int(os.getenv('BATCH_FILES_PAGE_SIZE', '100')),
+    'max_page_size': int(os.getenv('BATCH_FILES_MAX_PAGE_SIZE', '1000')),
+    # 最近讀取過的檔案清單保留在記憶體中，翻頁時不必重新解析
+    'cache_size': int(os.getenv('BATCH_FILES_CACHE_SIZE', '32')),
+}
+
+
+_TASK_ID_RE = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def files_url(task_id: str) -> str:
+    return f"/batches/{task_id}/files"
+
+
+def batch_summary(batch_results: Dict) -> Dict:
+    """完成訊息中的批次摘要"""
+    counts: Dict[str, int] = {}
+    for file_info in batch_results['files']:
+        counts[file_info['type']] = counts.get(file_info['type'], 0) + 1
+    task_id = batch_results['batch_id']
+    return {
+        'task_id': task_id,
+        'total_count': batch_results['total_count'],
+        'counts': counts,
+        'zip_url': result_url(task_id, batch_results['zip_file']),
+        'files_url': files_url(task_id),
+    }
+
+
+def write_file_index(task_id: str, batch_results: Dict) -> Path:
+    """將完整的檔案清單寫到任務目錄 (由 worker 在結果寫入完成時呼叫)"""
+    path = task_dir(task_id, create=True) / files_index_name(task_id)
+    index = {
+        'task_id': task_id,
+        'total_count': batch_results['total_count'],
+        'files': [{key: f.get(key, '') for key in ('filename', 'type', 'description', 'url')}
+                  for f in batch_results['files']],
+    }
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(dumpb(index))
+    os.replace(tmp, path)
+    return path
+
+
+class _IndexCache:
+    """以 (路徑, mtime, 大小) 為 key 的 LRU，檔案被重寫或刪除後自動失效"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> Optional[Dict]:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        index = loads(path.read_bytes())
+        # 依類型預先分好，翻頁時直接切片
+        by_type: Dict[str, List[Dict]] = {}
+        for file_info in index['files']:
+            by_type.setdefault(file_info['type'], []).append(file_info)
+        entry = {'files': index['files'], 'by_type': by_type}
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+
+_index_cache = _IndexCache(BATCH_CONFIG['cache_size'])
+
+
+def files_page(task_id: str, offset: int = 0, limit: Optional[int] = None,
+               file_type: Optional[str] = None) -> Optional[Dict]:
+    """讀取一頁檔案清單；任務不存在 (或已被清理) 時回傳 None。會讀取磁碟，請在 I/O 執行緒呼叫"""
+    if not _TASK_ID_RE.fullmatch(task_id):
+        return None
+    entry = _index_cache.get(task_dir(task_id) / files_index_name(task_id))
+    if entry is None:
+        return None
+    files = entry['by_type'].get(file_type, []) if file_type else entry['files']
+    limit = max(1, min(limit or BATCH_CONFIG['page_size'], BATCH_CONFIG['max_page_size']))
+    offset = max(0, offset)
+    end = offset + limit
+    return {
+        'task_id': task_id,
+        'total': len(files),
+        'offset': offset,
+        'limit': limit,
+        'next_offset': end if end < len(files) else None,
+        'files': files[offset:end],
+    }
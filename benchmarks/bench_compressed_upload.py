@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+壓縮上傳的 Benchmark：GDS 以 gzip / zstd / zip 上傳，以及傳送到 Server B 時的壓縮
+
+  ingest    以 compressed_io.ingest_upload 存下同一個 --mb MB 的合成 GDS (未壓縮與各種壓縮格式)，
+            記錄上傳大小、解壓縮時間與 Python 配置的記憶體峰值 (tracemalloc)
+  server-b  在本機啟動 Server B，以 tasks.upload_to_server_b 上傳 (API_SERVER_B_UPLOAD_DEDUPE 關閉)，
+            比較 API_SERVER_B_UPLOAD_ENCODING=none / gzip / zstd 實際傳送的位元組數
+            (Server B /metrics 的 drc_server_b_upload_wire_bytes_total) 與在 --wan-mbps 的連線上
+            估計需要的傳送時間
+  bomb      壓縮比極高的 gzip 必須被拒絕，且不留下任何檔案
+
+合成的 GDS 由重複的 BOUNDARY record 組成 (座標隨機)，壓縮比與實際的版圖相近。
+zstd 需要 zstandard 套件，未安裝時略過。用法 (在專案根目錄執行):
+    python -m benchmarks.bench_compressed_upload --mb 256 --wan-mbps 100
+"""
+
+import argparse
+import gzip
+import io
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.bench_upload_dedupe import server_b_metrics  # noqa: E402
+from benchmarks.loadtest import wait_for_http  # noqa: E402
+from compressed_io import COMPRESSION_CONFIG, DecompressionBomb, ingest_upload, zstandard  # noqa: E402
+
+API_KEY = 'bench-compressed-key'
+
+
+def gds_record(kind: int, data_type: int, payload: bytes) -> bytes:
+    return struct.pack('>HBB', len(payload) + 4, kind, data_type) + payload
+
+
+def write_synthetic_gds(path: Path, mb: int, seed: int = 0):
+    """寫出約 mb MB 的 GDS：BOUNDARY (layer、datatype、5 點 XY) 不斷重複"""
+    rng = random.Random(seed)
+    target = mb * 1024 * 1024
+    with open(path, 'wb') as f:
+        f.write(gds_record(0x00, 0x02, struct.pack('>h', 600)))      # HEADER
+        f.write(gds_record(0x06, 0x06, b'TOP\x00'))                  # STRNAME
+        while f.tell() < target:
+            x, y = rng.randrange(0, 1_000_000, 5), rng.randrange(0, 1_000_000, 5)
+            w, h = rng.choice((50, 100, 200)), rng.choice((50, 100, 400))
+            xy = struct.pack('>10i', x, y, x + w, y, x + w, y + h, x, y + h, x, y)
+            f.write(gds_record(0x08, 0x00, b''))                     # BOUNDARY
+            f.write(gds_record(0x0D, 0x02, struct.pack('>h', rng.choice((1, 2, 3)))))  # LAYER
+            f.write(gds_record(0x0E, 0x02, struct.pack('>h', 0)))    # DATATYPE
+            f.write(gds_record(0x10, 0x03, xy))                      # XY
+            f.write(gds_record(0x11, 0x00, b''))                     # ENDEL
+        f.write(gds_record(0x07, 0x00, b''))                         # ENDSTR
+        f.write(gds_record(0x04, 0x00, b''))                         # ENDLIB
+
+
+def compress_as(layout: Path, kind: str, workdir: Path) -> Path:
+    """把 layout 存成指定的上傳格式 (raw 即原檔)"""
+    if kind == 'raw':
+        return layout
+    target = workdir / f"{layout.name}.{kind}"
+    with open(layout, 'rb') as src:
+        if kind == 'gz':
+            with gzip.open(target, 'wb', compresslevel=6) as out:
+                while chunk := src.read(1024 * 1024):
+                    out.write(chunk)
+        elif kind == 'zst':
+            with open(target, 'wb') as out:
+                zstandard.ZstdCompressor(level=3).copy_stream(src, out)
+        else:
+            with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as archive:
+                archive.write(layout, layout.name)
+    return target
+
+
+def run_ingest(layout: Path, workdir: Path) -> bool:
+    print(f"{'format':>8} {'upload MB':>10} {'ingest s':>9} {'MB/s':>8} {'peak MB':>8}")
+    kinds = ['raw', 'gz', 'zip'] + (['zst'] if zstandard is not None else [])
+    ok = True
+    for kind in kinds:
+        upload = compress_as(layout, kind, workdir)
+        dest_dir = workdir / f"ingest_{kind}"
+        dest_dir.mkdir()
+        tracemalloc.start()
+        start = time.perf_counter()
+        with open(upload, 'rb') as src:
+            saved = ingest_upload(src, dest_dir, 'bench', upload.name)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        size_mb = layout.stat().st_size / 1e6
+        print(f"{kind:>8} {upload.stat().st_size / 1e6:>10.1f} {elapsed:>9.2f} {size_mb / elapsed:>8.0f} "
+              f"{peak / 1e6:>8.1f}")
+        if len(saved) != 1 or saved[0].stat().st_size != layout.stat().st_size:
+            print(f"    {kind}: 解壓縮後的檔案與原檔大小不同")
+            ok = False
+        for path in saved:
+            path.unlink()
+    return ok
+
+
+def run_bomb(workdir: Path) -> bool:
+    """解壓縮後超過 ratio_min_bytes 且壓縮比超過上限的 gzip"""
+    bomb = io.BytesIO()
+    zeros = b'\x00' * (1024 * 1024)
+    with gzip.GzipFile(fileobj=bomb, mode='wb', compresslevel=9) as out:
+        for _ in range(COMPRESSION_CONFIG['ratio_min_bytes'] // len(zeros) + 16):
+            out.write(zeros)
+    dest_dir = workdir / "bomb"
+    dest_dir.mkdir()
+    try:
+        ingest_upload(bomb, dest_dir, 'bench', 'bomb.gds.gz')
+        rejected = False
+    except DecompressionBomb as e:
+        rejected = True
+        print(f"\nbomb ({bomb.tell() / 1e3:.0f} KB): {e}")
+    leftovers = list(dest_dir.iterdir())
+    if not rejected or leftovers:
+        print(f"bomb 未被拒絕或留下檔案: rejected={rejected} leftovers={leftovers}")
+    return rejected and not leftovers
+
+
+def start_server_b(args, workdir: Path) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        'SERVER_B_API_KEY': API_KEY,
+        'SERVER_B_MOCK_PROCESSING_SECONDS': '0.1',
+        'SERVER_B_UPLOAD_DIR': str(workdir / "uploads"),
+        'SERVER_B_RESULTS_DIR': str(workdir / "results"),
+        'SERVER_B_PROCESSING_DIR': str(workdir / "processing"),
+    }
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "server_b_api_setup:app",
+                             "--port", str(args.server_b_port), "--log-level", "warning"],
+                            cwd=ROOT / "ServerB_setup", env=env, stdout=subprocess.DEVNULL)
+    wait_for_http(f"http://127.0.0.1:{args.server_b_port}/health")
+    return proc
+
+
+def run_server_b(layout: Path, workdir: Path, args) -> bool:
+    base_url = f"http://127.0.0.1:{args.server_b_port}"
+    os.environ.update({
+        'API_SERVER_B_URL': base_url,
+        'API_SERVER_B_KEY': API_KEY,
+        'API_TIMEOUT': '600',
+    })
+    import tasks  # noqa: E402  (讀取上面的環境變數)
+    tasks.API_SERVER_B['upload_dedupe'] = False
+
+    server_b = start_server_b(args, workdir)
+    ok = True
+    try:
+        digest = tasks.file_sha256(str(layout))
+        print(f"\n{'encoding':>8} {'wire MB':>9} {'ratio':>7} {'upload s':>9} {'WAN est s':>10}")
+        for encoding in ('none', 'gzip') + (('zstd',) if zstandard is not None else ()):
+            tasks.API_SERVER_B['upload_encoding'] = encoding
+            before = server_b_metrics(base_url).get('drc_server_b_upload_wire_bytes_total', 0.0)
+            task_id = f"compressed-{encoding}-{time.time_ns()}"
+            start = time.perf_counter()
+            result = tasks.upload_to_server_b(str(layout), task_id)
+            elapsed = time.perf_counter() - start
+            wire = server_b_metrics(base_url)['drc_server_b_upload_wire_bytes_total'] - before
+            wan = wire * 8 / (args.wan_mbps * 1e6)
+            print(f"{encoding:>8} {wire / 1e6:>9.1f} {layout.stat().st_size / max(wire, 1):>7.1f} "
+                  f"{elapsed:>9.2f} {wan:>10.1f}")
+            # Server B 存下的內容必須與原檔相同 (blob 以解壓縮後內容的 SHA-256 命名)
+            if result.get('sha256') != digest:
+                print(f"    {encoding}: Server B 回報的 sha256 {result.get('sha256')} 與原檔不同")
+                ok = False
+    finally:
+        server_b.terminate()
+        server_b.wait(timeout=10)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed upload benchmark")
+    parser.add_argument('--mb', type=int, default=256, help="合成 GDS 的大小 (MB)")
+    parser.add_argument('--wan-mbps', type=float, default=100.0, help="估計傳送時間用的 WAN 頻寬 (Mbit/s)")
+    parser.add_argument('--server-b-port', type=int, default=18012)
+    parser.add_argument('--skip-server-b', action='store_true', help="只量測 ingest 與 bomb")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="drc_compressed_") as tmp:
+        tmp = Path(tmp)
+        layout = tmp / "layout.gds"
+        write_synthetic_gds(layout, args.mb)
+        ok = run_ingest(layout, tmp)
+        ok = run_bomb(tmp) and ok
+        if not args.skip_server_b:
+            ok = run_server_b(layout, tmp, args) and ok
+    print(f"\n{'OK' if ok else 'FAILED'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+動態批次推論的吞吐量 / 延遲 Benchmark
+
+以 MicroBatcher 包住 MockDRCModel (批次成本 = 固定開銷 + 每筆耗時)，
+由 N 個並行的 client 執行緒持續送出請求 (closed loop，模擬多個 Celery 任務
+同時呼叫常駐推論行程)，比較不同 window / max_batch_size 設定下的
+吞吐量與 p50/p95 延遲。window=0、max_batch=1 即為原本逐筆推論的基準。
+
+用法 (在專案根目錄執行):
+    python -m benchmarks.bench_micro_batching --clients 16 --duration 5
+"""
+
+import argparse
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from micro_batcher import MicroBatcher  # noqa: E402
+from model_server import MockDRCModel  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_case(model, clients: int, duration: float, window_ms: float, max_batch: int):
+    batcher = MicroBatcher(model.infer_batch, window_ms=window_ms, max_batch_size=max_batch)
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(client_index):
+        seq = 0
+        while time.perf_counter() < stop_at:
+            request = {'file_paths': [], 'compiled_rules': {'rules': [], 'normalized_text': ''},
+                       'window': None, 'output_path': None,
+                       'task_id': f"bench-{client_index}-{seq}", 'client_id': f"client-{client_index}"}
+            start = time.perf_counter()
+            batcher.infer(request)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+            seq += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    stats = batcher.stats()
+    batcher.close()
+
+    return {
+        'throughput': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else 0.0,
+        'avg_batch': stats['avg_batch_size'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching throughput vs latency benchmark")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--overhead-ms', type=float, default=40.0, help='每次批次推論的固定開銷')
+    parser.add_argument('--per-item-ms', type=float, default=4.0, help='每筆請求的推論耗時')
+    parser.add_argument('--windows', default='0,2,5,10,20,50')
+    parser.add_argument('--max-batches', default='1,8,32')
+    args = parser.parse_args()
+
+    model = MockDRCModel({
+        'load_seconds': 0,
+        'batch_overhead_seconds': args.overhead_ms / 1000,
+        'per_item_seconds': args.per_item_ms / 1000,
+    })
+    model.warmup()
+
+    print(f"{args.clients} 個並行 client，每批固定開銷 {args.overhead_ms} ms + 每筆 {args.per_item_ms} ms\n")
+    print(f"{'window_ms':>9} {'max_batch':>9} {'req/s':>8} {'p50_ms':>8} {'p95_ms':>8} {'avg_batch':>9}")
+    for max_batch in [int(v) for v in args.max_batches.split(',')]:
+        for window_ms in [float(v) for v in args.windows.split(',')]:
+            if max_batch == 1 and window_ms > 0:
+                continue  # 單筆批次時 window 沒有意義
+            r = run_case(model, args.clients, args.duration, window_ms, max_batch)
+            print(f"{window_ms:>9.0f} {max_batch:>9} {r['throughput']:>8.1f} "
+                  f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['avg_batch']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+結果檔案傳送的 Benchmark：StaticFiles mount vs result_delivery
+
+以 create_mock_batch_files 產生一個任務的結果 (PNG + GDS + manifest)，模擬頁面
+第一次載入與重新 render (瀏覽器使用快取，或帶 If-None-Match 重新驗證) 時，兩種傳送方式
+在線上傳輸的位元組數與請求延遲。
+
+用法 (在專案根目錄執行，需要 fastapi 與 httpx):
+    python -m benchmarks.bench_result_delivery --results 24 --gds-bytes 200000 --rounds 5
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+import uuid
+import zipfile
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from starlette.staticfiles import StaticFiles
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from create_mock_results import create_mock_batch_files  # noqa: E402
+from result_delivery import serve_result_file, precompress_directory  # noqa: E402
+
+
+def build_apps(results_dir: Path):
+    static_app = FastAPI()
+    static_app.mount("/results", StaticFiles(directory=results_dir), name="results")
+
+    delivery_app = FastAPI()
+
+    @delivery_app.get("/results/{file_path:path}")
+    async def get_result_file(file_path: str, request: Request):
+        response = await serve_result_file(request, results_dir, file_path)
+        if response is None:
+            raise HTTPException(status_code=404)
+        return response
+
+    return static_app, delivery_app
+
+
+async def page_load(client: httpx.AsyncClient, urls, etags: dict, immutable: set):
+    """
+    載入一次頁面上所有結果，模擬瀏覽器快取：
+    immutable 的回應直接從快取取用 (不發出請求)，其他的帶 If-None-Match 重新驗證
+    """
+    wire_bytes = 0
+    latencies = []
+    requests_sent = 0
+    for url in urls:
+        if url in immutable:
+            latencies.append(0.0)
+            continue
+        requests_sent += 1
+        headers = {'Accept-Encoding': 'gzip, zstd'}
+        if url in etags:
+            headers['If-None-Match'] = etags[url]
+        t0 = time.perf_counter()
+        response = await client.get(url, headers=headers)
+        latencies.append(time.perf_counter() - t0)
+        # httpx 會自動解壓縮，線上位元組數以 raw stream 的長度計算
+        wire_bytes += int(response.headers.get('content-length', len(response.content)))
+        if 'etag' in response.headers:
+            etags[url] = response.headers['etag']
+        if 'immutable' in response.headers.get('cache-control', ''):
+            immutable.add(url)
+    return wire_bytes, latencies, requests_sent
+
+
+async def run(args, results_dir: Path, urls):
+    static_app, delivery_app = build_apps(results_dir)
+    print(f"{'mode':>10} {'load':>8} {'requests':>9} {'wire KB':>10} {'mean ms':>9} {'p95 ms':>9}")
+    for name, app in (('static', static_app), ('delivery', delivery_app)):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            etags, immutable = {}, set()
+            for label in ['first'] + ['repeat'] * args.rounds:
+                wire, latencies, sent = await page_load(client, urls, etags, immutable)
+                latencies.sort()
+                p95 = latencies[min(len(latencies) - 1, int(0.95 * (len(latencies) - 1)))]
+                print(f"{name:>10} {label:>8} {sent:>9} {wire / 1024:>10.1f} "
+                      f"{sum(latencies) / len(latencies) * 1000:>9.2f} {p95 * 1000:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Result delivery benchmark")
+    parser.add_argument('--results', type=int, default=24)
+    parser.add_argument('--gds-bytes', type=int, default=200000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="drc_delivery_") as tmp:
+        results_dir = Path(tmp)
+        task_id = str(uuid.uuid4())
+        zip_file, manifest_file = create_mock_batch_files(
+            task_id, num_results=args.results, gds_size=args.gds_bytes, output_dir=tmp)
+        task_dir = results_dir / task_id
+        with zipfile.ZipFile(zip_file) as zf:
+            zf.extractall(task_dir)
+        Path(manifest_file).rename(task_dir / f"{task_id}_manifest.json")
+
+        t0 = time.perf_counter()
+        stats = precompress_directory(task_dir)
+        print(f"預先壓縮 {stats['files']} 個檔案耗時 {time.perf_counter() - t0:.2f} 秒\n")
+
+        urls = [f"/results/{task_id}/{p.name}" for p in sorted(task_dir.iterdir())
+                if p.suffix in ('.png', '.gds', '.json')]
+        asyncio.run(run(args, results_dir, urls))
+
+
+if __name__ == "__main__":
+    main()
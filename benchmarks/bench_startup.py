@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+web 與 worker 行程的啟動時間與每個行程的記憶體 (RSS / PSS / USS) Benchmark
+
+  import   在新的 Python 行程中 import 各模組，記錄時間、載入的模組數與 RSS：
+           main (web)、main + tasks (web 原本會連帶 import tasks)、tasks (worker)
+  fork     模擬 gunicorn --preload 與 Celery prefork：父行程先 import 再 fork 出 --workers 個子行程，
+           子行程執行一段會觸發 GC 的工作後，從 /proc/<pid>/smaps_rollup 讀取記憶體：
+             spawn           fork 後由子行程各自 import (等同 uvicorn --workers)
+             preload         父行程 import 後 fork
+             preload+freeze  父行程 import 後 gc.freeze() 再 fork (gunicorn_conf.py 與 tasks.py 的做法)
+           USS 是子行程獨佔的記憶體，PSS 把共用的分頁平均分攤給共用它的行程
+  live     (--live) 實際啟動 uvicorn --workers 與 gunicorn -c gunicorn_conf.py，記錄到第一個
+           HTTP 回應的時間與每個 worker 的記憶體 (gunicorn 列在 requirements.txt)
+
+只在 Linux 上執行 (需要 /proc)。用法 (在專案根目錄執行):
+    python -m benchmarks.bench_startup --workers 4
+    python -m benchmarks.bench_startup --workers 4 --live
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.loadtest import wait_for_http  # noqa: E402
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+for name in sys.argv[1].split(','):
+    __import__(name)
+elapsed = time.perf_counter() - start
+rss = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS:'))
+print(json.dumps({'seconds': elapsed, 'modules': len(sys.modules), 'rss_kb': rss,
+                  'tasks': 'tasks' in sys.modules, 'celery': 'celery' in sys.modules}))
+"""
+
+# tier -> (要 import 的模組, fork 前額外呼叫的 preload)
+TIERS = {
+    'web': (['main'], 'task_client.preload'),
+    'worker': (['tasks'], None),
+}
+
+
+def smaps(pid: int) -> dict:
+    """/proc/<pid>/smaps_rollup 的數值 (KB)"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[-1] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    values['USS'] = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return values
+
+
+def run_import(modules: str, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT, modules], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    result = dict(samples[-1])
+    result['seconds'] = statistics.median(s['seconds'] for s in samples)
+    return result
+
+
+def import_modules(names):
+    for name in names:
+        __import__(name)
+
+
+def call_preload(path):
+    if path:
+        module, func = path.rsplit('.', 1)
+        getattr(__import__(module), func)()
+
+
+def churn():
+    """模擬 worker 執行期間的配置與 GC (會掃描所有被 GC 追蹤的物件)"""
+    garbage = [{'i': i, 'items': [i] * 8} for i in range(200_000)]
+    del garbage
+    for _ in range(3):
+        gc.collect()
+
+
+def fork_children(tier: str, mode: str, workers: int) -> dict:
+    """在子行程中 (避免影響本行程) 依 mode 載入 tier 的模組並 fork 出 workers 個子行程"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            modules, preload = TIERS[tier]
+            if mode != 'spawn':
+                gc.disable()
+                import_modules(modules)
+                call_preload(preload)
+                if mode == 'preload+freeze':
+                    gc.freeze()
+                gc.enable()
+            children, pipes = [], []
+            for _ in range(workers):
+                child_read, child_write = os.pipe()
+                child = os.fork()
+                if child == 0:
+                    os.close(child_read)
+                    if mode == 'spawn':
+                        import_modules(modules)
+                        call_preload(preload)
+                    churn()
+                    os.write(child_write, b'r')
+                    time.sleep(3600)
+                    os._exit(0)
+                os.close(child_write)
+                children.append(child)
+                pipes.append(child_read)
+            for fd in pipes:
+                os.read(fd, 1)
+            stats = [smaps(child) for child in children]
+            parent = smaps(os.getpid())
+            for child in children:
+                os.kill(child, 9)
+                os.waitpid(child, 0)
+            os.write(write_fd, json.dumps({'children': stats, 'parent': parent}).encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+def process_tree(pid: int) -> list:
+    """pid 的所有子孫行程"""
+    parents = {}
+    for entry in Path("/proc").iterdir():
+        if entry.name.isdigit():
+            try:
+                stat = (entry / "stat").read_text()
+            except OSError:
+                continue
+            ppid = int(stat.rsplit(')', 1)[1].split()[1])
+            parents.setdefault(ppid, []).append(int(entry.name))
+    result, stack = [], [pid]
+    while stack:
+        for child in parents.get(stack.pop(), []):
+            result.append(child)
+            stack.append(child)
+    return result
+
+
+def run_live(name: str, command: list, args) -> dict:
+    port = args.port
+    env = {**os.environ, 'WEB_BIND': f"127.0.0.1:{port}", 'WEB_WORKERS': str(args.workers)}
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_http(f"http://127.0.0.1:{port}/health", timeout=120)
+        ready = time.perf_counter() - start
+        # 所有 worker 都處理過請求後再量測
+        time.sleep(2)
+        stats = [smaps(pid) for pid in process_tree(proc.pid)]
+        workers = [s for s in stats if s.get('Rss', 0) > 20_000]
+        return {'ready': ready, 'workers': workers}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def print_memory(label: str, children: list, parent: dict = None):
+    uss = statistics.mean(c['USS'] for c in children) / 1024
+    rss = statistics.mean(c['Rss'] for c in children) / 1024
+    total_pss = (sum(c['Pss'] for c in children) + (parent['Pss'] if parent else 0)) / 1024
+    print(f"{label:>24} {rss:>9.1f} {uss:>9.1f} {total_pss:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process startup and memory benchmark")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5, help="import 量測的重複次數 (取中位數)")
+    parser.add_argument('--live', action='store_true', help="另外實際啟動 uvicorn 與 gunicorn 比較")
+    parser.add_argument('--port', type=int, default=18400)
+    args = parser.parse_args()
+
+    print(f"{'import':>24} {'seconds':>9} {'modules':>9} {'RSS MB':>9}  tasks/celery loaded")
+    for label, modules in (('web (main)', 'main'), ('web + tasks (舊)', 'main,tasks'), ('worker (tasks)', 'tasks')):
+        result = run_import(modules, args.repeat)
+        print(f"{label:>24} {result['seconds']:>9.3f} {result['modules']:>9} {result['rss_kb'] / 1024:>9.1f}  "
+              f"{result['tasks']}/{result['celery']}")
+
+    print(f"\n{args.workers} 個子行程的平均記憶體 (MB)；total PSS 包含父行程")
+    print(f"{'fork':>24} {'RSS':>9} {'USS':>9} {'total PSS':>10}")
+    for tier in TIERS:
+        for mode in ('spawn', 'preload', 'preload+freeze'):
+            result = fork_children(tier, mode, args.workers)
+            print_memory(f"{tier} {mode}", result['children'], result['parent'])
+
+    if args.live:
+        print(f"\n{'live':>24} {'RSS':>9} {'USS':>9} {'total PSS':>10} {'ready s':>8}")
+        for name, command in (
+            ('uvicorn --workers', [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+                                   "--workers", str(args.workers), "--log-level", "warning"]),
+            ('gunicorn --preload', [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app"]),
+        ):
+            result = run_live(name, command, args)
+            if not result['workers']:
+                print(f"{name:>24} 找不到 worker 行程")
+                continue
+            uss = statistics.mean(c['USS'] for c in result['workers']) / 1024
+            rss = statistics.mean(c['Rss'] for c in result['workers']) / 1024
+            total_pss = sum(c['Pss'] for c in result['workers']) / 1024
+            print(f"{name:>24} {rss:>9.1f} {uss:>9.1f} {total_pss:>10.1f} {result['ready']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+等待 Server B 完成的方式：固定間隔輪詢 vs 長輪詢 vs SSE
+
+在本機啟動 Server B (server_b_api_setup.py，模擬處理時間可調)，每種模式各送出 --jobs 個任務，
+以 tasks.py 實際使用的函式等待完成，記錄：
+  - 偵測延遲：Server B 記錄的 completed_at 到 worker 得知完成的時間
+  - 每個任務對 status endpoint 發出的請求數
+
+用法 (在專案根目錄執行):
+    python -m benchmarks.bench_status_wait --jobs 20 --server-b-seconds 2.5 --poll-interval 1
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.loadtest import percentile, wait_for_http  # noqa: E402
+
+API_KEY = 'bench-status-key'
+
+
+def start_server_b(args, workdir: Path) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        'SERVER_B_API_KEY': API_KEY,
+        'SERVER_B_MOCK_PROCESSING_SECONDS': str(args.server_b_seconds),
+        'SERVER_B_UPLOAD_DIR': str(workdir / "uploads"),
+        'SERVER_B_RESULTS_DIR': str(workdir / "results"),
+        'SERVER_B_PROCESSING_DIR': str(workdir / "processing"),
+    }
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "server_b_api_setup:app",
+                             "--port", str(args.server_b_port), "--log-level", "warning"],
+                            cwd=ROOT / "ServerB_setup", env=env, stdout=subprocess.DEVNULL)
+    wait_for_http(f"http://127.0.0.1:{args.server_b_port}/health")
+    return proc
+
+
+def run_mode(tasks, mode: str, args) -> dict:
+    """以指定模式等待 --jobs 個任務，回傳偵測延遲 (ms) 與每個任務的請求數"""
+    base_url = tasks.API_SERVER_B['base_url']
+    latencies = []
+
+    def one_job(index: int):
+        task_id = f"bench-{mode}-{index}-{time.time_ns()}"
+        response = requests.post(f"{base_url}/api/v1/upload", files={'file': ('input.txt', b'bench')},
+                                 data={'task_id': task_id}, headers={'Authorization': f'Bearer {API_KEY}'})
+        response.raise_for_status()
+        counter[task_id] = [0]
+        deadline = time.monotonic() + tasks.API_SERVER_B['poll_max_wait']
+        if mode == 'sse':
+            status_data = tasks.watch_task_status(task_id, deadline)
+        else:
+            status_data = tasks.poll_task_status(task_id, deadline, long_poll=(mode == 'longpoll'))
+        seen_at = time.time()
+        latencies.append((seen_at - status_data['timings']['completed_at']) * 1000)
+
+    # requests.get 在所有執行緒共用，以 task_id 區分每個任務的請求數
+    counter = {}
+    original_get = tasks.requests.get
+
+    def counting_get(url, *a, **kw):
+        for task_id, calls in counter.items():
+            if f"/{task_id}" in url:
+                calls[0] += 1
+        return original_get(url, *a, **kw)
+
+    tasks.requests.get = counting_get
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            list(pool.map(one_job, range(args.jobs)))
+    finally:
+        tasks.requests.get = original_get
+    requests_per_job = [calls[0] for calls in counter.values()]
+    return {'latencies': latencies, 'requests': requests_per_job}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server B status wait benchmark")
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--server-b-seconds', type=float, default=2.5)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--server-b-port', type=int, default=18001)
+    parser.add_argument('--modes', default='poll,longpoll,sse')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'API_SERVER_B_URL': f"http://127.0.0.1:{args.server_b_port}",
+        'API_SERVER_B_KEY': API_KEY,
+        'API_POLL_INTERVAL': str(args.poll_interval),
+    })
+    import tasks  # noqa: E402  (讀取上面的環境變數)
+
+    with tempfile.TemporaryDirectory(prefix="drc_status_") as tmp:
+        server_b = start_server_b(args, Path(tmp))
+        try:
+            print(f"{'mode':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'req/job':>8}")
+            for mode in args.modes.split(','):
+                result = run_mode(tasks, mode, args)
+                lat = result['latencies']
+                print(f"{mode:>9} {percentile(lat, 50):>9.1f} {percentile(lat, 95):>9.1f} {max(lat):>9.1f} "
+                      f"{sum(result['requests']) / len(result['requests']):>8.1f}")
+        finally:
+            server_b.terminate()
+            server_b.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
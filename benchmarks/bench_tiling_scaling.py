@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Tiling 平行處理的擴展性 Benchmark (1 到 N 個 worker)
+
+產生一個合成的大型 layout (文字格式 GDS，格式同 create_mock_results.py)，
+用 tiling.partition_layout 切成 tiles，再以 1..N 個行程平行執行一個
+CPU 密集的最小間距 (min spacing) 檢查，最後用 tiling.merge_violations
+合併結果，並與不切 tile 的單一行程結果比對，確認 halo 去重後數量一致。
+
+每個行程模擬一個 Celery prefork worker；tile 之間沒有共享狀態，因此結果
+可直接對應到 Celery group 在多個 worker/節點上的擴展行為。
+
+最後以實際的流程驗證合併：每個 tile 由模擬模型 (model_server.MockDRCModel) 產生輸出，
+經 Server B 的 violations.read_violations 轉成 manifest，再由 tiling.merge_tile_results 合併，
+violation 必須與不切 tile 的模型輸出完全相同 (halo 中的重複結果被去除、沒有遺漏)。
+
+用法 (在專案根目錄執行):
+    python -m benchmarks.bench_tiling_scaling --workers 8 --rects 40000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "ServerB_setup"))
+# 只需要模擬模型的輸出，不模擬載入與推論時間
+for name in ('MOCK_MODEL_LOAD_SECONDS', 'MOCK_MODEL_BATCH_OVERHEAD_SECONDS', 'MOCK_MODEL_PER_ITEM_SECONDS'):
+    os.environ.setdefault(name, '0')
+
+import result_store  # noqa: E402
+from model_server import MockDRCModel  # noqa: E402
+from rule_compiler import get_compiled_rules  # noqa: E402
+from tiling import layout_bbox, partition_layout, merge_violations, merge_tile_results  # noqa: E402
+from violations import read_violations  # noqa: E402
+
+
+def generate_layout(path: Path, rect_count: int, extent: int, seed: int = 0):
+    """產生隨機分佈的矩形 layout"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("HEADER 5\nBGNLIB\nLIBNAME BENCHLIB\nUNITS 0.001 1e-09\nBGNSTR\nSTRNAME TOP\n")
+        for _ in range(rect_count):
+            x = rng.randrange(0, extent)
+            y = rng.randrange(0, extent)
+            w = rng.randrange(50, 400)
+            h = rng.randrange(50, 400)
+            f.write("BOUNDARY\nLAYER 1\nDATATYPE 0\n")
+            f.write(f"XY {x} {y} {x + w} {y} {x + w} {y + h} {x} {y + h} {x} {y}\nENDEL\n")
+        f.write("ENDSTR\nENDLIB\n")
+
+
+def load_rects(path: str, window=None):
+    """讀取與 window 相交的矩形"""
+    rects = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.startswith('XY'):
+                continue
+            values = [int(v) for v in line.split()[1:]]
+            xs, ys = values[0::2], values[1::2]
+            rect = (min(xs), min(ys), max(xs), max(ys))
+            if window:
+                wx0, wy0, wx1, wy1 = window
+                if rect[2] < wx0 or rect[0] > wx1 or rect[3] < wy0 or rect[1] > wy1:
+                    continue
+            rects.append(rect)
+    return rects
+
+
+def spacing_violations(rects, min_space: int):
+    """以 x 方向掃描找出間距小於 min_space 的矩形對 (重疊不算)"""
+    rects = sorted(rects)
+    violations = []
+    for i, a in enumerate(rects):
+        for b in rects[i + 1:]:
+            if b[0] - a[2] >= min_space:
+                break
+            dx = max(0, b[0] - a[2], a[0] - b[2])
+            dy = max(0, b[1] - a[3], a[1] - b[3])
+            if (dx == 0 and dy == 0) or max(dx, dy) >= min_space:
+                continue
+            # 以兩矩形間隙的中心點作為 violation 的代表座標
+            gx = (max(a[0], b[0]) + min(a[2], b[2])) / 2
+            gy = (max(a[1], b[1]) + min(a[3], b[3])) / 2
+            violations.append({'rule': 'min_space', 'x': gx, 'y': gy,
+                               'pair': [list(a), list(b)]})
+    return violations
+
+
+def check_tile(args):
+    path, tile, min_space = args
+    rects = load_rects(path, tile['window'])
+    return tile, spacing_violations(rects, min_space)
+
+
+def run(path: Path, tiles, workers: int, min_space: int):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tile_violations = list(pool.map(check_tile, [(str(path), t, min_space) for t in tiles]))
+    merged = merge_violations(tile_violations)
+    return time.perf_counter() - start, len(merged)
+
+
+def check_pipeline(path: Path, tiles, min_width: float, workdir: Path) -> bool:
+    """模型輸出 -> Server B manifest -> merge_tile_results，與不切 tile 的結果比對"""
+    result_store.STORE_CONFIG['results_root'] = workdir / "results"
+    compiled_rules = get_compiled_rules(f"M1 width >= {min_width}")
+    model = MockDRCModel()
+
+    def model_violations(name: str, window):
+        output = workdir / f"{name}.txt"
+        model.infer_batch([{'file_paths': [str(path)], 'compiled_rules': compiled_rules,
+                            'window': window, 'output_path': str(output)}])
+        return read_violations(output)
+
+    reference = model_violations("untiled", None)
+    tile_results = []
+    found_in_tiles = 0
+    for tile in tiles:
+        violations = model_violations(f"tile{tile['index']:03d}", tile['window'])
+        found_in_tiles += len(violations)
+        tile_results.append({'tile': tile, 'batch_results': {
+            'batch_id': f"bench_tile{tile['index']:03d}", 'files': [], 'manifest': {'violations': violations}}})
+    merged = merge_tile_results("bench_merged", tile_results)['manifest']['violations']
+
+    key = lambda v: (v['x'], v['y'], tuple(v['bbox']))  # noqa: E731
+    ok = sorted(map(key, merged)) == sorted(map(key, reference))
+    print(f"\n實際流程: 各 tile 共回報 {found_in_tiles} 個 violation，合併後 {len(merged)} 個，"
+          f"未切 tile {len(reference)} 個 ({'OK' if ok else '不一致!'})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiling scaling benchmark")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--rects', type=int, default=40000)
+    parser.add_argument('--extent', type=int, default=400000)
+    parser.add_argument('--tile-size', type=int, default=100000)
+    parser.add_argument('--min-space', type=int, default=60)
+    parser.add_argument('--min-width', type=float, default=0.1, help="實際流程驗證中 width 檢查的下限 (um)")
+    args = parser.parse_args()
+
+    halo = args.min_space  # halo 必須 >= min_space / 2 才能保證跨邊界的 violation 不遺漏
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench_layout.gds"
+        generate_layout(path, args.rects, args.extent)
+        bbox = layout_bbox(path)
+        tiles = partition_layout(bbox, tile_size=args.tile_size, halo=halo, max_tiles=1024)
+        print(f"Layout: {args.rects} 個矩形, 外框 {bbox}, {len(tiles)} 個 tiles (halo={halo})")
+
+        start = time.perf_counter()
+        reference = len(spacing_violations(load_rects(str(path)), args.min_space))
+        baseline = time.perf_counter() - start
+        print(f"未切 tile (單一行程): {baseline:.2f}s, {reference} 個 violation\n")
+
+        print(f"{'workers':>8} {'time(s)':>9} {'speedup':>8} {'efficiency':>10} {'violations':>11}")
+        one_worker = None
+        for workers in range(1, args.workers + 1):
+            elapsed, found = run(path, tiles, workers, args.min_space)
+            one_worker = one_worker or elapsed
+            speedup = one_worker / elapsed
+            status = "" if found == reference else "  <-- 與未切 tile 結果不一致!"
+            print(f"{workers:>8} {elapsed:>9.2f} {speedup:>8.2f} {speedup / workers:>10.0%} {found:>11}{status}")
+
+        ok = check_pipeline(path, tiles, args.min_width, Path(tmp))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+結果傳輸的 Benchmark：HTTP 下載 vs ftps_transfer
+
+在本機啟動一個 FTP 伺服器 (pyftpdlib) 與一個 HTTP 檔案伺服器代替 Server B，比較：
+  http            tasks.py 原本的下載方式 (requests stream，8 KB chunk)
+  ftp-single      ftps_transfer 單一連線下載
+  ftp-ranges      ftps_transfer 切成多個 range 平行下載
+  small-connect   每個小檔案各自建立連線並登入 (create_mock_results 的寫法)
+  small-pooled    透過連線池平行下載同一批小檔案
+  resume          .part 已有一半內容時續傳
+
+預設使用一般 FTP；指定 --certfile (PEM，內含私鑰與憑證，需要 pyOpenSSL) 時以 FTPS 測試，
+此時 TLS 握手成本會讓連線池的差異更明顯。
+
+用法 (在專案根目錄執行，需要 pyftpdlib):
+    python -m benchmarks.bench_transfer --mb 256 --small-files 40
+"""
+
+import argparse
+import functools
+import hashlib
+import http.server
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.log import config_logging
+from pyftpdlib.servers import ThreadedFTPServer
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import ftps_transfer  # noqa: E402
+from ftps_transfer import FTPS_CONFIG, FTPConnectionPool, download_file, download_files, open_connection  # noqa: E402
+
+USER, PASSWORD = 'bench', 'bench-password'
+
+
+def sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def start_ftp_server(root: Path, port: int, certfile: str = None):
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(USER, PASSWORD, str(root), perm='elradfmwMT')
+    if certfile:
+        from pyftpdlib.handlers import TLS_FTPHandler
+        handler = type('BenchTLSHandler', (TLS_FTPHandler,), {})
+        handler.certfile = certfile
+        handler.tls_control_required = True
+        handler.tls_data_required = True
+    else:
+        handler = type('BenchHandler', (FTPHandler,), {})
+    handler.authorizer = authorizer
+    handler.banner = "bench"
+    server = ThreadedFTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, kwargs={'handle_exit': False}, daemon=True).start()
+    return server
+
+
+def start_http_server(root: Path, port: int):
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), functools.partial(QuietHandler, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def http_download(url: str, dest: Path):
+    response = requests.get(url, timeout=60, stream=True)
+    response.raise_for_status()
+    with open(dest, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=8192):
+            f.write(chunk)
+
+
+def connect_per_file(names, dest_dir: Path):
+    for name in names:
+        ftp = open_connection()
+        try:
+            with open(dest_dir / name, 'wb') as f:
+                ftp.retrbinary(f'RETR /{name}', f.write)
+        finally:
+            ftp.quit()
+
+
+def timed(label, func, size_bytes):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:>14} {elapsed:>9.3f} {size_bytes / 1e6 / elapsed:>10.1f}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP vs FTPS transfer benchmark")
+    parser.add_argument('--mb', type=int, default=128, help="大型結果 ZIP 的大小 (MB)")
+    parser.add_argument('--small-files', type=int, default=32)
+    parser.add_argument('--small-kb', type=int, default=64)
+    parser.add_argument('--parts', type=int, default=4)
+    parser.add_argument('--ftp-port', type=int, default=12121)
+    parser.add_argument('--http-port', type=int, default=18081)
+    parser.add_argument('--certfile', default=None)
+    args = parser.parse_args()
+
+    config_logging(level=logging.WARNING)
+    with tempfile.TemporaryDirectory(prefix="drc_transfer_") as tmp:
+        server_root = Path(tmp) / "server"
+        client_root = Path(tmp) / "client"
+        server_root.mkdir()
+        client_root.mkdir()
+
+        big = server_root / "results.zip"
+        with open(big, 'wb') as f:
+            for _ in range(args.mb):
+                f.write(os.urandom(1024 * 1024))
+        small_names = [f"manifest_{i:03d}.json" for i in range(args.small_files)]
+        for name in small_names:
+            (server_root / name).write_bytes(os.urandom(args.small_kb * 1024))
+        expected = sha256(big)
+
+        ftp_server = start_ftp_server(server_root, args.ftp_port, args.certfile)
+        http_server = start_http_server(server_root, args.http_port)
+        FTPS_CONFIG.update({'host': '127.0.0.1', 'port': args.ftp_port, 'username': USER, 'password': PASSWORD,
+                            'tls': bool(args.certfile), 'verify_tls': False, 'download_dir': '/',
+                            'range_threshold': 1})
+        size = big.stat().st_size
+        small_total = args.small_files * args.small_kb * 1024
+        pool = FTPConnectionPool(size=max(args.parts, 4))
+
+        print(f"{'mode':>14} {'time(s)':>9} {'MB/s':>10}")
+        try:
+            dest = client_root / "http.zip"
+            timed('http', lambda: http_download(f"http://127.0.0.1:{args.http_port}/results.zip", dest), size)
+            assert sha256(dest) == expected
+
+            dest = client_root / "single.zip"
+            timed('ftp-single', lambda: download_file('results.zip', dest, pool=pool, parts=1), size)
+            assert sha256(dest) == expected
+
+            dest = client_root / "ranges.zip"
+            timed('ftp-ranges', lambda: download_file('results.zip', dest, pool=pool, parts=args.parts), size)
+            assert sha256(dest) == expected
+
+            small_dir = client_root / "small_connect"
+            small_dir.mkdir()
+            timed('small-connect', lambda: connect_per_file(small_names, small_dir), small_total)
+
+            small_dir = client_root / "small_pooled"
+            small_dir.mkdir()
+            timed('small-pooled', lambda: download_files([(n, small_dir / n) for n in small_names], pool=pool),
+                  small_total)
+
+            dest = client_root / "resume.zip"
+            with open(big, 'rb') as src, open(dest.with_name(dest.name + '.part'), 'wb') as part:
+                part.write(src.read(size // 2))
+            timed('resume', lambda: download_file('results.zip', dest, pool=pool, parts=1), size - size // 2)
+            assert sha256(dest) == expected
+            print(f"\n連線池共建立 {pool.created} 條控制連線")
+        finally:
+            pool.close()
+            ftp_server.close_all()
+            http_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+前端 (index.html) 渲染的 Benchmark：長時間聊天紀錄、1,000 個結果檔案的圖庫、大型 WebSocket 訊息
+
+以本機的 HTTP 伺服器提供 index.html、/batches/{task_id}/files 分頁清單與 /results/ 下的縮圖，
+在 headless Chromium 中以假的 WebSocket 送出訊息，記錄：
+  history   連續送出 --messages 則完成訊息，到最後一則出現在畫面上的時間
+  gallery   一個 --files 張 PNG (與同樣數量 GDS) 的批次結果：第一張縮圖顯示的時間，
+            以及捲完整個圖庫 (讀完所有分頁) 的時間
+  frame     一則 --frame-mb MB 的訊息從送出到顯示的時間
+
+每個情境都記錄 DOM 節點數、掛載中的 <img> 數、主執行緒 long task 的總時間與 JS heap 大小。
+指定 --html 可以量測其他版本的頁面，例如先以 git show <commit>:index.html > old.html 取出舊版。
+
+需要 playwright (pip install playwright && playwright install chromium)，頁面會從 CDN 載入
+React、Babel 與 Tailwind。用法 (在專案根目錄執行):
+    python -m benchmarks.bench_ui_render --files 1000 --messages 2000
+"""
+
+import argparse
+import functools
+import http.server
+import json
+import struct
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+ROOT = Path(__file__).resolve().parent.parent
+
+try:
+    from playwright.sync_api import sync_playwright
+except ImportError:
+    sync_playwright = None
+
+GALLERY_TASK = 'bench-gallery'
+
+# 取代 WebSocket：頁面建立的連線都記在 window.__benchSockets，由 __benchEmit 送出訊息
+FAKE_WEBSOCKET = """
+window.__benchSockets = [];
+window.WebSocket = class {
+    constructor(url) {
+        this.url = url;
+        this.readyState = 1;
+        window.__benchSockets.push(this);
+        setTimeout(() => this.onopen && this.onopen(), 0);
+    }
+    send() {}
+    close() { this.readyState = 3; }
+};
+window.__benchEmit = (text) => window.__benchSockets.forEach(s => s.onmessage && s.onmessage({ data: text }));
+window.__longTaskMs = 0;
+new PerformanceObserver(list => list.getEntries().forEach(e => { window.__longTaskMs += e.duration; }))
+    .observe({ entryTypes: ['longtask'] });
+"""
+
+PAGE_STATS = """() => ({
+    domNodes: document.getElementsByTagName('*').length,
+    images: document.getElementsByTagName('img').length,
+    longTaskMs: window.__longTaskMs,
+    heapMb: performance.memory ? performance.memory.usedJSHeapSize / 1e6 : NaN,
+})"""
+
+
+def make_png(size: int = 64) -> bytes:
+    """單色的 size x size PNG"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    raw = b''.join(b'\x00' + b'\x80\x90\xa0' * size for _ in range(size))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def batch_files(count: int) -> dict:
+    files = {'png': [], 'gds': []}
+    for i in range(count):
+        for kind, ext in (('png', 'png'), ('gds', 'gds')):
+            name = f"{GALLERY_TASK}_output_{i:04d}.{ext}"
+            files[kind].append({'filename': name, 'type': kind, 'description': f"結果 {i} ({ext})",
+                                'url': f"/results/{GALLERY_TASK}/{name}"})
+    return files
+
+
+class BenchHandler(http.server.BaseHTTPRequestHandler):
+    """index.html、分頁檔案清單與縮圖 (對應 main.py 的 /、/batches/{task_id}/files 與 /results/)"""
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self, html: bytes = b'', files: dict = None, png: bytes = b''):
+        url = urlparse(self.path)
+        if url.path == '/':
+            return self.send_body(html, 'text/html; charset=utf-8')
+        if url.path == f"/batches/{GALLERY_TASK}/files":
+            query = parse_qs(url.query)
+            kind = query.get('type', ['png'])[0]
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['60'])[0])
+            items = files.get(kind, [])
+            end = offset + limit
+            page = {'task_id': GALLERY_TASK, 'total': len(items), 'offset': offset, 'limit': limit,
+                    'next_offset': end if end < len(items) else None, 'files': items[offset:end]}
+            return self.send_body(json.dumps(page).encode(), 'application/json')
+        if url.path.startswith('/results/') and url.path.endswith('.png'):
+            return self.send_body(png, 'image/png')
+        self.send_error(404)
+
+
+def start_server(args) -> http.server.ThreadingHTTPServer:
+    handler = type('Handler', (BenchHandler,), {
+        'do_GET': functools.partialmethod(BenchHandler.do_GET, html=Path(args.html).read_bytes(),
+                                          files=batch_files(args.files), png=make_png()),
+    })
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def report(label: str, seconds: float, page, extra: str = ''):
+    stats = page.evaluate(PAGE_STATS)
+    print(f"{label:>16} {seconds * 1000:>9.0f} {stats['domNodes']:>9} {stats['images']:>7} "
+          f"{stats['longTaskMs']:>10.0f} {stats['heapMb']:>8.1f}  {extra}")
+
+
+def wait_for_text(page, text: str, timeout_s: float):
+    page.wait_for_function("(text) => document.getElementById('root').textContent.includes(text)",
+                           arg=text, timeout=timeout_s * 1000, polling='raf')
+
+
+def run_history(page, args):
+    start = time.perf_counter()
+    page.evaluate("""(n) => {
+        for (let i = 0; i < n; i++) {
+            window.__benchEmit(JSON.stringify({ task_id: `bench-history-${i}`, status: 'completed',
+                                                message: `歷史訊息 ${i} 已完成` }));
+        }
+    }""", args.messages)
+    wait_for_text(page, f"歷史訊息 {args.messages - 1} 已完成", args.timeout)
+    report('history', time.perf_counter() - start, page)
+
+
+def run_gallery(page, args):
+    summary = {
+        'task_id': GALLERY_TASK, 'status': 'completed', 'message': '批次處理完成',
+        'batch': {'task_id': GALLERY_TASK, 'total_count': 2 * args.files,
+                  'counts': {'png': args.files, 'gds': args.files},
+                  'zip_url': f"/results/{GALLERY_TASK}/{GALLERY_TASK}_results.zip",
+                  'files_url': f"/batches/{GALLERY_TASK}/files"},
+    }
+    start = time.perf_counter()
+    page.evaluate("(text) => window.__benchEmit(text)", json.dumps(summary))
+    page.wait_for_function(f"""() => [...document.querySelectorAll('img[src*="/results/{GALLERY_TASK}/"]')]
+                                    .some(img => img.complete && img.naturalWidth > 0)""",
+                           timeout=args.timeout * 1000, polling='raf')
+    report('gallery-first', time.perf_counter() - start, page)
+
+    # 捲完整個圖庫：捲動圖庫 (以及聊天視窗) 到底部，沒有自動讀取時按「載入更多」
+    start = time.perf_counter()
+    deadline = start + args.timeout
+    while time.perf_counter() < deadline:
+        loaded = page.evaluate("""(galleryTask) => {
+            const tiles = document.querySelectorAll('.grid > div');
+            const gallery = document.querySelector('[data-gallery]') || tiles[0]?.closest('.overflow-y-auto');
+            if (gallery) gallery.scrollTop = gallery.scrollHeight;
+            const more = [...document.querySelectorAll('button')].find(b => b.textContent.includes('載入更多'));
+            if (more && !more.disabled) more.click();
+            return tiles.length;
+        }""", GALLERY_TASK)
+        if loaded >= args.files:
+            break
+        page.wait_for_timeout(50)
+    report('gallery-all', time.perf_counter() - start, page, f"{loaded} 張縮圖")
+
+
+def run_frame(page, args):
+    # 大型訊息：大部分內容是前端不使用的欄位 (例如舊版完成訊息內嵌的完整檔案清單)
+    entries = max(1, int(args.frame_mb * 1e6 / 120))
+    before = page.evaluate("() => window.__longTaskMs")
+    start = time.perf_counter()
+    page.evaluate("""(n) => {
+        const files = [];
+        for (let i = 0; i < n; i++) {
+            files.push({ filename: `large_${i}.png`, type: 'png', description: `大型訊息的檔案 ${i}`,
+                         url: `/results/bench-large/large_${i}.png` });
+        }
+        window.__benchEmit(JSON.stringify({ task_id: 'bench-large', status: 'completed',
+                                            message: '大型訊息已顯示', batch_results: { files } }));
+    }""", entries)
+    wait_for_text(page, '大型訊息已顯示', args.timeout)
+    after = page.evaluate("() => window.__longTaskMs")
+    report('frame', time.perf_counter() - start, page, f"此訊息的 long task {after - before:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Web UI render benchmark")
+    parser.add_argument('--html', default=str(ROOT / "index.html"))
+    parser.add_argument('--files', type=int, default=1000, help="批次結果中的 PNG 數量")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--frame-mb', type=float, default=5.0)
+    parser.add_argument('--port', type=int, default=18091)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    if sync_playwright is None:
+        print("需要 playwright: pip install playwright && playwright install chromium")
+        sys.exit(1)
+
+    server = start_server(args)
+    try:
+        with sync_playwright() as p:
+            browser = p.chromium.launch(args=['--enable-precise-memory-info'])
+            page = browser.new_page(viewport={'width': 1280, 'height': 900})
+            page.add_init_script(FAKE_WEBSOCKET)
+            page.goto(f"http://127.0.0.1:{args.port}/")
+            page.wait_for_function("() => window.__benchSockets.some(s => s.onmessage)", timeout=args.timeout * 1000)
+
+            print(f"{'scenario':>16} {'time ms':>9} {'DOM':>9} {'<img>':>7} {'longtask':>10} {'heap MB':>8}")
+            run_history(page, args)
+            run_gallery(page, args)
+            run_frame(page, args)
+            browser.close()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
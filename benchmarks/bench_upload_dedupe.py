@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+上傳到 Server B 的 Benchmark：每次傳送完整檔案 vs upload by hash
+
+在本機啟動 Server B (server_b_api_setup.py)，以 tasks.upload_to_server_b 將同一個 --mb MB 的
+檔案以不同的 task_id 上傳 --jobs 次，比較 API_SERVER_B_UPLOAD_DEDUPE 關閉與開啟時
+每次上傳的時間與 Server B 實際收到的位元組數 (取自 Server B 的 /metrics)。
+
+接著以相同的 layout 與規則送出兩個任務，經過模型 (tasks.mock_ai_model) 再上傳，確認第二個任務
+的模型輸出與第一個相同、上傳時沒有重新傳送檔案 (Server B 回應 deduplicated)。
+
+最後逐一刪除任務，確認共用的 blob 在最後一個任務刪除後才被移除。
+
+用法 (在專案根目錄執行):
+    python -m benchmarks.bench_upload_dedupe --mb 64 --jobs 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.loadtest import percentile, wait_for_http  # noqa: E402
+
+API_KEY = 'bench-dedupe-key'
+
+
+def start_server_b(args, workdir: Path) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        'SERVER_B_API_KEY': API_KEY,
+        'SERVER_B_MOCK_PROCESSING_SECONDS': '0.1',
+        'SERVER_B_UPLOAD_DIR': str(workdir / "uploads"),
+        'SERVER_B_RESULTS_DIR': str(workdir / "results"),
+        'SERVER_B_PROCESSING_DIR': str(workdir / "processing"),
+    }
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "server_b_api_setup:app",
+                             "--port", str(args.server_b_port), "--log-level", "warning"],
+                            cwd=ROOT / "ServerB_setup", env=env, stdout=subprocess.DEVNULL)
+    wait_for_http(f"http://127.0.0.1:{args.server_b_port}/health")
+    return proc
+
+
+def server_b_metrics(base_url: str) -> dict:
+    """Server B /metrics 中沒有 label 或只有 mode label 的數值"""
+    text = requests.get(f"{base_url}/metrics", timeout=10).text
+    values = {}
+    for line in text.splitlines():
+        if line.startswith('#') or not line.strip():
+            continue
+        name, value = line.rsplit(' ', 1)
+        values[name] = float(value)
+    return values
+
+
+def received_bytes(base_url: str) -> float:
+    return server_b_metrics(base_url).get('drc_server_b_upload_bytes_total{mode="full"}', 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server B upload dedupe benchmark")
+    parser.add_argument('--mb', type=int, default=64, help="上傳檔案的大小 (MB)")
+    parser.add_argument('--jobs', type=int, default=10)
+    parser.add_argument('--server-b-port', type=int, default=18011)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.server_b_port}"
+    os.environ.update({
+        'API_SERVER_B_URL': base_url,
+        'API_SERVER_B_KEY': API_KEY,
+        'API_TIMEOUT': '120',
+        # 只需要模型的輸出檔，不模擬載入與推論時間
+        'MOCK_MODEL_LOAD_SECONDS': '0',
+        'MOCK_MODEL_BATCH_OVERHEAD_SECONDS': '0',
+        'MOCK_MODEL_PER_ITEM_SECONDS': '0',
+    })
+    import tasks  # noqa: E402  (讀取上面的環境變數)
+    from rule_compiler import get_compiled_rules  # noqa: E402
+
+    with tempfile.TemporaryDirectory(prefix="drc_dedupe_") as tmp:
+        tmp = Path(tmp)
+        server_b = start_server_b(args, tmp)
+        layout = tmp / "model_output.txt"
+        with open(layout, 'wb') as f:
+            for _ in range(args.mb):
+                f.write(os.urandom(1024 * 1024))
+
+        task_ids = []
+        ok = True
+        try:
+            print(f"{'mode':>8} {'p50 s':>8} {'max s':>8} {'MB received':>12}")
+            for dedupe in (False, True):
+                tasks.API_SERVER_B['upload_dedupe'] = dedupe
+                before = received_bytes(base_url)
+                durations = []
+                for i in range(args.jobs):
+                    task_id = f"dedupe-{int(dedupe)}-{i}-{time.time_ns()}"
+                    start = time.perf_counter()
+                    tasks.upload_to_server_b(str(layout), task_id)
+                    durations.append(time.perf_counter() - start)
+                    task_ids.append(task_id)
+                received = (received_bytes(base_url) - before) / 1e6
+                print(f"{'hash' if dedupe else 'full':>8} {percentile(durations, 50):>8.3f} "
+                      f"{max(durations):>8.3f} {received:>12.1f}")
+
+            # 相同的 layout 與規則重新送出：上傳檔名帶 task_id，模型輸出仍必須相同
+            compiled_rules = get_compiled_rules("min_width 0.1\nmin_space 0.12")
+            source = os.urandom(1024 * 1024)
+            outputs, results, pipeline_ids = [], [], []
+            for i in range(2):
+                task_id = f"pipeline-{i}-{time.time_ns()}"
+                upload = tmp / f"{task_id}_layout_.gds"
+                upload.write_bytes(source)
+                output = tasks.mock_ai_model([str(upload)], compiled_rules,
+                                             output_path=str(tmp / f"AI_model_output_{task_id}.txt"), task_id=task_id)
+                outputs.append(tasks.file_sha256(output))
+                results.append(tasks.upload_to_server_b(output, task_id))
+                pipeline_ids.append(task_id)
+            if outputs[0] != outputs[1] or not results[1].get('deduplicated'):
+                print(f"相同的任務重新送出仍上傳完整檔案 (輸出 {outputs[0][:12]} / {outputs[1][:12]})")
+                ok = False
+            else:
+                print(f"\n相同的任務重新送出: 模型輸出相同 ({outputs[0][:12]})，未重新上傳")
+
+            headers = {'Authorization': f'Bearer {API_KEY}'}
+            for task_id in pipeline_ids:
+                requests.delete(f"{base_url}/api/v1/tasks/{task_id}", headers=headers, timeout=10).raise_for_status()
+
+            # 所有任務共用同一個 blob：最後一個任務刪除前都不能被移除
+            digest = tasks.file_sha256(str(layout))
+            blob = tmp / "uploads" / "blobs" / digest[:2] / digest
+            for i, task_id in enumerate(task_ids):
+                requests.delete(f"{base_url}/api/v1/tasks/{task_id}", headers=headers, timeout=10).raise_for_status()
+                last = i == len(task_ids) - 1
+                if blob.exists() == last:
+                    print(f"刪除 {task_id} 後 blob {'仍然存在' if last else '已被移除'}")
+                    ok = False
+            metrics = server_b_metrics(base_url)
+            print(f"\n刪除所有任務後: blobs={metrics['drc_server_b_blobs']:.0f} "
+                  f"references={metrics['drc_server_b_blob_references']:.0f} "
+                  f"({'OK' if ok else 'FAILED'})")
+        finally:
+            server_b.terminate()
+            server_b.wait(timeout=10)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
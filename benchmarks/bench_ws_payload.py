@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+完成訊息大小與編碼耗時：內嵌完整 batch_results vs 批次摘要 + 分頁清單
+
+以 N 組 PNG/GDS 的批次結果，比較：
+  - 舊版完成訊息 (batch_results + files + png_files/gds_files + manifest) 與新版摘要的大小
+  - 經過 permessage-deflate (zlib raw deflate) 後的大小
+  - json / orjson / msgpack 的編碼耗時 (Redis 發布、監聽器解碼、WebSocket 寫入各一次)
+  - 新版前端讀取第一頁檔案清單的大小
+
+用法 (在專案根目錄執行):
+    python -m benchmarks.bench_ws_payload --results 2000
+"""
+
+import argparse
+import json
+import sys
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from batch_files import batch_summary, BATCH_CONFIG  # noqa: E402
+from result_store import result_url, zip_name  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def sample_batch_results(task_id: str, results: int) -> dict:
+    files = []
+    for i in range(results):
+        for kind, name in (('png', f"output_{i:04d}.png"), ('gds', f"layout_{i:04d}.gds")):
+            files.append({'filename': name, 'type': kind, 'description': f"DRC result {i} ({kind})",
+                          'url': result_url(task_id, name)})
+    return {
+        'batch_id': task_id,
+        'total_count': len(files),
+        'files': files,
+        'png_files': [f['filename'] for f in files if f['type'] == 'png'],
+        'gds_files': [f['filename'] for f in files if f['type'] == 'gds'],
+        'zip_file': zip_name(task_id),
+        'manifest': {'files': [{k: f[k] for k in ('filename', 'type', 'description')} for f in files]},
+    }
+
+
+def deflated_size(data: bytes) -> int:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+def time_codec(encode, decode, payload, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        # 發布時編碼 → 監聽器解碼 → 寫入 WebSocket 時再編碼一次
+        decode(encode({'client_id': 'c', 'payload': payload}))
+        encode(payload)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket completed payload benchmark")
+    parser.add_argument('--results', type=int, default=2000, help="PNG/GDS 組數")
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    task_id = str(uuid.uuid4())
+    batch_results = sample_batch_results(task_id, args.results)
+    message = f"批次處理完成！共產生 {batch_results['total_count']} 個檔案"
+    legacy = {"status": "completed", "message": message, "batch_results": batch_results,
+              "zip_url": result_url(task_id, batch_results['zip_file']), "files": batch_results['files']}
+    summary = batch_summary(batch_results)
+    lean = {"status": "completed", "message": message, "batch": summary, "zip_url": summary['zip_url']}
+    first_page = {'task_id': task_id, 'total': args.results, 'offset': 0, 'limit': BATCH_CONFIG['page_size'],
+                  'next_offset': BATCH_CONFIG['page_size'],
+                  'files': [f for f in batch_results['files'] if f['type'] == 'png'][:BATCH_CONFIG['page_size']]}
+
+    print(f"{batch_results['total_count']} 個檔案\n")
+    print(f"{'payload':>12} {'json KB':>10} {'deflate KB':>11}")
+    for name, payload in (('legacy', legacy), ('lean', lean), ('first page', first_page)):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        print(f"{name:>12} {len(data) / 1024:>10.1f} {deflated_size(data) / 1024:>11.1f}")
+
+    codecs = [('json', lambda o: json.dumps(o, ensure_ascii=False), json.loads)]
+    if orjson is not None:
+        codecs.append(('orjson', orjson.dumps, orjson.loads))
+    if msgpack is not None:
+        codecs.append(('msgpack', lambda o: msgpack.packb(o, use_bin_type=True),
+                       lambda b: msgpack.unpackb(b, raw=False)))
+    print(f"\n{'codec':>12} {'legacy ms':>10} {'lean ms':>9}")
+    for name, encode, decode in codecs:
+        print(f"{name:>12} {time_codec(encode, decode, legacy, args.rounds):>10.2f} "
+              f"{time_codec(encode, decode, lean, args.rounds):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Server B 結果打包的 Benchmark
+
+產生一批大型結果 (PNG 以隨機位元組模擬已壓縮的影像，GDS 為帶隨機座標的文字)，
+比較四種打包方式的耗時、ZIP 大小與第一個位元組送出的時間：
+
+  zipfile-stored    原本 simulate_processing 的 zipfile.ZipFile(zip_file, 'w')
+  zipfile-deflate   原本 create_mock_batch_files 的 ZIP_DEFLATED (所有檔案)
+  policy-serial     result_packaging 的壓縮策略 (PNG STORED、GDS DEFLATE 9)，單執行緒
+  policy-parallel   同上，多執行緒平行壓縮成員
+
+用法 (在專案根目錄執行):
+    python -m benchmarks.bench_zip_packaging --results 64 --png-bytes 2000000 --gds-bytes 8000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "ServerB_setup"))
+
+from result_packaging import iter_zip  # noqa: E402
+
+
+def generate_batch(workdir: Path, results: int, png_bytes: int, gds_bytes: int, seed: int):
+    rng = random.Random(seed)
+    files = []
+    for i in range(results):
+        png = workdir / f"output_{i:03d}.png"
+        png.write_bytes(os.urandom(png_bytes))
+        gds = workdir / f"layout_{i:03d}.gds"
+        lines = []
+        size = 0
+        while size < gds_bytes:
+            x, y = rng.randrange(0, 100000), rng.randrange(0, 100000)
+            w, h = rng.randrange(10, 500), rng.randrange(10, 500)
+            line = (f"BOUNDARY\nLAYER {rng.randrange(1, 12)}\nDATATYPE 0\n"
+                    f"XY {x} {y} {x + w} {y} {x + w} {y + h} {x} {y + h} {x} {y}\nENDEL\n")
+            lines.append(line)
+            size += len(line)
+        gds.write_text(''.join(lines))
+        files += [(png, png.name), (gds, gds.name)]
+    return files
+
+
+def run_zipfile(files, dest: Path, compression):
+    t0 = time.perf_counter()
+    with zipfile.ZipFile(dest, 'w', compression) as zf:
+        for path, arcname in files:
+            zf.write(path, arcname)
+    elapsed = time.perf_counter() - t0
+    # zipfile 必須整個寫完才能開始傳送
+    return elapsed, elapsed, dest.stat().st_size
+
+
+def run_stream(files, dest: Path, workers: int):
+    t0 = time.perf_counter()
+    first_byte = None
+    with open(dest, 'wb') as f:
+        for chunk in iter_zip(files, workers=workers):
+            if first_byte is None:
+                first_byte = time.perf_counter() - t0
+            f.write(chunk)
+    return time.perf_counter() - t0, first_byte, dest.stat().st_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Result ZIP packaging benchmark")
+    parser.add_argument('--results', type=int, default=32)
+    parser.add_argument('--png-bytes', type=int, default=1_000_000)
+    parser.add_argument('--gds-bytes', type=int, default=4_000_000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="drc_zipbench_") as tmp:
+        workdir = Path(tmp)
+        files = generate_batch(workdir, args.results, args.png_bytes, args.gds_bytes, args.seed)
+        total = sum(path.stat().st_size for path, _ in files)
+        print(f"{len(files)} 個檔案，共 {total / 1e6:.1f} MB，{args.workers} 個壓縮執行緒\n")
+        print(f"{'mode':>16} {'time(s)':>9} {'first byte(s)':>14} {'zip MB':>9} {'ratio':>7}")
+
+        cases = [
+            ('zipfile-stored', lambda dest: run_zipfile(files, dest, zipfile.ZIP_STORED)),
+            ('zipfile-deflate', lambda dest: run_zipfile(files, dest, zipfile.ZIP_DEFLATED)),
+            ('policy-serial', lambda dest: run_stream(files, dest, 1)),
+            ('policy-parallel', lambda dest: run_stream(files, dest, args.workers)),
+        ]
+        for name, run in cases:
+            dest = workdir / f"{name}.zip"
+            elapsed, first_byte, size = run(dest)
+            with zipfile.ZipFile(dest) as zf:
+                assert zf.testzip() is None
+            print(f"{name:>16} {elapsed:>9.2f} {first_byte:>14.3f} {size / 1e6:>9.1f} {size / total:>7.3f}")
+            dest.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Event loop 延遲檢查
+
+在同一個 event loop 中以 httpx 的 ASGITransport 直接呼叫 main.py 與 Server B 的 app，
+同時進行多個大檔上傳 (Server B /api/v1/upload)、結果下載 (/download/{file})
+與首頁請求 (/)，另一個 heartbeat coroutine 每 10 ms 醒來一次，量測實際醒來時間
+比預期晚了多少。任何 handler 在 event loop 上做阻塞的磁碟 I/O 都會直接反映在此延遲上。
+
+最大延遲超過 --threshold-ms 時以非零狀態結束，可放進 CI：
+    python -m benchmarks.check_event_loop_lag --clients 16 --file-mb 32 --threshold-ms 50
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "ServerB_setup"))
+
+API_KEY = "lag-check-api-key"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def heartbeat(stop: asyncio.Event, lags: list, interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def run(args, workdir: Path):
+    import httpx
+
+    os.environ.update({
+        'SERVER_B_API_KEY': API_KEY,
+        'SERVER_B_UPLOAD_DIR': str(workdir / "uploads"),
+        'SERVER_B_RESULTS_DIR': str(workdir / "results"),
+        'SERVER_B_PROCESSING_DIR': str(workdir / "processing"),
+        'SERVER_B_MOCK_PROCESSING_SECONDS': '0.1',
+    })
+    import server_b_api_setup
+    import main
+
+    payload = os.urandom(args.file_mb * 1024 * 1024)
+    download_names = []
+    for i in range(args.clients):
+        name = f"lagcheck_{uuid.uuid4().hex[:8]}_{i}.bin"
+        (main.RESULTS_DIR / name).write_bytes(payload)
+        download_names.append(name)
+
+    web = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://web", timeout=300)
+    server_b = httpx.AsyncClient(transport=httpx.ASGITransport(app=server_b_api_setup.app),
+                                 base_url="http://server-b", timeout=300)
+
+    async def upload(i):
+        response = await server_b.post(
+            "/api/v1/upload",
+            data={'task_id': f"lagcheck_{i}"},
+            files={'file': (f"input_{i}.zip", payload, 'application/zip')},
+            headers={'Authorization': f"Bearer {API_KEY}"},
+        )
+        response.raise_for_status()
+
+    async def download(name):
+        response = await web.get(f"/download/{name}")
+        response.raise_for_status()
+        assert len(response.content) == len(payload)
+
+    async def index():
+        for _ in range(20):
+            response = await web.get("/", headers={'Accept-Encoding': 'br, gzip'})
+            assert response.status_code in (200, 404)
+
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(stop, lags))
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(upload(i) for i in range(args.clients)),
+            *(download(name) for name in download_names),
+            *(index() for _ in range(args.clients)),
+        )
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await beat
+        await web.aclose()
+        await server_b.aclose()
+        for name in download_names:
+            (main.RESULTS_DIR / name).unlink(missing_ok=True)
+    return elapsed, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event loop lag under concurrent uploads and downloads")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--file-mb', type=int, default=32)
+    parser.add_argument('--threshold-ms', type=float, default=50.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="drc_lagcheck_") as tmp:
+        elapsed, lags = asyncio.run(run(args, Path(tmp)))
+
+    worst = max(lags) * 1000 if lags else 0.0
+    print(f"{args.clients} 個上傳 + {args.clients} 個下載 ({args.file_mb} MB)，耗時 {elapsed:.2f} 秒")
+    print(f"event loop 延遲: p50 {percentile(lags, 50) * 1000:.1f} ms, "
+          f"p99 {percentile(lags, 99) * 1000:.1f} ms, max {worst:.1f} ms ({len(lags)} 個樣本)")
+    if worst > args.threshold_ms:
+        print(f"最大延遲超過門檻 {args.threshold_ms} ms")
+        sys.exit(1)
+    print(f"最大延遲低於門檻 {args.threshold_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Server B 後端池檢查：依負載分派、斷路器與 affinity
+
+在本機啟動 --backends 個 Server B (server_b_api_setup.py)，第一台的模擬處理時間較長 (--slow-seconds)，
+以 tasks.py 的 upload_to_server_b / wait_for_server_b_response 跑完整的上傳 → 等待 → 下載：
+  single    只使用第一台 (原本單一 API_SERVER_B_URL 的情況)
+  pool      API_SERVER_B_URLS 包含所有 Server B，依 /health 的負載分派
+  failover  同 pool，但送出三分之一的工作後停掉第二台；之後的工作應全部避開它
+
+每個工作的狀態查詢與下載都必須送到接收上傳的那台 (否則會 404)，任何非預期的失敗都以非零狀態結束。
+需要 Redis (REDIS_URL)：
+
+    python -m benchmarks.check_server_b_pool --backends 3 --jobs 60 --concurrency 12
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.loadtest import percentile, wait_for_http  # noqa: E402
+
+API_KEY = 'pool-check-api-key'
+
+
+def start_server_b(port: int, seconds: float, workdir: Path) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        'SERVER_B_API_KEY': API_KEY,
+        'SERVER_B_MOCK_PROCESSING_SECONDS': str(seconds),
+        'SERVER_B_UPLOAD_DIR': str(workdir / "uploads"),
+        'SERVER_B_RESULTS_DIR': str(workdir / "results"),
+        'SERVER_B_PROCESSING_DIR': str(workdir / "processing"),
+    }
+    for name in ("uploads", "results", "processing"):
+        (workdir / name).mkdir(parents=True, exist_ok=True)
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "server_b_api_setup:app",
+                             "--port", str(port), "--log-level", "warning"],
+                            cwd=ROOT / "ServerB_setup", env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_http(f"http://127.0.0.1:{port}/health")
+    return proc
+
+
+def run_jobs(tasks, args, label: str, workdir: Path, on_submitted=None) -> dict:
+    """以 --concurrency 個執行緒跑 --jobs 個工作，回傳延遲、各後端分到的數量與失敗的工作"""
+    input_file = workdir / "model_output.txt"
+    input_file.write_bytes(b"x" * 1024)
+    latencies, failures, routed = [], [], {}
+
+    def one_job(index: int):
+        job_id = f"pool-{label}-{index}-{time.time_ns()}"
+        start = time.perf_counter()
+        try:
+            tasks.upload_to_server_b(str(input_file), job_id)
+            backend = tasks.server_b_pool.url_for(job_id)
+            routed[backend] = routed.get(backend, 0) + 1
+            if on_submitted:
+                on_submitted(index)
+            tasks.wait_for_server_b_response(job_id)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            failures.append((job_id, tasks.server_b_pool.url_for(job_id), repr(e)))
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one_job, range(args.jobs)))
+    return {'latencies': latencies, 'failures': failures, 'routed': routed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server B pool check")
+    parser.add_argument('--backends', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=12)
+    parser.add_argument('--seconds', type=float, default=1.0, help="一般 Server B 的模擬處理時間")
+    parser.add_argument('--slow-seconds', type=float, default=4.0, help="第一台 Server B 的模擬處理時間")
+    parser.add_argument('--base-port', type=int, default=18101)
+    parser.add_argument('--hedge-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    urls = [f"http://127.0.0.1:{args.base_port + i}" for i in range(args.backends)]
+    with tempfile.TemporaryDirectory(prefix="drc_pool_") as tmp:
+        tmp = Path(tmp)
+        os.environ.update({
+            'API_SERVER_B_URL': urls[0],
+            'API_SERVER_B_KEY': API_KEY,
+            'RESULTS_DIR': str(tmp / "main_results"),
+            'SERVER_B_HEDGE_MS': str(args.hedge_ms),
+            # 讓 failover 階段在檢查時間內觸發與恢復
+            'SERVER_B_BREAKER_FAILURES': '2',
+            'SERVER_B_HEALTH_TTL': '0.5',
+        })
+        import tasks  # noqa: E402  (讀取上面的環境變數)
+        from server_b_pool import ServerBPool  # noqa: E402
+
+        procs = [start_server_b(args.base_port + i, args.slow_seconds if i == 0 else args.seconds,
+                                tmp / f"server_b_{i}")
+                 for i in range(args.backends)]
+        ok = True
+        try:
+            print(f"{'mode':>9} {'p50 s':>7} {'p99 s':>7} {'failed':>7}  routed")
+            for mode in ('single', 'pool', 'failover'):
+                tasks.server_b_pool = ServerBPool(urls[:1] if mode == 'single' else urls, tasks.get_redis)
+                on_submitted = None
+                if mode == 'failover':
+                    killed = {}
+
+                    def on_submitted(index):
+                        if index >= args.jobs // 3 and not killed:
+                            killed['url'] = urls[1]
+                            procs[1].terminate()
+
+                result = run_jobs(tasks, args, mode, tmp, on_submitted)
+                lat = result['latencies']
+                routed = ", ".join(f"{url.rsplit(':', 1)[1]}={count}" for url, count in sorted(result['routed'].items()))
+                print(f"{mode:>9} {percentile(lat, 50):>7.2f} {percentile(lat, 99):>7.2f} "
+                      f"{len(result['failures']):>7}  {routed}")
+                # failover 時只容許在停機當下已送到第二台的工作失敗
+                unexpected = [f for f in result['failures'] if not (mode == 'failover' and f[1] == urls[1])]
+                for job_id, backend, error in unexpected[:5]:
+                    print(f"    {job_id} @ {backend}: {error}")
+                ok = ok and not unexpected
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.wait(timeout=10)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+全流程負載測試 (Load Test) 與 Benchmark
+
+在本機啟動 main.py (uvicorn)、Celery worker 與 Server B (server_b_api_setup.py)，
+連到本機的 Redis，由 N 個並行的 WebSocket client 送出任務，量測：
+
+  - 吞吐量 (完成的任務數 / 秒)
+  - submit 到收到 completed 訊息的 p50 / p95 / p99 延遲
+  - 各行程的 RSS 記憶體 (含 Celery 子行程)
+  - Redis 執行的指令數與記憶體用量
+
+上傳的輸入檔由 create_mock_results.create_mock_batch_files 產生，
+可設定檔案大小；Server B 產生的結果數量透過 SERVER_B_MOCK_RESULT_COUNT 控制。
+
+結果可存成 baseline，之後以 --compare 比對，超過容許範圍時以非零狀態結束：
+    python -m benchmarks.loadtest --clients 8 --jobs-per-client 3 --save-baseline default
+    python -m benchmarks.loadtest --clients 8 --jobs-per-client 3 --compare default
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import redis
+import requests
+import websockets
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from create_mock_results import create_mock_batch_files  # noqa: E402
+from redis_pool import REDIS_CONFIG  # noqa: E402
+
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+SERVER_B_API_KEY = "loadtest-api-key"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def rss_kb(pid: int) -> int:
+    """讀取 /proc 中的 VmRSS (含所有子行程)"""
+    total = 0
+    pids = [pid]
+    try:
+        children = Path(f"/proc/{pid}/task/{pid}/children").read_text().split()
+        pids += [int(c) for c in children]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            for line in Path(f"/proc/{p}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+        except OSError:
+            continue
+    return total
+
+
+def wait_for_http(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"服務未在 {timeout} 秒內啟動: {url}")
+
+
+class Stack:
+    """啟動並管理 main.py / Celery worker / Server B 三個行程"""
+
+    def __init__(self, args, workdir: Path):
+        self.args = args
+        self.workdir = workdir
+        self.procs = {}
+
+    def env(self) -> dict:
+        env = dict(os.environ)
+        env.update({
+            'REDIS_URL': self.args.redis_url,
+            'API_SERVER_B_URL': f"http://127.0.0.1:{self.args.server_b_port}",
+            'API_SERVER_B_KEY': SERVER_B_API_KEY,
+            'API_POLL_INTERVAL': str(self.args.poll_interval),
+            'SERVER_B_API_KEY': SERVER_B_API_KEY,
+            'SERVER_B_PORT': str(self.args.server_b_port),
+            'SERVER_B_MOCK_PROCESSING_SECONDS': str(self.args.server_b_seconds),
+            'SERVER_B_MOCK_RESULT_COUNT': str(self.args.result_count),
+            'SERVER_B_UPLOAD_DIR': str(self.workdir / "server_b" / "uploads"),
+            'SERVER_B_RESULTS_DIR': str(self.workdir / "server_b" / "results"),
+            'SERVER_B_PROCESSING_DIR': str(self.workdir / "server_b" / "processing"),
+            'MOCK_MODEL_LOAD_SECONDS': '0',
+            'MOCK_MODEL_BATCH_OVERHEAD_SECONDS': str(self.args.model_seconds),
+            'MOCK_MODEL_PER_ITEM_SECONDS': '0',
+        })
+        return env
+
+    def start(self):
+        env = self.env()
+        (self.workdir / "server_b").mkdir(parents=True, exist_ok=True)
+        logs = self.workdir / "logs"
+        logs.mkdir(exist_ok=True)
+
+        def spawn(name, cmd, cwd):
+            log = open(logs / f"{name}.log", "w")
+            self.procs[name] = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                                start_new_session=True)
+
+        spawn('server_b', [sys.executable, "-m", "uvicorn", "server_b_api_setup:app",
+                           "--port", str(self.args.server_b_port), "--log-level", "warning"],
+              ROOT / "ServerB_setup")
+        spawn('web', [sys.executable, "-m", "uvicorn", "main:app",
+                      "--port", str(self.args.web_port), "--log-level", "warning"], ROOT)
+        spawn('worker', [sys.executable, "-m", "celery", "-A", "celery_app", "worker",
+                         "-Q", "interactive,bulk", "-c", str(self.args.concurrency), "--loglevel", "warning"],
+              ROOT)
+
+        wait_for_http(f"http://127.0.0.1:{self.args.server_b_port}/health")
+        wait_for_http(f"http://127.0.0.1:{self.args.web_port}/health")
+        time.sleep(self.args.worker_warmup)
+        print(f"服務已啟動，log 位於 {logs}")
+
+    def memory(self) -> dict:
+        return {name: rss_kb(proc.pid) for name, proc in self.procs.items()}
+
+    def stop(self):
+        for proc in self.procs.values():
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+
+
+async def run_client(args, index: int, input_file: Path, latencies: list, failures: list):
+    """一個 client：保持一條 WebSocket，依序送出任務並等待完成"""
+    client_id = f"loadtest_{index}_{uuid.uuid4().hex[:6]}"
+    base = f"127.0.0.1:{args.web_port}"
+    loop = asyncio.get_running_loop()
+
+    async with websockets.connect(f"ws://{base}/ws/{client_id}", max_size=None) as ws:
+        for _ in range(args.jobs_per_client):
+            def submit():
+                while True:
+                    with open(input_file, 'rb') as f:
+                        response = requests.post(
+                            f"http://{base}/submit-task",
+                            data={'text': args.rule_text, 'client_id': client_id},
+                            files={'files': (input_file.name, f, 'application/octet-stream')},
+                            timeout=120
+                        )
+                    if response.status_code == 429:
+                        time.sleep(float(response.headers.get('Retry-After', '1')))
+                        continue
+                    response.raise_for_status()
+                    return response.json()
+
+            start = time.perf_counter()
+            await loop.run_in_executor(None, submit)
+            while True:
+                message = json.loads(await asyncio.wait_for(ws.recv(), timeout=args.job_timeout))
+                if message.get('status') == 'completed':
+                    latencies.append(time.perf_counter() - start)
+                    break
+                if message.get('status') == 'error':
+                    failures.append(message.get('message'))
+                    break
+
+
+async def drive(args, input_file: Path):
+    latencies, failures = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(args, i, input_file, latencies, failures) for i in range(args.clients)))
+    return time.perf_counter() - start, latencies, failures
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """回傳超出容許範圍的項目"""
+    regressions = []
+    checks = [('throughput_jobs_per_s', True)] + [(k, False) for k in ('p50_s', 'p95_s', 'p99_s')]
+    for key, higher_is_better in checks:
+        old, new = baseline.get(key), result.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{key}: baseline {old:.3f} -> {new:.3f} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DRC pipeline load test")
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--jobs-per-client', type=int, default=2)
+    parser.add_argument('--input-results', type=int, default=12, help='輸入 ZIP 內的 layout/design 組數')
+    parser.add_argument('--input-gds-bytes', type=int, default=0, help='輸入 ZIP 內每個 GDS 的大小')
+    parser.add_argument('--result-count', type=int, default=12, help='Server B 每個任務產生的結果組數')
+    parser.add_argument('--concurrency', type=int, default=4, help='Celery worker 的子行程數')
+    parser.add_argument('--model-seconds', type=float, default=0.2)
+    parser.add_argument('--server-b-seconds', type=float, default=0.5)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--rule-text', default='M1 min width 0.1um; M1 spacing >= 0.12um')
+    parser.add_argument('--web-port', type=int, default=18000)
+    parser.add_argument('--server-b-port', type=int, default=18001)
+    parser.add_argument('--redis-url', default=REDIS_CONFIG['url'])
+    parser.add_argument('--worker-warmup', type=float, default=3.0)
+    parser.add_argument('--job-timeout', type=float, default=600.0)
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='允許的退步比例')
+    args = parser.parse_args()
+
+    r = redis.from_url(args.redis_url)
+    r.ping()
+
+    with tempfile.TemporaryDirectory(prefix="drc_loadtest_") as tmp:
+        workdir = Path(tmp)
+        zip_file, manifest_file = create_mock_batch_files(
+            "loadtest_input", num_results=args.input_results, gds_size=args.input_gds_bytes, output_dir=tmp)
+        input_file = Path(zip_file)
+        input_bytes = input_file.stat().st_size
+
+        stack = Stack(args, workdir)
+        try:
+            stack.start()
+            redis_before = r.info()
+            elapsed, latencies, failures = asyncio.run(drive(args, input_file))
+            redis_after = r.info()
+            memory = stack.memory()
+        finally:
+            stack.stop()
+
+    result = {
+        'clients': args.clients,
+        'jobs': len(latencies),
+        'failures': len(failures),
+        'input_bytes': input_bytes,
+        'result_count': args.result_count,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_jobs_per_s': round(len(latencies) / elapsed, 4) if elapsed else 0.0,
+        'p50_s': round(percentile(latencies, 50), 3),
+        'p95_s': round(percentile(latencies, 95), 3),
+        'p99_s': round(percentile(latencies, 99), 3),
+        'mean_s': round(statistics.mean(latencies), 3) if latencies else 0.0,
+        'rss_kb': memory,
+        'redis_commands': redis_after['total_commands_processed'] - redis_before['total_commands_processed'],
+        'redis_used_memory_bytes': redis_after['used_memory'],
+    }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if failures:
+        print(f"失敗的任務: {failures[:5]}")
+
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        path = BASELINE_DIR / f"{args.save_baseline}.json"
+        path.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+        print(f"已儲存 baseline: {path}")
+
+    if args.compare:
+        baseline = json.loads((BASELINE_DIR / f"{args.compare}.json").read_text())
+        regressions = compare(result, baseline, args.tolerance)
+        if failures:
+            regressions.append(f"{len(failures)} 個任務失敗")
+        if regressions:
+            print("效能退步:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"與 baseline '{args.compare}' 比較：沒有超過 {args.tolerance:.0%} 的退步")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Celery 訊息大小與 result backend 用量的量測
+
+以一個分 tile 處理的大型任務為例 (主任務 → N 個 tile 任務 → chord 合併)，
+比較三種設定下每個任務寫進 Redis 的位元組數：
+
+  json             原本的設定：JSON 序列化，所有任務都寫入結果
+  msgpack          msgpack 序列化，只有 tile 任務寫入結果 (ignore_result)
+  msgpack+offload  同上，且超過 TASK_PAYLOAD_OFFLOAD_BYTES 的參數與結果改存 blob store
+
+訊息 body 依 Celery protocol 2 的 (args, kwargs, embed) 格式序列化；結果依 result backend
+寫入的 meta 格式序列化。加上 --redis-url 時另外回報該 Redis 中 celery-task-meta-* 的實際記憶體用量。
+
+用法 (在專案根目錄執行):
+    python -m benchmarks.measure_task_payloads --files 2000 --tiles 16
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import msgpack
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import payload_store  # noqa: E402
+from rule_compiler import get_compiled_rules  # noqa: E402
+from tiling import partition_layout  # noqa: E402
+
+
+def sample_rule_text(rules: int) -> str:
+    checks = ['width', 'spacing', 'enclosure', 'area']
+    return '\n'.join(f"{checks[i % 4]} M{i % 9 + 1} >= {0.05 + i * 0.001:.3f}um" for i in range(rules))
+
+
+def sample_batch_results(task_id: str, results: int) -> dict:
+    files = []
+    manifest_files = []
+    for i in range(results):
+        for kind in ('png', 'gds'):
+            name = f"{'output' if kind == 'png' else 'layout'}_{i:03d}.{kind}"
+            manifest_files.append({'filename': name, 'type': kind, 'description': f"DRC result {i} ({kind})"})
+            files.append({**manifest_files[-1], 'url': f"/results/{task_id[:2]}/{task_id}/{name}"})
+    return {
+        'batch_id': task_id,
+        'total_count': len(files),
+        'files': files,
+        'png_files': [f['filename'] for f in files if f['type'] == 'png'],
+        'gds_files': [f['filename'] for f in files if f['type'] == 'gds'],
+        'zip_file': f"{task_id}_results.zip",
+        'manifest': {'task_id': task_id, 'files': manifest_files},
+    }
+
+
+def build_job(args):
+    """回傳 [(任務名稱, args, 回傳值, 是否需要結果)]，依實際執行順序排列"""
+    client_id = str(uuid.uuid4())
+    task_id = str(uuid.uuid4())
+    file_paths = [f"uploads/{uuid.uuid4()}_block_{i:05d}.gds" for i in range(args.files)]
+    rule_text = sample_rule_text(args.rules)
+    compiled_rules = get_compiled_rules(rule_text)
+    tiles = partition_layout((0, 0, 100000, 100000), tile_size=100000 // int(args.tiles ** 0.5) + 1,
+                             max_tiles=args.tiles)
+
+    job = [('run_ai_processing_task', (client_id, file_paths, rule_text, False), "已分派 tile 任務", False)]
+    tile_results = []
+    for tile in tiles:
+        result = {'tile': tile, 'batch_results': sample_batch_results(f"{task_id}_tile{tile['index']:03d}",
+                                                                      args.results_per_tile)}
+        tile_results.append(result)
+        job.append(('process_tile_task', (task_id, file_paths, compiled_rules, tile), result, True))
+    job.append(('merge_tile_results_task', (tile_results, client_id, task_id, file_paths, False),
+                "任務流程結束", False))
+    return job
+
+
+def encode(value, serializer: str) -> bytes:
+    if serializer == 'json':
+        return json.dumps(value, ensure_ascii=False).encode('utf-8')
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def measure(job, serializer: str, ignore_results: bool, offload: bool):
+    message_bytes = 0
+    result_bytes = 0
+    largest = ('', 0)
+    chord_results = []
+    for name, task_args, result, needs_result in job:
+        if name == 'merge_tile_results_task' and offload:
+            # chord 回呼收到的是 backend 中各 tile 的 (已 offload 的) 結果
+            task_args = (chord_results,) + task_args[1:]
+        if offload:
+            task_args, _ = payload_store.offload_args(task_args, {})
+        body = encode([list(task_args), {}, {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}],
+                      serializer)
+        message_bytes += len(body)
+        largest = max(largest, (name, len(body)), key=lambda item: item[1])
+
+        if ignore_results and not needs_result:
+            continue
+        stored = payload_store.offload_value(result) if offload else result
+        if name == 'process_tile_task':
+            chord_results.append(stored)
+        meta = {'status': 'SUCCESS', 'result': stored, 'traceback': None, 'children': [],
+                'date_done': '2026-01-01T00:00:00.000000', 'task_id': str(uuid.uuid4())}
+        result_bytes += len(encode(meta, serializer))
+    return message_bytes, result_bytes, largest
+
+
+def live_result_backend_usage(redis_url: str):
+    import redis
+    client = redis.Redis.from_url(redis_url)
+    keys = 0
+    total = 0
+    for key in client.scan_iter(match='celery-task-meta-*', count=1000):
+        keys += 1
+        total += client.memory_usage(key) or 0
+    return keys, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Celery payload size measurement")
+    parser.add_argument('--files', type=int, default=2000, help="任務的輸入檔案數")
+    parser.add_argument('--rules', type=int, default=400, help="rule deck 的行數")
+    parser.add_argument('--tiles', type=int, default=16)
+    parser.add_argument('--results-per-tile', type=int, default=24)
+    parser.add_argument('--redis-url', default=None, help="另外量測此 Redis 中 result backend 的實際用量")
+    args = parser.parse_args()
+
+    job = build_job(args)
+    with tempfile.TemporaryDirectory(prefix="drc_blobs_") as tmp:
+        payload_store.BLOB_CONFIG['blob_dir'] = Path(tmp)
+        print(f"{len(job)} 個任務 (1 個主任務、{len(job) - 2} 個 tile、1 個合併)，"
+              f"offload 門檻 {payload_store.BLOB_CONFIG['threshold_bytes'] / 1024:.0f} KB\n")
+        print(f"{'mode':>16} {'messages KB':>12} {'results KB':>11} {'largest message':>32}")
+        for mode, serializer, ignore_results, offload in (
+                ('json', 'json', False, False),
+                ('msgpack', 'msgpack', True, False),
+                ('msgpack+offload', 'msgpack', True, True)):
+            messages, results, (largest_name, largest_size) = measure(job, serializer, ignore_results, offload)
+            print(f"{mode:>16} {messages / 1024:>12.1f} {results / 1024:>11.1f} "
+                  f"{largest_name + f' {largest_size / 1024:.1f} KB':>32}")
+        blobs = list(Path(tmp).glob('*/*'))
+        print(f"\nblob store: {len(blobs)} 個 blob，共 {sum(p.stat().st_size for p in blobs) / 1024:.1f} KB "
+              f"(相同內容只存一份)")
+
+    if args.redis_url:
+        keys, total = live_result_backend_usage(args.redis_url)
+        print(f"\n{args.redis_url}: {keys} 個 celery-task-meta-* key，共 {total / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Celery worker / Server B executor 自動擴縮的模擬 (離散事件模擬)
+
+情境：平時每分鐘約 --base-rate 個任務，每 --burst-every 秒有一波 --burst-jobs 個任務在
+--burst-seconds 秒內湧入。每個任務先佔用一個 Celery 行程做前處理 (模型推論)，再送到 Server B
+排隊處理 (Celery 行程在等待期間仍被佔用，與 tasks.py 相同)，最後由同一個行程下載結果。
+
+比較三種設定的延遲 (submit 到 complete)、Celery 排隊時間與平均配置的大小 (成本)：
+  fixed-min   Celery 與 Server B 固定為下限
+  fixed-max   固定為上限 (以尖峰配置)
+  autoscale   從下限開始，每 --interval 秒以 autoscaler.ScalingPolicy 決定新的大小；
+              新的 Celery 行程要 --spawn-seconds 秒 (fork + 載入模型) 後才能接任務
+
+autoscale 的大小必須一直在上下限之內，縮減前必須經過 cooldown (否則視為 hysteresis 失效)，
+且 p95 延遲要低於 fixed-min；任一條件不成立時以非零狀態結束。
+
+用法 (在專案根目錄執行):
+    python -m benchmarks.sim_autoscaling --hours 4 --burst-jobs 80
+"""
+
+import argparse
+import heapq
+import random
+import sys
+from collections import deque
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from autoscaler import AUTOSCALE_CONFIG, ScalingPolicy  # noqa: E402
+from benchmarks.sim_priority_lanes import percentile  # noqa: E402
+
+
+def generate_jobs(args, rng):
+    """Poisson 的基本負載加上週期性的突發"""
+    horizon = args.hours * 3600
+    arrivals = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(args.base_rate / 60)
+        if t > horizon:
+            break
+        arrivals.append(t)
+    start = args.burst_every / 2
+    while start < horizon:
+        arrivals += [start + rng.uniform(0, args.burst_seconds) for _ in range(args.burst_jobs)]
+        start += args.burst_every
+    return [{'arrival': t,
+             'pre': rng.expovariate(1 / args.pre_seconds),
+             'server_b': rng.expovariate(1 / args.server_b_seconds),
+             'post': rng.expovariate(1 / args.post_seconds)} for t in sorted(arrivals)]
+
+
+class Tier:
+    """一組可調整大小的處理容量 (Celery pool 或 Server B executor)"""
+
+    def __init__(self, name: str, size: int, spawn_seconds: float):
+        self.name = name
+        self.capacity = size
+        self.spawn_seconds = spawn_seconds
+        # 已經決定擴充、尚未可以接任務的數量 [(ready_at, count)]
+        self.pending = deque()
+        self.busy = 0
+        self.queue = deque()
+        self.area = 0.0
+        self.last = 0.0
+        self.history = []
+
+    def current(self) -> int:
+        return self.capacity + sum(count for _, count in self.pending)
+
+    def account(self, now: float):
+        self.area += self.current() * (now - self.last)
+        self.last = now
+
+    def resize(self, now: float, target: int) -> list:
+        """回傳需要排入的 ready 事件時間"""
+        self.history.append((now, self.current(), target))
+        diff = target - self.current()
+        if diff > 0:
+            if self.spawn_seconds <= 0:
+                self.capacity += diff
+                return []
+            self.pending.append((now + self.spawn_seconds, diff))
+            return [now + self.spawn_seconds]
+        # 縮減時先取消還沒啟動的部分
+        while diff < 0 and self.pending:
+            ready_at, count = self.pending.pop()
+            cancel = min(count, -diff)
+            if count > cancel:
+                self.pending.append((ready_at, count - cancel))
+            diff += cancel
+        self.capacity += diff
+        return []
+
+    def ready(self, now: float):
+        while self.pending and self.pending[0][0] <= now:
+            self.capacity += self.pending.popleft()[1]
+
+    def snapshot(self, now: float) -> tuple:
+        oldest = now - self.queue[0][0] if self.queue else 0.0
+        return self.current(), self.busy, len(self.queue), oldest
+
+
+def simulate(jobs, args, mode: str, config: dict):
+    if mode == 'fixed-max':
+        celery_size, server_b_size = args.celery_max, args.server_b_max
+    else:
+        celery_size, server_b_size = args.celery_min, args.server_b_min
+    celery = Tier('celery', celery_size, args.spawn_seconds if mode == 'autoscale' else 0)
+    server_b = Tier('server_b', server_b_size, 0)
+    policies = {celery.name: ScalingPolicy(args.celery_min, args.celery_max, config),
+                server_b.name: ScalingPolicy(args.server_b_min, args.server_b_max, config)}
+
+    events = []
+    seq = 0
+
+    def push(at, kind, payload=None):
+        nonlocal seq
+        heapq.heappush(events, (at, seq, kind, payload))
+        seq += 1
+
+    for job in jobs:
+        push(job['arrival'], 'arrive', job)
+    end = jobs[-1]['arrival'] if jobs else 0.0
+    if mode == 'autoscale':
+        push(args.interval, 'tick')
+
+    latencies, waits = [], []
+    done = 0
+
+    def dispatch(now):
+        while celery.queue and celery.busy < celery.capacity:
+            enqueued, job = celery.queue.popleft()
+            celery.busy += 1
+            waits.append(now - enqueued)
+            push(now + job['pre'], 'pre_done', job)
+        while server_b.queue and server_b.busy < server_b.capacity:
+            _, job = server_b.queue.popleft()
+            server_b.busy += 1
+            push(now + job['server_b'], 'server_b_done', job)
+
+    while events:
+        now, _, kind, job = heapq.heappop(events)
+        celery.account(now)
+        server_b.account(now)
+        if kind == 'arrive':
+            celery.queue.append((now, job))
+        elif kind == 'pre_done':
+            server_b.queue.append((now, job))
+        elif kind == 'server_b_done':
+            server_b.busy -= 1
+            push(now + job['post'], 'post_done', job)
+        elif kind == 'post_done':
+            celery.busy -= 1
+            latencies.append(now - job['arrival'])
+            done += 1
+        elif kind == 'ready':
+            celery.ready(now)
+        elif kind == 'tick':
+            for tier in (celery, server_b):
+                current, busy, backlog, oldest = tier.snapshot(now)
+                target, direction = policies[tier.name].decide(current, busy, backlog, oldest, now)
+                if direction != 'hold':
+                    for ready_at in tier.resize(now, target):
+                        push(ready_at, 'ready')
+            # 所有任務完成後停止評估
+            if done < len(jobs) or now < end:
+                push(now + args.interval, 'tick')
+        dispatch(now)
+
+    duration = max(celery.last, 1e-9)
+    return {
+        'latencies': latencies, 'waits': waits,
+        'celery_avg': celery.area / duration, 'server_b_avg': server_b.area / duration,
+        'tiers': (celery, server_b),
+    }
+
+
+def check_hysteresis(tier: Tier, minimum: int, maximum: int, cooldown: float) -> list:
+    """大小超出範圍，或在上次調整後 cooldown 秒內縮減"""
+    problems = []
+    last_change = float('-inf')
+    for at, before, after in tier.history:
+        if not minimum <= after <= maximum:
+            problems.append(f"{tier.name} t={at:.0f}s 調整為 {after}，超出 [{minimum}, {maximum}]")
+        if after < before and at - last_change < cooldown:
+            problems.append(f"{tier.name} t={at:.0f}s 在上次調整 {at - last_change:.0f}s 後就縮減")
+        last_change = at
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Autoscaling under bursty load")
+    parser.add_argument('--hours', type=float, default=4.0)
+    parser.add_argument('--base-rate', type=float, default=2.0, help="平時每分鐘的任務數")
+    parser.add_argument('--burst-every', type=float, default=1800.0)
+    parser.add_argument('--burst-jobs', type=int, default=80)
+    parser.add_argument('--burst-seconds', type=float, default=60.0)
+    parser.add_argument('--pre-seconds', type=float, default=20.0, help="Celery 前處理平均秒數")
+    parser.add_argument('--server-b-seconds', type=float, default=40.0, help="Server B 處理平均秒數")
+    parser.add_argument('--post-seconds', type=float, default=3.0, help="下載結果平均秒數")
+    parser.add_argument('--celery-min', type=int, default=2)
+    parser.add_argument('--celery-max', type=int, default=24)
+    parser.add_argument('--server-b-min', type=int, default=2)
+    parser.add_argument('--server-b-max', type=int, default=16)
+    parser.add_argument('--spawn-seconds', type=float, default=5.0, help="新 Celery 行程可以接任務前的時間")
+    parser.add_argument('--interval', type=float, default=AUTOSCALE_CONFIG['interval'])
+    parser.add_argument('--up-wait', type=float, default=AUTOSCALE_CONFIG['up_wait_seconds'])
+    parser.add_argument('--down-rounds', type=int, default=AUTOSCALE_CONFIG['down_rounds'])
+    parser.add_argument('--down-cooldown', type=float, default=AUTOSCALE_CONFIG['down_cooldown_seconds'])
+    parser.add_argument('--max-step', type=int, default=AUTOSCALE_CONFIG['max_step'])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    config = {**AUTOSCALE_CONFIG, 'up_wait_seconds': args.up_wait, 'down_rounds': args.down_rounds,
+              'down_cooldown_seconds': args.down_cooldown, 'max_step': args.max_step}
+    jobs = generate_jobs(args, random.Random(args.seed))
+    print(f"{len(jobs)} 個任務，{args.hours:g} 小時，每 {args.burst_every:g} 秒一波 {args.burst_jobs} 個\n")
+    print(f"{'mode':>10} {'p50(s)':>8} {'p95(s)':>8} {'max(s)':>8} {'wait p95':>9} "
+          f"{'celery avg':>11} {'B avg':>7} {'resizes':>8}")
+
+    results = {}
+    for mode in ('fixed-min', 'fixed-max', 'autoscale'):
+        result = simulate(jobs, args, mode, config)
+        results[mode] = result
+        lat = result['latencies']
+        resizes = sum(len(tier.history) for tier in result['tiers'])
+        print(f"{mode:>10} {percentile(lat, 50):>8.1f} {percentile(lat, 95):>8.1f} {max(lat):>8.1f} "
+              f"{percentile(result['waits'], 95):>9.1f} {result['celery_avg']:>11.1f} "
+              f"{result['server_b_avg']:>7.1f} {resizes:>8}")
+
+    celery, server_b = results['autoscale']['tiers']
+    problems = (check_hysteresis(celery, args.celery_min, args.celery_max, args.down_cooldown)
+                + check_hysteresis(server_b, args.server_b_min, args.server_b_max, args.down_cooldown))
+    if percentile(results['autoscale']['latencies'], 95) >= percentile(results['fixed-min']['latencies'], 95):
+        problems.append("autoscale 的 p95 延遲沒有低於 fixed-min")
+    for problem in problems[:10]:
+        print(f"  {problem}")
+    print(f"\n{'OK' if not problems else 'FAILED'}")
+    sys.exit(0 if not problems else 1)
+
+
+if __name__ == "__main__":
+    main()
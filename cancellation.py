@@ -0,0 +1,149 @@
+"""
+任務取消
+
+取消由 web 端發起 (POST /tasks/{task_id}/cancel，或 client 斷線超過寬限時間後自動取消)：
+  1. 在 Redis 設定取消旗標，並以 Celery revoke 讓還在佇列中的任務不會開始
+  2. 已經在執行的任務在各階段之間呼叫 checkpoint()，看到旗標就丟出 TaskCancelled，
+     清理暫存檔並取消 Server B 上的工作
+  3. web 端同時呼叫 Server B 的 cancel API，讓正在長輪詢 / 訂閱狀態的 worker 立即醒來
+
+每個 client 執行中的任務記在 drc:cancel:active:{client_id}，提交時加入、任務結束時移除。
+取消在哪個階段生效 (也就是省下了之後哪些階段的 worker 與 Server B 時間) 記在統計中，由 /metrics 輸出。
+"""
+
+import os
+import time
+from typing import Dict, List, Optional
+
+CANCEL_CONFIG = {
+    'key_prefix': os.getenv('CANCEL_KEY_PREFIX', 'drc:cancel'),
+    # 取消旗標與執行中任務清單的保留時間，需大於任務最長執行時間
+    'ttl_seconds': int(os.getenv('CANCEL_TTL_SECONDS', str(2 * 60 * 60))),
+    # client 的 WebSocket 斷線超過此秒數仍未重新連線時，取消它執行中的任務；0 代表不自動取消
+    'disconnect_grace_seconds': float(os.getenv('CANCEL_ON_DISCONNECT_GRACE', '0')),
+}
+
+
+class TaskCancelled(Exception):
+    """任務已被取消 (由 checkpoint 丟出)"""
+
+    def __init__(self, task_id: str, stage: str):
+        super().__init__(f"Task {task_id} cancelled before {stage}")
+        self.task_id = task_id
+        self.stage = stage
+
+
+def _key(name: str) -> str:
+    return f"{CANCEL_CONFIG['key_prefix']}:{name}"
+
+
+def _active_key(client_id: str) -> str:
+    return _key(f"active:{client_id}")
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+# --- web 端 (非同步 Redis client) ---
+
+async def atrack_task(redis_client, client_id: str, task_id: str):
+    """提交任務時記錄為 client 執行中的任務"""
+    pipe = redis_client.pipeline()
+    pipe.sadd(_active_key(client_id), task_id)
+    pipe.expire(_active_key(client_id), CANCEL_CONFIG['ttl_seconds'])
+    await pipe.execute()
+
+
+async def auntrack_task(redis_client, client_id: str, task_id: str):
+    """任務沒有成功送出時，從 client 的執行中清單移除 (atrack_task 的反向操作)"""
+    await redis_client.srem(_active_key(client_id), task_id)
+
+
+async def aactive_tasks(redis_client, client_id: str) -> List[str]:
+    return [_decode(task_id) for task_id in await redis_client.smembers(_active_key(client_id))]
+
+
+async def arequest_cancel(redis_client, task_id: str, reason: str) -> bool:
+    """設定取消旗標；已經取消過時回傳 False"""
+    created = await redis_client.set(_key(f"task:{task_id}"), reason, nx=True, ex=CANCEL_CONFIG['ttl_seconds'])
+    if created:
+        await redis_client.hincrby(_key('stats'), f"requested_{reason}", 1)
+    return bool(created)
+
+
+async def get_cancel_stats(redis_client) -> Dict[str, float]:
+    """累計的取消統計 (非同步，供 /metrics 使用)"""
+    stats = await redis_client.hgetall(_key('stats')) or {}
+    return {_decode(k): float(v) for k, v in stats.items()}
+
+
+# --- worker 端 (同步 Redis client) ---
+
+def is_cancelled(redis_client, task_id: str) -> bool:
+    try:
+        return bool(redis_client.exists(_key(f"task:{task_id}")))
+    except Exception as e:
+        # Redis 暫時無法連線時不中斷任務
+        print(f"讀取取消旗標失敗: {e}")
+        return False
+
+
+def checkpoint(redis_client, task_id: Optional[str], stage: str):
+    """在進入 stage 之前確認任務是否已被取消，是則丟出 TaskCancelled"""
+    if task_id and is_cancelled(redis_client, task_id):
+        raise TaskCancelled(task_id, stage)
+
+
+def record_cancelled(redis_client, stage: str, started_at: Optional[float] = None):
+    """記錄取消在哪個階段生效，以及任務在取消前已經執行的秒數"""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hincrby(_key('stats'), f"cancelled_{stage}", 1)
+        if started_at:
+            pipe.hincrbyfloat(_key('stats'), 'cancelled_runtime_seconds', max(0.0, time.time() - started_at))
+        pipe.execute()
+    except Exception as e:
+        print(f"記錄取消統計失敗: {e}")
+
+
+def record_server_b_cancelled(redis_client):
+    try:
+        redis_client.hincrby(_key('stats'), 'server_b_cancelled', 1)
+    except Exception as e:
+        print(f"記錄取消統計失敗: {e}")
+
+
+def cancel_on_server_b(redis_client, base_url: str, task_id: str, headers: Dict[str, str],
+                       cancel_endpoint: str = '/api/v1/cancel', timeout: float = 30) -> bool:
+    """
+    取消 Server B 上的工作 (已結束或不存在時回傳 False)
+
+    web 端 (task_client) 與 worker (tasks.py) 共用；base_url 為接收上傳的那台 Server B。
+    """
+    # web 行程只有取消時才需要 requests，不在 import 時載入
+    import requests
+
+    try:
+        response = requests.post(f"{base_url}{cancel_endpoint}/{task_id}", headers=headers, timeout=timeout)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        cancelled = bool(response.json().get('success'))
+        if cancelled:
+            print(f"已取消 Server B 上的工作 {task_id}")
+            record_server_b_cancelled(redis_client)
+        return cancelled
+    except requests.exceptions.RequestException as e:
+        print(f"取消 Server B 工作失敗: {e}")
+        return False
+
+
+def untrack_task(redis_client, client_id: Optional[str], task_id: str):
+    """任務結束 (完成、失敗或取消) 時從 client 的執行中清單移除"""
+    if not client_id or not task_id:
+        return
+    try:
+        redis_client.srem(_active_key(client_id), task_id)
+    except Exception as e:
+        print(f"更新執行中任務清單失敗: {e}")
@@ -1,17 +1,65 @@
+import os
+
 from celery import Celery
+from kombu import Queue
+
+from model_server import MODEL_CONFIG
+from result_store import STORE_CONFIG
+from redis_pool import REDIS_CONFIG, celery_url
 
 # 這裡使用 Redis 作為訊息中間人 (Broker) 和結果後端 (Backend)
-# 在生產環境中，請確保 Redis 服務正在運行
-CELERY_BROKER_URL = "redis://localhost:6379/0"
-CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
+# 在生產環境中，請確保 Redis 服務正在運行；位置由 REDIS_URL (或 REDIS_UNIX_SOCKET) 設定
+CELERY_BROKER_URL = celery_url()
+CELERY_RESULT_BACKEND = celery_url()
 
 celery_app = Celery(
     "tasks",
     broker=CELERY_BROKER_URL,
     backend=CELERY_RESULT_BACKEND,
-    include=["tasks"] # 要包含的任務模組
+    include=["tasks"], # 要包含的任務模組
+    # [新增] 所有任務送出時將大型參數 offload 到 blob store，執行前還原
+    task_cls="payload_store:OffloadingTask"
 )
 
 celery_app.conf.update(
     task_track_started=True,
+    # [新增] 訊息與結果改用 msgpack (比 JSON 小且快)；仍接受 JSON，讓舊版送出的訊息可以被處理
+    task_serializer="msgpack",
+    result_serializer="msgpack",
+    accept_content=["msgpack", "json"],
+    # 結果只需保留到 chord 合併或呼叫端讀取為止；不需要結果的任務以 ignore_result=True 宣告
+    result_expires=int(os.getenv("CELERY_RESULT_EXPIRES", "3600")),
+    # [新增] 兩條 lane：互動式的單次檢查與大量批次分開排隊，避免大量批次卡住互動任務
+    # 建議至少保留一個只消費 interactive 的 worker：
+    #   celery -A celery_app worker -Q interactive -n interactive@%h
+    #   celery -A celery_app worker -Q bulk,interactive -n bulk@%h
+    task_queues=(
+        Queue("interactive"),
+        Queue("bulk"),
+    ),
+    task_default_queue="interactive",
+    # 每個子行程一次只預取一個訊息，且任務完成後才 ack，
+    # 長時間的任務不會把其他訊息扣在自己手上
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # 子行程在 worker_process_init 載入並 warmup 模型後才回報啟動完成，
+    # 等待時間必須大於載入時間，否則子行程會在載入途中被終止並一再重啟
+    worker_proc_alive_timeout=MODEL_CONFIG['worker_start_timeout'],
+    # acks_late 時，未 ack 的訊息超過此秒數會被重新派送，必須大於最長任務時間
+    broker_transport_options={
+        "visibility_timeout": 2 * 60 * 60,
+        "health_check_interval": REDIS_CONFIG['health_check_interval'],
+    },
+    redis_backend_health_check_interval=REDIS_CONFIG['health_check_interval'],
+    redis_socket_connect_timeout=REDIS_CONFIG['socket_connect_timeout'],
+    redis_retry_on_timeout=True,
+    # [新增] 定期清理過期或超過 quota 的結果，需另外啟動 beat：celery -A celery_app beat
+    beat_schedule={
+        "sweep-results": {
+            "task": "tasks.sweep_results_task",
+            "schedule": STORE_CONFIG['sweep_interval_seconds'],
+            "options": {"queue": "bulk"},
+        },
+    },
 )
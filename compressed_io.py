@@ -0,0 +1,251 @@
+"""
+壓縮檔的上傳與傳送
+
+GDS 壓縮後通常只有原本的 1/5 ~ 1/10，因此：
+  - /submit-task 接受 gzip、zstd 與 zip 壓縮的檔案，格式依檔案開頭的 magic bytes 判斷 (不看副檔名)。
+    ingest_upload() 以串流方式解壓縮到 uploads 目錄，之後的流程 (tiling、模型、Server B) 讀到的都是
+    原始檔案；未壓縮的檔案照舊直接複製。
+  - 上傳到 Server B 時以 iter_compressed() 邊讀邊壓縮，Server B 收到後同樣邊解壓縮邊寫入，
+    原始與壓縮後的內容都不會整份放在記憶體中。
+
+解壓縮炸彈 (zip bomb) 的防護：
+  - 單次上傳解壓縮後的總大小上限 UPLOAD_MAX_UNCOMPRESSED_BYTES
+  - 解壓縮後超過 UPLOAD_RATIO_MIN_BYTES 時，壓縮比不得超過 UPLOAD_MAX_COMPRESSION_RATIO
+    (以實際讀入的壓縮資料計算，不相信 zip 目錄中宣告的大小)
+  - zip 的成員數上限 UPLOAD_MAX_ZIP_MEMBERS；加密的成員與目錄結構一律不接受/忽略，
+    成員只取檔名 (不會寫到 uploads 目錄以外)
+超過限制時丟出 DecompressionBomb，已寫出的檔案會被刪除。
+
+zstd 需要 zstandard 套件；未安裝時 zstd 上傳會被拒絕，傳送到 Server B 改用 gzip。
+"""
+
+import os
+import gzip
+import zlib
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstandard 為選用套件，未安裝時不支援 zstd
+    zstandard = None
+
+COMPRESSION_CONFIG = {
+    'chunk_size': int(os.getenv('UPLOAD_DECOMPRESS_CHUNK_SIZE', str(1024 * 1024))),
+    'max_uncompressed_bytes': int(os.getenv('UPLOAD_MAX_UNCOMPRESSED_BYTES', str(16 * 1024 ** 3))),
+    'max_ratio': float(os.getenv('UPLOAD_MAX_COMPRESSION_RATIO', '200')),
+    # 解壓縮後的資料少於此大小時不檢查壓縮比 (小檔案的壓縮比本來就可能很高)
+    'ratio_min_bytes': int(os.getenv('UPLOAD_RATIO_MIN_BYTES', str(64 * 1024 * 1024))),
+    'max_zip_members': int(os.getenv('UPLOAD_MAX_ZIP_MEMBERS', '256')),
+}
+
+# 檔案開頭的 magic bytes
+_MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+    (b'PK\x03\x04', 'zip'),
+    (b'PK\x05\x06', 'zip'),  # 空的 zip
+)
+
+# 解壓縮後從檔名去掉的副檔名
+_COMPRESSED_SUFFIXES = {'.gz', '.gzip', '.zst', '.zstd', '.zip'}
+
+
+# 壓縮資料損毀或不完整時各格式丟出的例外 (gzip.BadGzipFile 是 OSError 的子類別)
+_DECOMPRESS_ERRORS = (zipfile.BadZipFile, EOFError, OSError, zlib.error) + (
+    (zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class UnsupportedCompression(Exception):
+    """無法處理的壓縮格式 (例如未安裝 zstandard 時的 zstd)"""
+
+
+class DecompressionBomb(Exception):
+    """解壓縮後的大小或壓縮比超過限制"""
+
+
+def detect_compression(head: bytes) -> Optional[str]:
+    """依開頭的 magic bytes 判斷壓縮格式：'gzip'、'zstd'、'zip' 或 None (未壓縮)"""
+    for magic, kind in _MAGIC:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def stored_name(filename: str) -> str:
+    """解壓縮後的檔名：去掉壓縮格式的副檔名 (layout.gds.gz -> layout.gds)"""
+    name = Path(filename or 'upload').name
+    while Path(name).suffix.lower() in _COMPRESSED_SUFFIXES and Path(name).stem:
+        name = Path(name).stem
+    return name
+
+
+class _Budget:
+    """累計解壓縮後的位元組數，超過總大小或壓縮比上限時丟出 DecompressionBomb"""
+
+    def __init__(self):
+        self.written = 0
+
+    def add(self, count: int, compressed_read: Optional[int] = None):
+        """compressed_read 為 None 時 (未壓縮的檔案) 只檢查總大小"""
+        self.written += count
+        if self.written > COMPRESSION_CONFIG['max_uncompressed_bytes']:
+            raise DecompressionBomb(
+                f"解壓縮後超過 {COMPRESSION_CONFIG['max_uncompressed_bytes']} bytes 的上限")
+        if (compressed_read is not None and self.written > COMPRESSION_CONFIG['ratio_min_bytes']
+                and self.written > COMPRESSION_CONFIG['max_ratio'] * max(compressed_read, 1)):
+            raise DecompressionBomb(
+                f"壓縮比超過 {COMPRESSION_CONFIG['max_ratio']:g} 倍 "
+                f"({compressed_read} bytes 解壓縮為 {self.written} bytes 以上)")
+
+
+def _copy_guarded(reader, dest: Path, budget: _Budget,
+                  compressed_read: Optional[Callable[[], int]] = None) -> int:
+    """從 reader 分段讀出並寫入 dest，每段都檢查 budget，回傳寫入的位元組數"""
+    written = 0
+    with open(dest, 'wb') as out:
+        while True:
+            chunk = reader.read(COMPRESSION_CONFIG['chunk_size'])
+            if not chunk:
+                return written
+            budget.add(len(chunk), compressed_read() if compressed_read else None)
+            out.write(chunk)
+            written += len(chunk)
+
+
+def _stream_reader(src: BinaryIO, kind: str):
+    """gzip / zstd 的串流解壓縮 reader (支援多個 member / frame 串接的檔案)"""
+    if kind == 'gzip':
+        return gzip.GzipFile(fileobj=src, mode='rb')
+    if zstandard is None:
+        raise UnsupportedCompression("未安裝 zstandard 套件，無法解壓縮 zstd 檔案")
+    return zstandard.ZstdDecompressor().stream_reader(src, read_across_frames=True)
+
+
+def _unique_path(dest_dir: Path, prefix: str, name: str) -> Path:
+    """與原本的上傳命名相同 ({prefix}_{stem}_{suffix})，zip 中有同名檔案時加上序號"""
+    stem, suffix = Path(name).stem, Path(name).suffix
+    path = dest_dir / f"{prefix}_{stem}_{suffix}"
+    index = 1
+    while path.exists():
+        path = dest_dir / f"{prefix}_{stem}-{index}_{suffix}"
+        index += 1
+    return path
+
+
+def _extract_zip(src: BinaryIO, dest_dir: Path, prefix: str, budget: _Budget, saved: List[Path]):
+    archive_size = src.seek(0, os.SEEK_END)
+    src.seek(0)
+    with zipfile.ZipFile(src) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if len(members) > COMPRESSION_CONFIG['max_zip_members']:
+            raise DecompressionBomb(f"zip 內有 {len(members)} 個檔案，超過 "
+                                    f"{COMPRESSION_CONFIG['max_zip_members']} 個的上限")
+        # 宣告的大小不可信，但明顯超過上限時不必開始解壓縮
+        declared = sum(info.file_size for info in members)
+        if declared > COMPRESSION_CONFIG['max_uncompressed_bytes']:
+            raise DecompressionBomb(f"zip 宣告的解壓縮大小 {declared} bytes 超過上限")
+        consumed = 0
+        for info in members:
+            if info.flag_bits & 0x1:
+                raise UnsupportedCompression(f"不支援加密的 zip 成員: {info.filename}")
+            # 只取檔名，忽略 zip 內的目錄 (包含 ../ 與絕對路徑)
+            name = Path(info.filename.replace('\\', '/')).name
+            if not name:
+                continue
+            dest = _unique_path(dest_dir, prefix, name)
+            saved.append(dest)
+            with archive.open(info) as reader:
+                # ZipExtFile 沒有提供已讀取的壓縮位元組數，以成員宣告的壓縮大小估計
+                # (讀完時一定等於它)；宣告值可以造假，因此不超過整個 zip 的大小
+                _copy_guarded(reader, dest, budget, lambda: min(consumed + info.compress_size, archive_size))
+            consumed += info.compress_size
+
+
+def ingest_upload(src: BinaryIO, dest_dir: Path, prefix: str, filename: str) -> List[Path]:
+    """
+    將上傳的檔案存到 dest_dir，壓縮檔以串流方式解壓縮 (會讀寫磁碟，請在 I/O 執行緒呼叫)
+
+    未壓縮與 gzip / zstd 檔案存成一個檔案，zip 的每個成員各存成一個檔案；回傳存下的路徑。
+    失敗時 (格式錯誤、DecompressionBomb) 刪除已寫出的檔案後丟出例外。
+    """
+    src.seek(0)
+    kind = detect_compression(src.read(4))
+    src.seek(0)
+    saved: List[Path] = []
+    budget = _Budget()
+    try:
+        if kind is None:
+            dest = _unique_path(dest_dir, prefix, Path(filename or 'upload').name)
+            saved.append(dest)
+            # 未壓縮的檔案不必檢查壓縮比，只限制總大小
+            _copy_guarded(src, dest, budget)
+        elif kind == 'zip':
+            _extract_zip(src, dest_dir, prefix, budget, saved)
+        else:
+            dest = _unique_path(dest_dir, prefix, stored_name(filename))
+            saved.append(dest)
+            reader = _stream_reader(src, kind)
+            _copy_guarded(reader, dest, budget, src.tell)
+    except _DECOMPRESS_ERRORS as e:
+        _remove(saved)
+        if kind is None:
+            raise
+        raise ValueError(f"無法解壓縮 {filename} ({kind}): {e}") from e
+    except Exception:
+        _remove(saved)
+        raise
+    return saved
+
+
+def _remove(paths: List[Path]):
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+def upload_encoding(requested: str) -> Optional[str]:
+    """傳送到 Server B 時實際使用的壓縮格式 (zstd 在未安裝 zstandard 時改用 gzip，none 代表不壓縮)"""
+    requested = (requested or 'none').lower()
+    if requested == 'zstd' and zstandard is None:
+        return 'gzip'
+    return requested if requested in ('gzip', 'zstd') else None
+
+
+def iter_compressed(path: str, encoding: str, level: Optional[int] = None) -> Iterator[bytes]:
+    """逐段讀取檔案並以 gzip / zstd 壓縮後產出，記憶體中只有一段資料"""
+    chunk_size = COMPRESSION_CONFIG['chunk_size']
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=level or 3).compressobj()
+    else:
+        # wbits=31：輸出 gzip 格式 (含 header 與 CRC)
+        compressor = zlib.compressobj(level if level is not None else 6, zlib.DEFLATED, 31)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
+
+def iter_file(path: str) -> Iterator[bytes]:
+    """逐段讀取未壓縮的檔案 (供 multipart_stream 使用)"""
+    chunk_size = COMPRESSION_CONFIG['chunk_size']
+    with open(path, 'rb') as f:
+        yield from iter(lambda: f.read(chunk_size), b'')
+
+
+def multipart_stream(boundary: str, fields: dict, file_field: str, filename: str,
+                     chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    以串流產生 multipart/form-data 的內容 (檔案部分來自 chunks)
+
+    requests 的 files= 會把整個檔案讀進記憶體再送出；傳入這個 generator 時改以 chunked 傳送。
+    """
+    for name, value in fields.items():
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+               f'{value}\r\n').encode()
+    yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+           f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    yield from chunks
+    yield f'\r\n--{boundary}--\r\n'.encode()
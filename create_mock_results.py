@@ -2,7 +2,7 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-from tasks import CustomFTP_TLS
+from ftps_transfer import CustomFTP_TLS
 
 # Load environment variables
 load_dotenv()
@@ -15,8 +15,14 @@ FTP_CONFIG = {
     'download_dir': os.getenv('FTP_SERVER_B_DOWNLOAD_DIR', '/results')
 }
 
-def create_mock_batch_files(task_id: str):
-    """Create mock batch result files (ZIP + manifest) for testing"""
+def create_mock_batch_files(task_id: str, num_results: int = 12, gds_size: int = 0, output_dir: str = "."):
+    """
+    Create mock batch result files (ZIP + manifest) for testing
+
+    num_results: number of layout/design pairs (each pair is one PNG and one GDS)
+    gds_size: pad each GDS file to roughly this many bytes (0 keeps the minimal layout)
+    output_dir: directory where the ZIP and manifest are written
+    """
     import zipfile
     import json
     from datetime import datetime
@@ -59,9 +65,14 @@ ENDEL
 ENDSTR
 ENDLIB
 '''
+    # Pad the GDS with extra boundaries to reach the requested size
+    if gds_size > len(gds_content):
+        boundary = b"BOUNDARY\nLAYER 1\nDATATYPE 0\nXY 0 0 1000 0 1000 1000 0 1000 0 0\nENDEL\n"
+        repeat = (gds_size - len(gds_content)) // len(boundary) + 1
+        head, tail = gds_content.rsplit(b"ENDSTR", 1)
+        gds_content = head + boundary * repeat + b"ENDSTR" + tail
     
-    # Create multiple mock files for batch testing (10+ images)
-    num_results = 12  # Generate 12 layout/design pairs (24 files total)
+    # Create multiple mock files for batch testing (default 12 layout/design pairs, 24 files total)
     mock_files = []
     
     for i in range(1, num_results + 1):
@@ -87,10 +98,15 @@ ENDLIB
     print(f"Generated {len(mock_files)} files ({len([f for f in mock_files if f['type'] == 'png'])} PNG, {len([f for f in mock_files if f['type'] == 'gds'])} GDS)")
     
     # Create ZIP file
-    zip_filename = f"{task_id}_results.zip"
-    with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    zip_filename = str(Path(output_dir) / f"{task_id}_results.zip")
+    # Same policy as Server B's result packaging: PNGs are already compressed, GDS compresses well
+    with zipfile.ZipFile(zip_filename, 'w') as zipf:
         for file_info in mock_files:
-            zipf.writestr(file_info["name"], file_info["content"])
+            if file_info["name"].lower().endswith('.png'):
+                zipf.writestr(file_info["name"], file_info["content"], compress_type=zipfile.ZIP_STORED)
+            else:
+                zipf.writestr(file_info["name"], file_info["content"],
+                              compress_type=zipfile.ZIP_DEFLATED, compresslevel=9)
     
     # Create manifest
     manifest = {
@@ -106,7 +122,7 @@ ENDLIB
         ]
     }
     
-    manifest_filename = f"{task_id}_manifest.json"
+    manifest_filename = str(Path(output_dir) / f"{task_id}_manifest.json")
     with open(manifest_filename, 'w', encoding='utf-8') as f:
         json.dump(manifest, f, indent=2, ensure_ascii=False)
     
@@ -0,0 +1,367 @@
+"""
+FTPS 傳輸後端
+
+與 Server B 交換大型檔案 (批次結果 ZIP、manifest) 時使用：
+  - 連線池：保留已登入 (AUTH TLS + PROT P) 的控制連線，不必每個檔案都重新握手、登入
+  - 多個檔案平行傳輸，每個檔案使用池中的一條控制連線
+  - 大檔下載切成多個 byte range，各自以 REST <offset> + RETR 平行下載後寫入同一個檔案
+  - 續傳：下載到 .part 檔，重試時以 REST 從已下載的位置繼續；上傳時先以 SIZE 查詢遠端大小，
+    再以 REST + STOR 從該位置續傳
+
+資料連線沿用控制連線的 TLS session (CustomFTP_TLS)，許多 FTPS 伺服器要求這麼做。
+有多台 Server B 時每台各有一個連線池 (get_pool(host))，host 由呼叫端依任務所在的 Server B 決定；
+未指定時使用 FTP_SERVER_B_HOST。
+FTPS_TLS=false 時改用一般 FTP (僅供本機測試)。
+"""
+
+import ftplib
+import os
+import queue
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FTPS_CONFIG = {
+    'host': os.getenv('FTP_SERVER_B_HOST'),
+    'port': int(os.getenv('FTP_SERVER_B_PORT', '21')),
+    'username': os.getenv('FTP_SERVER_B_USER'),
+    'password': os.getenv('FTP_SERVER_B_PASS'),
+    'upload_dir': os.getenv('FTP_SERVER_B_UPLOAD_DIR', '/uploads'),
+    'download_dir': os.getenv('FTP_SERVER_B_DOWNLOAD_DIR', '/results'),
+    'tls': os.getenv('FTPS_TLS', 'true').lower() == 'true',
+    'verify_tls': os.getenv('FTPS_VERIFY_TLS', 'true').lower() == 'true',
+    'timeout': float(os.getenv('FTPS_TIMEOUT', '30')),
+    # 池中最多保留的控制連線數，也是同時進行的傳輸上限
+    'pool_size': int(os.getenv('FTPS_POOL_SIZE', '4')),
+    # 閒置超過此秒數的連線，取用前先以 NOOP 確認仍然可用
+    'keepalive_seconds': float(os.getenv('FTPS_KEEPALIVE_SECONDS', '30')),
+    # 超過此大小的檔案下載時切成多個 range 平行下載
+    'range_threshold': int(os.getenv('FTPS_RANGE_THRESHOLD_BYTES', str(32 * 1024 * 1024))),
+    'range_parts': int(os.getenv('FTPS_RANGE_PARTS', '4')),
+    'block_size': int(os.getenv('FTPS_BLOCK_SIZE', str(256 * 1024))),
+    'retries': int(os.getenv('FTPS_RETRIES', '3')),
+}
+
+
+class CustomFTP_TLS(ftplib.FTP_TLS):
+    """Custom FTP_TLS class to handle TLS session reuse issues"""
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+        if self._prot_p:
+            conn = self.context.wrap_socket(conn,
+                                          server_hostname=self.host,
+                                          session=self.sock.session)  # Reuse TLS session
+        return conn, size
+
+
+def _tls_context() -> ssl.SSLContext:
+    context = ssl.create_default_context()
+    if not FTPS_CONFIG['verify_tls']:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def open_connection(host: Optional[str] = None) -> ftplib.FTP:
+    """建立並登入一條控制連線 (binary 模式、被動模式)；host 未指定時連到 FTP_SERVER_B_HOST"""
+    host = host or FTPS_CONFIG['host']
+    if FTPS_CONFIG['tls']:
+        ftp = CustomFTP_TLS(context=_tls_context(), timeout=FTPS_CONFIG['timeout'])
+        ftp.connect(host, FTPS_CONFIG['port'])
+        ftp.auth()
+        ftp.login(FTPS_CONFIG['username'], FTPS_CONFIG['password'])
+        ftp.prot_p()
+    else:
+        ftp = ftplib.FTP(timeout=FTPS_CONFIG['timeout'])
+        ftp.connect(host, FTPS_CONFIG['port'])
+        ftp.login(FTPS_CONFIG['username'], FTPS_CONFIG['password'])
+    ftp.set_pasv(True)
+    ftp.voidcmd('TYPE I')
+    return ftp
+
+
+class FTPConnectionPool:
+    """
+    已登入控制連線的連線池
+
+    connection() 取出一條連線 (沒有閒置連線且未達上限時建立新的，否則等待)，
+    使用中發生錯誤或已被關閉的連線不放回池中。fork 後的子行程會重新建立自己的連線。
+    """
+
+    def __init__(self, size: Optional[int] = None, host: Optional[str] = None):
+        self.size = max(1, size or FTPS_CONFIG['pool_size'])
+        self.host = host
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle: "queue.LifoQueue[Tuple[ftplib.FTP, float]]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.created = 0
+
+    @contextmanager
+    def connection(self):
+        if self._pid != os.getpid():
+            self._reset()
+        self._slots.acquire()
+        ftp = None
+        try:
+            ftp = self._checkout()
+            yield ftp
+        except BaseException:
+            if ftp is not None:
+                _close_quietly(ftp)
+                ftp = None
+            raise
+        finally:
+            # ftplib 關閉連線後 sock 為 None (例如 _retr_range 無法確定控制連線的狀態時)
+            if ftp is not None and ftp.sock is not None:
+                self._idle.put((ftp, time.monotonic()))
+            self._slots.release()
+
+    def _checkout(self) -> ftplib.FTP:
+        while True:
+            try:
+                ftp, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                self.created += 1
+                return open_connection(self.host)
+            if time.monotonic() - idle_since < FTPS_CONFIG['keepalive_seconds']:
+                return ftp
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except (ftplib.Error, OSError, EOFError):
+                _close_quietly(ftp)
+
+    def close(self):
+        while True:
+            try:
+                ftp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                ftp.quit()
+            except (ftplib.Error, OSError, EOFError):
+                _close_quietly(ftp)
+
+
+def _close_quietly(ftp: ftplib.FTP):
+    try:
+        ftp.close()
+    except Exception:
+        pass
+
+
+_pools: Dict[Optional[str], FTPConnectionPool] = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(host: Optional[str] = None) -> FTPConnectionPool:
+    """取得連到 host 的連線池 (每個 host 一個)"""
+    with _pool_lock:
+        if host not in _pools:
+            _pools[host] = FTPConnectionPool(host=host)
+        return _pools[host]
+
+
+def _remote_path(directory: Optional[str], name: str) -> str:
+    if name.startswith('/') or not directory:
+        return name
+    return f"{directory.rstrip('/')}/{name}"
+
+
+def remote_size(ftp: ftplib.FTP, path: str) -> Optional[int]:
+    try:
+        return ftp.size(path)
+    except ftplib.error_perm:
+        return None
+
+
+# 本機檔案不存在等錯誤不重試，只重試連線與伺服器的暫時性錯誤
+_RETRYABLE = (ftplib.error_temp, ftplib.error_reply, ConnectionError, socket.timeout, ssl.SSLError, EOFError)
+
+
+def _with_retries(func, *args):
+    """連線中斷或暫時性錯誤時重試 (換一條連線)；已完成的部分由續傳機制接續"""
+    for attempt in range(FTPS_CONFIG['retries'] + 1):
+        try:
+            return func(*args)
+        except _RETRYABLE as e:
+            if attempt >= FTPS_CONFIG['retries']:
+                raise
+            print(f"FTPS 傳輸中斷，重試 ({attempt + 1}/{FTPS_CONFIG['retries']}): {e}")
+            time.sleep(min(2 ** attempt * 0.5, 5))
+
+
+# --- 上傳 ---
+def upload_file(local_path, remote_name: Optional[str] = None, remote_dir: Optional[str] = None,
+                pool: Optional[FTPConnectionPool] = None, resume: bool = False, host: Optional[str] = None) -> int:
+    """
+    上傳一個檔案，回傳檔案大小
+
+    第一次嘗試覆寫遠端檔案 (resume=True 時改為從遠端現有大小續傳)，
+    傳輸中斷後的重試一律以 SIZE 查詢已寫入的大小並從該位置續傳。
+    """
+    local_path = Path(local_path)
+    remote = _remote_path(remote_dir or FTPS_CONFIG['upload_dir'], remote_name or local_path.name)
+    pool = pool or get_pool(host)
+    total = local_path.stat().st_size
+    state = {'resume': resume}
+
+    def attempt():
+        with pool.connection() as ftp:
+            offset = (remote_size(ftp, remote) or 0) if state['resume'] else 0
+            state['resume'] = True
+            if offset == total and total > 0:
+                return total
+            if offset > total:
+                offset = 0
+            with open(local_path, 'rb') as f:
+                f.seek(offset)
+                ftp.storbinary(f'STOR {remote}', f, blocksize=FTPS_CONFIG['block_size'], rest=offset or None)
+            return total
+
+    return _with_retries(attempt)
+
+
+def upload_files(files: Iterable[Tuple[str, str]], remote_dir: Optional[str] = None,
+                 pool: Optional[FTPConnectionPool] = None, host: Optional[str] = None) -> List[int]:
+    """平行上傳多個 (本機路徑, 遠端名稱)"""
+    pool = pool or get_pool(host)
+    files = list(files)
+    with ThreadPoolExecutor(max_workers=min(pool.size, max(1, len(files))),
+                            thread_name_prefix="ftps-upload") as executor:
+        return list(executor.map(lambda item: upload_file(item[0], item[1], remote_dir, pool), files))
+
+
+# --- 下載 ---
+def _retr_range(ftp: ftplib.FTP, remote: str, dest: Path, offset: int, length: Optional[int],
+                progress: Optional[List[int]] = None):
+    """
+    以 REST offset + RETR 下載 [offset, offset + length)，length 為 None 時下載到檔尾
+
+    progress[0] 累計已寫入的位元組數，中斷後的重試可以從該位置接續。
+    結束前一定會讀取 RETR 的最終回覆，控制連線才能放回池中；讀不到回覆時關閉控制連線。
+    """
+    remaining = length
+    reached_eof = False
+    with open(dest, 'r+b') as f:
+        f.seek(offset)
+        conn = ftp.transfercmd(f'RETR {remote}', rest=offset or None)
+        try:
+            while remaining is None or remaining > 0:
+                size = FTPS_CONFIG['block_size'] if remaining is None else min(FTPS_CONFIG['block_size'], remaining)
+                data = conn.recv(size)
+                if not data:
+                    reached_eof = True
+                    break
+                f.write(data)
+                if progress is not None:
+                    progress[0] += len(data)
+                if remaining is not None:
+                    remaining -= len(data)
+            if reached_eof and isinstance(conn, ssl.SSLSocket):
+                conn.unwrap()
+        except BaseException:
+            # 資料連線中途出錯時控制連線上還有未讀的回覆，不能再重複使用
+            _close_quietly(ftp)
+            raise
+        finally:
+            conn.close()
+    try:
+        ftp.voidresp()
+    except ftplib.error_temp:
+        # 讀完指定長度後提早關閉資料連線，伺服器回 426/451 代表這段 range 已經完整收到
+        if reached_eof:
+            raise
+    except BaseException:
+        _close_quietly(ftp)
+        raise
+    if remaining:
+        raise ftplib.error_temp(f"426 Range of {remote} ended {remaining} bytes early")
+
+
+def download_file(remote_name: str, local_path, remote_dir: Optional[str] = None,
+                  pool: Optional[FTPConnectionPool] = None, parts: Optional[int] = None,
+                  host: Optional[str] = None) -> int:
+    """
+    下載一個檔案到 local_path，回傳檔案大小
+
+    大於 FTPS_RANGE_THRESHOLD_BYTES 的檔案切成 parts 段平行下載；否則單一連線下載，
+    並以 .part 檔續傳。完成後才改名為 local_path。
+    """
+    local_path = Path(local_path)
+    remote = _remote_path(remote_dir or FTPS_CONFIG['download_dir'], remote_name)
+    pool = pool or get_pool(host)
+    part_path = local_path.with_name(local_path.name + '.part')
+    parts = max(1, parts or min(FTPS_CONFIG['range_parts'], pool.size))
+
+    with pool.connection() as ftp:
+        total = remote_size(ftp, remote)
+    if total is None:
+        raise FileNotFoundError(f"遠端檔案不存在: {remote}")
+
+    if parts > 1 and total >= FTPS_CONFIG['range_threshold']:
+        _download_ranges(remote, part_path, total, parts, pool)
+    else:
+        def attempt():
+            if not part_path.exists():
+                part_path.touch()
+            offset = part_path.stat().st_size
+            if offset > total:
+                part_path.write_bytes(b'')
+                offset = 0
+            if offset < total:
+                with pool.connection() as ftp:
+                    _retr_range(ftp, remote, part_path, offset, None)
+        _with_retries(attempt)
+
+    size = part_path.stat().st_size
+    if size != total:
+        raise ftplib.error_temp(f"426 {remote} 大小不符: 預期 {total}，實際 {size}")
+    os.replace(part_path, local_path)
+    return total
+
+
+def _download_ranges(remote: str, part_path: Path, total: int, parts: int, pool: FTPConnectionPool):
+    # 預先配置檔案大小，各段直接寫入自己的位置
+    with open(part_path, 'ab') as f:
+        f.truncate(total)
+    step = -(-total // parts)
+    ranges = [(start, min(step, total - start)) for start in range(0, total, step)]
+
+    def fetch(item):
+        start, length = item
+        done = [0]
+
+        def attempt():
+            if done[0] >= length:
+                return
+            with pool.connection() as ftp:
+                _retr_range(ftp, remote, part_path, start + done[0], length - done[0], done)
+        _with_retries(attempt)
+
+    with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="ftps-range") as executor:
+        list(executor.map(fetch, ranges))
+
+
+def download_files(files: Iterable[Tuple[str, str]], remote_dir: Optional[str] = None,
+                   pool: Optional[FTPConnectionPool] = None, host: Optional[str] = None) -> Dict[str, int]:
+    """平行下載多個 (遠端名稱, 本機路徑)，回傳 {遠端名稱: 大小}"""
+    pool = pool or get_pool(host)
+    files = list(files)
+    with ThreadPoolExecutor(max_workers=min(pool.size, max(1, len(files))),
+                            thread_name_prefix="ftps-download") as executor:
+        sizes = executor.map(lambda item: download_file(item[0], item[1], remote_dir, pool), files)
+        return {name: size for (name, _), size in zip(files, sizes)}
@@ -0,0 +1,35 @@
+"""
+以 gunicorn 啟動多個 web worker，並在 fork 前預先載入 main:app
+
+uvicorn --workers 以 spawn 啟動 worker，每個 worker 各自 import 一次 main 與所有相依模組。
+gunicorn 的 preload_app 則在 master 行程 import 一次後再 fork，worker 以 copy-on-write 共用：
+  - import 設定檔時先關閉 GC，避免載入期間的 GC 掃描把物件分散到各世代
+  - master 載入 app 後 (when_ready) 呼叫 task_client.preload() 載入送出任務用的模組，
+    再 gc.freeze() 把所有已載入的物件移到永久世代，worker 的 GC 不會再碰到這些分頁
+  - freeze 後立刻重新開啟 GC；when_ready 在 fork 第一個 worker 之前執行，
+    之後 fork 的 worker (包含重啟的 worker) 都繼承開啟的狀態
+
+main.py 在 import 時不建立連線，Redis 與 broker 的連線都在各 worker 中第一次使用時才建立。
+gunicorn 列在 requirements.txt：
+    gunicorn -c gunicorn_conf.py main:app
+"""
+
+import gc
+import os
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_WORKERS', '4'))
+worker_class = os.getenv('WEB_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+preload_app = True
+# 長輪詢與 WebSocket 連線不應被 gunicorn 的 worker timeout 中斷 (UvicornWorker 會持續回報心跳)
+timeout = int(os.getenv('WEB_WORKER_TIMEOUT', '60'))
+
+gc.disable()
+
+
+def when_ready(server):
+    import task_client
+    task_client.preload()
+    gc.freeze()
+    gc.enable()
+    server.log.info(f"Preloaded app; {gc.get_freeze_count()} objects frozen before forking workers")
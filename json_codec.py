@@ -0,0 +1,34 @@
+"""
+熱路徑上的 JSON 編解碼
+
+進度訊息在 worker 發布、web 的 Pub/Sub 監聽器與 WebSocket 寫入時各編解碼一次，
+批次檔案清單也可能有數千筆。有安裝 orjson 時使用它 (比標準函式庫快數倍)，
+否則退回標準的 json 模組，輸出格式相同 (UTF-8、不跳脫非 ASCII 字元)。
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def dumpb(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    # orjson.JSONDecodeError 是 json.JSONDecodeError 的子類別，呼叫端可以統一捕捉
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
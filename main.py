@@ -1,34 +1,79 @@
 import asyncio
 import json
+import time
+import secrets
+import uuid
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 from contextlib import asynccontextmanager
-import redis.asyncio as aioredis
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 
-from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.staticfiles import StaticFiles
 
-from tasks import run_ai_processing_task
+# 以任務名稱送出，不 import tasks (worker 的程式碼) 與 Celery app
+from task_client import send_processing_task, revoke, cancel_server_b_task
 from websocket_manager import manager
+from json_codec import loads, dumpb
+from batch_files import files_page
+from scheduling import choose_lane, refund_token, task_headers, get_lane_stats, RateLimited
+from tracing import arecord_span, load_stage_histograms, render_histograms
+from rule_compiler import get_rule_cache_stats
+from async_io import run_io, StaticAssetCache
+from compressed_io import DecompressionBomb, UnsupportedCompression, ingest_upload
+from result_delivery import serve_result_file
+from result_store import STORE_CONFIG, task_id_from_path, download_path, atouch_task, get_retention_stats
+from redis_pool import new_async_redis, acheck_redis
+from cancellation import CANCEL_CONFIG, atrack_task, auntrack_task, aactive_tasks, arequest_cancel, get_cancel_stats
+from server_b_pool import get_pool_stats
+from autoscaler import get_autoscale_stats
+from profiling import (PROFILING_CONFIG, PROFILE_HEADER, SamplingProfiler, LoopBlockMonitor,
+                       profile_requested, task_mark_key, list_profiles, profile_path)
 
 # --- Lifespan Event Handler ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     task = asyncio.create_task(redis_listener())
+    if loop_monitor:
+        loop_monitor.start()
     yield
     # Shutdown
+    for timer in disconnect_timers.values():
+        timer.cancel()
+    if loop_monitor:
+        await loop_monitor.stop()
     task.cancel()
     try:
         await task
     except asyncio.CancelledError:
         pass
+    await redis_client.aclose()
 
 # --- App Initialization ---
 app = FastAPI(title="AI Model Server", lifespan=lifespan)
 
+# [新增] Profiling 只在 PROFILING_ENABLED=true 時安裝，關閉時對請求沒有任何額外成本
+loop_monitor = LoopBlockMonitor() if PROFILING_CONFIG['enabled'] else None
+
+async def profile_request(request: Request, call_next):
+    """帶有 X-DRC-Profile header 或 ?profile= 參數的請求，取樣 event loop 執行緒直到回應產生"""
+    if not profile_requested(request.headers.get(PROFILE_HEADER) or request.query_params.get('profile')):
+        return await call_next(request)
+    # 取樣的是整個 event loop 執行緒，同時間其他請求的 coroutine 也會出現在 profile 中
+    profiler = SamplingProfiler().start()
+    try:
+        return await call_next(request)
+    finally:
+        name = request.url.path.strip('/').replace('/', '_') or 'index'
+        await run_io(profiler.stop().write, f"http_{request.method}_{name}_{int(time.time() * 1000)}")
+
+if PROFILING_CONFIG['enabled']:
+    app.middleware("http")(profile_request)
+    if not PROFILING_CONFIG['token']:
+        print("警告: 未設定 PROFILING_TOKEN，/admin/profiles 等管理端點將拒絕所有請求")
+
 # --- CORS Middleware ---
 app.add_middleware(
     CORSMiddleware,
@@ -40,97 +85,370 @@ app.add_middleware(
 
 # --- Static File Serving ---
 BASE_DIR = Path(__file__).resolve().parent
-UPLOAD_DIR = BASE_DIR / "uploads"
-RESULTS_DIR = BASE_DIR / "results"
-UPLOAD_DIR.mkdir(exist_ok=True)
-RESULTS_DIR.mkdir(exist_ok=True)
-app.mount("/results", StaticFiles(directory=RESULTS_DIR), name="results")
+UPLOAD_DIR = STORE_CONFIG['uploads_root']
+RESULTS_DIR = STORE_CONFIG['results_root']
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+static_assets = StaticAssetCache()
+
+# [新增] 排程用的 Redis client (token bucket 與 lane 統計)，連線設定來自 redis_pool (REDIS_URL / REDIS_UNIX_SOCKET)
+redis_client = new_async_redis(decode_responses=True)
 
 # --- [新增] Redis Pub/Sub 監聽器 ---
 # 這個背景任務會在 FastAPI 啟動時自動運行
 # 它會監聽 Redis 的 'progress_updates' 頻道
 async def redis_listener():
-    redis_client = None
-    pubsub = None
-    
+    # 連線中斷時以指數退避重新訂閱，web 不需要重啟
+    backoff = 0.5
+    while True:
+        redis_client = None
+        pubsub = None
+        try:
+            # 注意：這裡使用非同步的 redis client；訂閱連線可能長時間沒有訊息，不設讀取逾時
+            redis_client = new_async_redis(decode_responses=True, socket_timeout=None)
+            pubsub = redis_client.pubsub()
+            await pubsub.subscribe("progress_updates")
+            print("Redis Pub/Sub 監聽器已啟動，正在監聽 'progress_updates' 頻道...")
+            backoff = 0.5
+
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    try:
+                        print(f"從 Redis 收到訊息: {message['data']}")
+                        data = loads(message['data'])
+                        client_id = data.get("client_id")
+                        payload = data.get("payload")
+                        if client_id and payload:
+                            # 收到訊息後，透過 WebSocketManager 將其轉發給指定的前端客戶端 (同一任務的進度會節流合併)
+                            await manager.send_progress(payload, client_id)
+                    except json.JSONDecodeError as e:
+                        print(f"JSON 解析錯誤: {e}")
+                    except Exception as e:
+                        print(f"處理訊息時發生錯誤: {e}")
+        except asyncio.CancelledError:
+            print("Redis 監聽器被取消")
+            raise
+        except (RedisConnectionError, RedisTimeoutError) as e:
+            print(f"Redis 監聽器連線中斷，{backoff:.1f} 秒後重新連線: {e}")
+        except Exception as e:
+            print(f"Redis 監聽器發生錯誤，{backoff:.1f} 秒後重新連線: {e}")
+        finally:
+            if pubsub:
+                await pubsub.aclose()
+            if redis_client:
+                await redis_client.aclose()
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+# --- [新增] 任務取消 ---
+# client 斷線後等待重新連線的計時器 (CANCEL_ON_DISCONNECT_GRACE > 0 時才會建立)
+disconnect_timers = {}
+
+async def cancel_task(task_id: str, reason: str) -> bool:
+    """設定取消旗標、revoke 還在佇列中的任務，並取消 Server B 上的工作讓等待中的 worker 立即醒來"""
+    if not await arequest_cancel(redis_client, task_id, reason):
+        return False
+    # revoke 是對所有 worker 的廣播；tile 的工作由 worker 在 checkpoint 時自行取消
+    await run_io(revoke, task_id)
+    await run_io(cancel_server_b_task, task_id)
+    print(f"已取消任務 {task_id} ({reason})")
+    return True
+
+async def cancel_after_disconnect(client_id: str):
+    """斷線超過寬限時間仍未重新連線時，取消該 client 所有執行中的任務"""
     try:
-        # 注意：這裡使用非同步的 redis client
-        redis_client = aioredis.from_url("redis://localhost:6379", decode_responses=True)
-        pubsub = redis_client.pubsub()
-        await pubsub.subscribe("progress_updates")
-        print("Redis Pub/Sub 監聽器已啟動，正在監聽 'progress_updates' 頻道...")
-        
-        async for message in pubsub.listen():
-            if message['type'] == 'message':
-                try:
-                    print(f"從 Redis 收到訊息: {message['data']}")
-                    data = json.loads(message['data'])
-                    client_id = data.get("client_id")
-                    payload = data.get("payload")
-                    if client_id and payload:
-                        # 收到訊息後，透過 WebSocketManager 將其轉發給指定的前端客戶端
-                        await manager.send_personal_message(payload, client_id)
-                except json.JSONDecodeError as e:
-                    print(f"JSON 解析錯誤: {e}")
-                except Exception as e:
-                    print(f"處理訊息時發生錯誤: {e}")
+        await asyncio.sleep(CANCEL_CONFIG['disconnect_grace_seconds'])
+        if client_id in manager.active_connections:
+            return
+        for task_id in await aactive_tasks(redis_client, client_id):
+            await cancel_task(task_id, 'disconnect')
     except asyncio.CancelledError:
-        print("Redis 監聽器被取消")
         raise
     except Exception as e:
-        print(f"Redis 監聽器發生錯誤: {e}")
+        print(f"斷線後取消任務失敗 (client {client_id}): {e}")
     finally:
-        if pubsub:
-            await pubsub.close()
-        if redis_client:
-            await redis_client.close()
-        print("Redis 監聽器已清理並關閉")
+        if disconnect_timers.get(client_id) is asyncio.current_task():
+            del disconnect_timers[client_id]
 
 # --- API Endpoints ---
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
+    # ?format=msgpack 時以 binary frame 傳送 msgpack，預設為 JSON text frame
+    await manager.connect(websocket, client_id, websocket.query_params.get('format', 'json'))
+    # 在寬限時間內重新連線，任務繼續執行
+    timer = disconnect_timers.pop(client_id, None)
+    if timer:
+        timer.cancel()
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
         manager.disconnect(client_id)
+        if CANCEL_CONFIG['disconnect_grace_seconds'] > 0:
+            disconnect_timers[client_id] = asyncio.create_task(cancel_after_disconnect(client_id))
 
 @app.post("/submit-task")
 async def submit_task(files: List[UploadFile] = File(None), 
                       text: str = Form(...),
-                      client_id: str = Form(...)
+                      client_id: str = Form(...),
+                      lane: Optional[str] = Form(None),
+                      include_timings: Optional[bool] = Form(None),
+                      profile: Optional[str] = Form(None),
+                      x_drc_profile: Optional[str] = Header(None)
                       ):
+    # 先產生 task_id，讓上傳階段的 span 也能記錄在同一個 trace 底下
+    task_id = str(uuid.uuid4())
+
+    # 依 client 的 token bucket 決定 interactive / bulk lane，額度用完時請 client 稍後重送
+    try:
+        lane = await choose_lane(redis_client, client_id, len(files or []), lane)
+    except RateLimited as e:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "提交的任務過多，請稍後再試", "retry_after": round(e.retry_after, 1)},
+            headers={"Retry-After": str(max(1, int(e.retry_after + 0.999)))}
+        )
+
+    upload_started = time.time()
+    t0 = time.perf_counter()
     saved_file_paths = []
     if files:
-        for file in files:
-            file_path = UPLOAD_DIR / f"{Path(file.filename).stem}_{Path(file.filename).suffix}"
-            with open(file_path, "wb") as buffer:
-                buffer.write(await file.read())
-            saved_file_paths.append(str(file_path))
-
-    task = run_ai_processing_task.delay(
-        client_id=client_id, 
-        file_paths=saved_file_paths, 
-        rule_text=text
-    )
-    return {"task_id": task.id}
-
-@app.get("/download/{file_name}")
-async def download_file(file_name: str):
-    file_path = RESULTS_DIR / file_name
-    if file_path.exists():
-        return FileResponse(path=file_path, filename=file_name, media_type='application/octet-stream')
+        try:
+            for file in files:
+                # 檔名加上 task_id，避免不同任務上傳同名檔案時互相覆蓋；
+                # gzip / zstd / zip 壓縮檔 (依 magic bytes 判斷) 以串流方式解壓縮後存檔
+                paths = await run_io(ingest_upload, file.file, UPLOAD_DIR, task_id, file.filename)
+                saved_file_paths.extend(str(path) for path in paths)
+        except (DecompressionBomb, UnsupportedCompression, ValueError) as e:
+            print(f"上傳檔案無法接受: {e}")
+            for path in saved_file_paths:
+                await run_io(Path(path).unlink, missing_ok=True)
+            # 任務沒有送出，退還 choose_lane 扣的 token，避免 client 因為壞檔案把自己限流
+            await refund_token(redis_client, client_id, lane)
+            status_code = {DecompressionBomb: 413, UnsupportedCompression: 415}.get(type(e), 400)
+            raise HTTPException(status_code=status_code, detail=f"上傳檔案無法接受: {e}")
+
+    await arecord_span(redis_client, 'upload', upload_started, time.perf_counter() - t0,
+                       trace_id=task_id, files=len(saved_file_paths))
+
+    headers = task_headers(lane)
+    if profile_requested(profile or x_drc_profile):
+        headers['profile'] = True
+
+    # 記為 client 執行中的任務，取消 API 與斷線自動取消都以此清單為準
+    await atrack_task(redis_client, client_id, task_id)
+
+    try:
+        task = await run_io(
+            send_processing_task,
+            task_id,
+            {
+                "client_id": client_id,
+                "file_paths": saved_file_paths,
+                "rule_text": text,
+                "include_timings": include_timings
+            },
+            queue=lane,
+            headers=headers
+        )
+    except Exception as e:
+        # 任務沒有送進佇列：撤銷執行中記錄、刪除上傳檔並退還 token，client 可以直接重送
+        print(f"送出任務 {task_id} 失敗: {e}")
+        for path in saved_file_paths:
+            await run_io(Path(path).unlink, missing_ok=True)
+        await auntrack_task(redis_client, client_id, task_id)
+        await refund_token(redis_client, client_id, lane)
+        raise HTTPException(status_code=503, detail="任務佇列暫時無法使用，請稍後再試")
+    return {"task_id": task.id, "lane": lane}
+
+@app.post("/tasks/{task_id}/cancel")
+async def cancel_task_endpoint(task_id: str, client_id: str = Form(...)):
+    """取消 client 自己執行中的任務；任務已結束 (或不屬於此 client) 時回傳 404"""
+    if task_id not in await aactive_tasks(redis_client, client_id):
+        raise HTTPException(status_code=404, detail="任務不存在或已結束")
+    cancelled = await cancel_task(task_id, 'api')
+    return {"task_id": task_id, "cancelled": cancelled}
+
+@app.get("/queues")
+async def queue_stats():
+    """各 lane 的佇列深度與排隊時間"""
+    return await get_lane_stats(redis_client)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text format：各階段延遲 histogram、lane 佇列狀態、rule 快取統計與結果保留用量"""
+    lines = render_histograms("drc_stage_duration_seconds", "Per-stage latency of DRC jobs",
+                              await load_stage_histograms(redis_client))
+
+    lane_stats = await get_lane_stats(redis_client)
+    for metric, field, help_text in (
+        ("drc_lane_depth", "depth", "Messages waiting in each lane"),
+        ("drc_lane_oldest_age_seconds", "oldest_age_seconds", "Age of the oldest waiting message"),
+        ("drc_lane_wait_p95_seconds", "wait_p95_seconds", "p95 queue wait of recently started tasks"),
+    ):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        lines += [f'{metric}{{lane="{lane}"}} {stats[field]}' for lane, stats in lane_stats.items()]
+
+    rule_stats = await get_rule_cache_stats(redis_client)
+    lines += ["# HELP drc_rule_cache_total Rule compilation cache lookups", "# TYPE drc_rule_cache_total counter"]
+    for result in ("hits", "misses"):
+        lines.append(f'drc_rule_cache_total{{result="{result}"}} {rule_stats[result]}')
+    lines += ["# HELP drc_rule_cache_hit_ratio Share of rule decks served from the cache",
+              "# TYPE drc_rule_cache_hit_ratio gauge", f"drc_rule_cache_hit_ratio {rule_stats['hit_rate']}",
+              "# HELP drc_rule_compile_seconds_total Time spent compiling rule decks",
+              "# TYPE drc_rule_compile_seconds_total counter",
+              f"drc_rule_compile_seconds_total {rule_stats['compile_ms_total'] / 1000}",
+              "# HELP drc_rule_compile_avg_seconds Average time to compile a rule deck on a cache miss",
+              "# TYPE drc_rule_compile_avg_seconds gauge",
+              f"drc_rule_compile_avg_seconds {rule_stats['avg_compile_ms'] / 1000}"]
+
+    retention = await get_retention_stats(redis_client)
+    lines += ["# HELP drc_results_bytes Bytes of task results tracked by the retention index",
+              "# TYPE drc_results_bytes gauge", f"drc_results_bytes {retention['total_bytes']}",
+              "# HELP drc_results_quota_bytes Configured quota for task results",
+              "# TYPE drc_results_quota_bytes gauge", f"drc_results_quota_bytes {retention['quota_bytes']}",
+              "# HELP drc_results_tasks Tasks with results on disk",
+              "# TYPE drc_results_tasks gauge", f"drc_results_tasks {retention['tasks']}",
+              "# HELP drc_results_evicted_total Task results removed by the sweeper",
+              "# TYPE drc_results_evicted_total counter"]
+    for reason in ("ttl", "lru"):
+        lines.append(f'drc_results_evicted_total{{reason="{reason}"}} {retention["evicted"].get(f"evicted_{reason}", 0)}')
+
+    # 取消：請求來源、取消在哪個階段生效 (之後的階段不再佔用 worker / Server B)，以及取消前已執行的時間
+    cancel_stats = await get_cancel_stats(redis_client)
+    lines += ["# HELP drc_cancel_requests_total Cancellation requests by source",
+              "# TYPE drc_cancel_requests_total counter"]
+    lines += [f'drc_cancel_requests_total{{reason="{reason}"}} {int(cancel_stats.get(f"requested_{reason}", 0))}'
+              for reason in ("api", "disconnect")]
+    lines += ["# HELP drc_tasks_cancelled_total Cancelled tasks by the stage they stopped before",
+              "# TYPE drc_tasks_cancelled_total counter"]
+    lines += [f'drc_tasks_cancelled_total{{stage="{key[len("cancelled_"):]}"}} {int(value)}'
+              for key, value in sorted(cancel_stats.items())
+              if key.startswith("cancelled_") and key != "cancelled_runtime_seconds"]
+    lines += ["# HELP drc_cancelled_runtime_seconds_total Worker time spent on tasks before they were cancelled",
+              "# TYPE drc_cancelled_runtime_seconds_total counter",
+              f"drc_cancelled_runtime_seconds_total {cancel_stats.get('cancelled_runtime_seconds', 0.0)}",
+              "# HELP drc_server_b_jobs_cancelled_total Server B jobs cancelled before they finished",
+              "# TYPE drc_server_b_jobs_cancelled_total counter",
+              f"drc_server_b_jobs_cancelled_total {int(cancel_stats.get('server_b_cancelled', 0))}"]
+
+    # Server B 後端池：各台分到的工作數、失敗與斷路器打開次數，以及 hedged request
+    pool_stats = await get_pool_stats(redis_client)
+    for metric, prefix, help_text in (
+        ("drc_server_b_routed_total", "routed:", "Jobs routed to each Server B"),
+        ("drc_server_b_request_failures_total", "failures:", "Failed requests (connection errors, timeouts, 5xx) per Server B"),
+        ("drc_server_b_breaker_opened_total", "breaker_opened:", "Times the circuit breaker opened per Server B"),
+    ):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{backend="{key[len(prefix):]}"}} {value}'
+                  for key, value in sorted(pool_stats.items()) if key.startswith(prefix)]
+    lines += ["# HELP drc_server_b_hedged_requests_total Hedged status/download requests sent, and how many the hedge won",
+              "# TYPE drc_server_b_hedged_requests_total counter",
+              f'drc_server_b_hedged_requests_total{{result="sent"}} {pool_stats.get("hedged", 0)}',
+              f'drc_server_b_hedged_requests_total{{result="won"}} {pool_stats.get("hedge_wins", 0)}']
+
+    # Autoscaler：最近一次評估的各 Celery worker / Server B 大小與需求，以及累計的擴縮決策
+    autoscale = await get_autoscale_stats(redis_client)
+    for metric, field, help_text in (
+        ("drc_autoscale_size", "size", "Pool size chosen by the autoscaler (Celery processes or Server B executor threads)"),
+        ("drc_autoscale_demand", "demand", "Running plus waiting jobs seen by the autoscaler"),
+        ("drc_autoscale_oldest_age_seconds", "oldest_age", "Age of the oldest waiting job seen by the autoscaler"),
+    ):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        lines += [f'{metric}{{kind="{r["kind"]}",resource="{r["resource"]}"}} {r[field]}'
+                  for r in autoscale['resources']]
+    lines += ["# HELP drc_autoscale_decisions_total Autoscaler evaluations by resource kind and decision",
+              "# TYPE drc_autoscale_decisions_total counter"]
+    lines += [f'drc_autoscale_decisions_total{{kind="{key.split(":")[0]}",direction="{key.split(":")[1]}"}} {value}'
+              for key, value in sorted(autoscale['decisions'].items())]
+
+    return "\n".join(lines) + "\n"
+
+# --- [新增] Profiling 管理端點 ---
+def require_profiling(token: Optional[str]):
+    """
+    未啟用 profiling 時一律 404；管理端點必須帶與 PROFILING_TOKEN 相同的 X-DRC-Profile header
+
+    profile 內含程式的呼叫堆疊，沒有設定 PROFILING_TOKEN 時管理端點一律拒絕，不會對外開放。
+    """
+    if not PROFILING_CONFIG['enabled']:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not PROFILING_CONFIG['token']:
+        raise HTTPException(status_code=403, detail="PROFILING_TOKEN is not configured")
+    if not token or not secrets.compare_digest(token.encode(), PROFILING_CONFIG['token'].encode()):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+@app.get("/admin/profiles")
+async def get_profiles(x_drc_profile: Optional[str] = Header(None)):
+    require_profiling(x_drc_profile)
+    return {"profiles": await run_io(list_profiles)}
+
+@app.get("/admin/profiles/{name}")
+async def get_profile(name: str, x_drc_profile: Optional[str] = Header(None)):
+    require_profiling(x_drc_profile)
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path=path, filename=name, media_type='text/plain')
+
+@app.post("/admin/profiles/tasks/{task_id}")
+async def mark_task_for_profiling(task_id: str, x_drc_profile: Optional[str] = Header(None)):
+    """標記尚未開始執行的 task_id，worker 開始執行時會進行 profiling"""
+    require_profiling(x_drc_profile)
+    await redis_client.set(task_mark_key(task_id), 1, ex=PROFILING_CONFIG['mark_ttl'])
+    return {"task_id": task_id, "profile": f"task_{task_id}.folded"}
+
+@app.get("/admin/loop-blocking")
+async def get_loop_blocking(x_drc_profile: Optional[str] = Header(None)):
+    """最近的 event loop 阻塞區間 (同時寫入 profiles/loop_blocking.json)"""
+    require_profiling(x_drc_profile)
+    await run_io(loop_monitor.write)
+    return {"threshold_ms": PROFILING_CONFIG['loop_block_threshold_ms'], "blocks": loop_monitor.snapshot()}
+
+# 結果檔案：content-hash ETag、任務路徑 immutable 快取、304、Range 與預先壓縮的版本
+@app.get("/results/{file_path:path}")
+async def get_result_file(file_path: str, request: Request):
+    response = await serve_result_file(request, RESULTS_DIR, file_path)
+    if response is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    task_id = task_id_from_path(file_path)
+    if task_id:
+        await atouch_task(redis_client, task_id)
+    return response
+
+# 批次結果的檔案清單 (分頁)，完成訊息中只帶摘要與這個網址
+@app.get("/batches/{task_id}/files")
+async def list_batch_files(task_id: str, offset: int = 0, limit: Optional[int] = None,
+                           type: Optional[str] = None):
+    page = await run_io(files_page, task_id, offset, limit, type)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    await atouch_task(redis_client, task_id)
+    # 一頁可能有上千筆，直接以 json_codec 編碼，略過 FastAPI 逐欄位的 jsonable_encoder
+    return Response(content=dumpb(page), media_type="application/json")
+
+@app.get("/download/{file_name:path}")
+async def download_file(file_name: str, request: Request):
+    rel_path = download_path(file_name)
+    response = await serve_result_file(request, RESULTS_DIR, rel_path, download_name=Path(rel_path).name)
+    if response is not None:
+        task_id = task_id_from_path(rel_path)
+        if task_id:
+            await atouch_task(redis_client, task_id)
+        return response
     return {"error": "File not found"}
 
 @app.get("/", response_class=HTMLResponse)
-async def read_index():
-    index_html_path = BASE_DIR / "index.html"
-    if index_html_path.exists():
-        return index_html_path.read_text()
+async def read_index(request: Request):
+    # index.html 常駐記憶體，附 ETag 並預先壓縮，不必每次請求都讀取磁碟
+    response = await static_assets.response(request, BASE_DIR / "index.html")
+    if response is not None:
+        return response
     return HTMLResponse("<h1>index.html not found</h1>", status_code=404)
 
 @app.get("/health")
-def health_check():
-    return {"status": "ok"}
+async def health_check():
+    # Redis 無法連線時任務無法排入佇列，回報 degraded 讓監控得知
+    redis_ok = await acheck_redis(redis_client)
+    return {"status": "ok" if redis_ok else "degraded", "redis": "ok" if redis_ok else "unavailable"}
 
@@ -0,0 +1,351 @@
+"""
+AI 模型服務 (Model Serving)
+
+模型權重只在每個 worker 行程啟動時載入一次，不再於每個任務內重新載入。
+支援兩種模式 (環境變數 MODEL_SERVING_MODE)：
+
+  - in_process (預設): 每個 Celery prefork 子行程在 worker_process_init 時
+    載入並 warmup 模型，之後的任務直接使用已載入的模型。
+  - socket: 由一個常駐的推論行程持有模型，Celery 任務透過 Unix socket 呼叫。
+    適合模型很大、不希望每個 prefork 子行程各持有一份權重的情況。
+        python model_server.py serve --socket /tmp/drc_model.sock
+
+socket 模式下，常駐行程前面有一個動態批次佇列 (micro_batcher.MicroBatcher)，
+會把不同任務同時送來的請求合併成一次批次推論，再把結果各自交回原本的任務。
+
+兩種模式都會記錄 cold start (載入 + warmup) 與 warm 推論延遲，可用
+`python model_server.py stats` 查詢常駐行程的統計。
+
+in_process 模式的載入與 warmup 在 worker_process_init 中執行，子行程要等 handler 結束後
+才回報 WORKER_UP；Celery 主行程在 worker_proc_alive_timeout 秒 (預設 4 秒) 內沒收到就會
+終止並重新建立子行程，模型載入比這個時間久時子行程會一直被重啟、永遠無法接任務。
+celery_app.py 因此以 MODEL_CONFIG['worker_start_timeout'] 設定 worker_proc_alive_timeout，
+預設為載入加 warmup 的時間再留兩倍的餘裕；換成真實模型後請以 MODEL_WORKER_START_TIMEOUT
+設定為最慢的載入時間以上 (pool_grow 新增的子行程同樣適用)。
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import argparse
+import threading
+import socketserver
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from micro_batcher import MicroBatcher
+from tiling import LayoutParseError, iter_layout_polygons
+
+MODEL_CONFIG = {
+    'mode': os.getenv('MODEL_SERVING_MODE', 'in_process'),
+    'socket_path': os.getenv('MODEL_SERVER_SOCKET', '/tmp/drc_model.sock'),
+    'socket_timeout': float(os.getenv('MODEL_SERVER_TIMEOUT', '600')),
+    # 模擬用的耗時設定 (換成真實模型後可移除)
+    'load_seconds': float(os.getenv('MOCK_MODEL_LOAD_SECONDS', '5')),
+    'batch_overhead_seconds': float(os.getenv('MOCK_MODEL_BATCH_OVERHEAD_SECONDS', '0.5')),
+    'per_item_seconds': float(os.getenv('MOCK_MODEL_PER_ITEM_SECONDS', '0.2')),
+    # 模擬的 width 檢查：rule 中的 um 換算成 layout 的資料庫單位
+    'dbu_per_um': float(os.getenv('MOCK_MODEL_DBU_PER_UM', '1000')),
+}
+# prefork 子行程啟動 (載入 + warmup) 的最長時間，用於 Celery 的 worker_proc_alive_timeout
+MODEL_CONFIG['worker_start_timeout'] = float(os.getenv(
+    'MODEL_WORKER_START_TIMEOUT',
+    str(max(4.0, 2 * (MODEL_CONFIG['load_seconds'] + MODEL_CONFIG['batch_overhead_seconds']
+                      + MODEL_CONFIG['per_item_seconds'])))))
+
+
+class ModelStats:
+    """記錄 cold start 與 warm 推論延遲"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.load_ms = None
+        self.warmup_ms = None
+        self.batches = 0
+        self.requests = 0
+        self.warm_total_ms = 0.0
+        self.warm_max_ms = 0.0
+
+    def record_batch(self, batch_size: int, elapsed_ms: float):
+        with self._lock:
+            self.batches += 1
+            self.requests += batch_size
+            self.warm_total_ms += elapsed_ms
+            self.warm_max_ms = max(self.warm_max_ms, elapsed_ms)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'cold_start_ms': (self.load_ms or 0.0) + (self.warmup_ms or 0.0),
+                'load_ms': self.load_ms,
+                'warmup_ms': self.warmup_ms,
+                'batches': self.batches,
+                'requests': self.requests,
+                'warm_avg_batch_ms': self.warm_total_ms / self.batches if self.batches else 0.0,
+                'warm_max_batch_ms': self.warm_max_ms,
+            }
+
+
+_digest_cache: Dict[tuple, str] = {}
+
+
+def input_digest(path: str) -> str:
+    """輸入檔案內容的 SHA-256 (以路徑、大小與 mtime 快取，tile 任務不必重複讀取整個 layout)"""
+    stat = os.stat(path)
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _digest_cache:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        if len(_digest_cache) >= 256:
+            _digest_cache.clear()
+        _digest_cache[key] = digest.hexdigest()
+    return _digest_cache[key]
+
+
+_violation_cache: Dict[tuple, List[Dict]] = {}
+
+
+def _layout_violations(path: str, min_width: float) -> List[Dict]:
+    """整個 layout 中寬或高小於 min_width 的多邊形 (以輸入內容與門檻快取，各 tile 共用一次掃描)"""
+    key = (input_digest(path), min_width)
+    if key not in _violation_cache:
+        violations = []
+        try:
+            for polygon in iter_layout_polygons(path):
+                if not polygon:
+                    continue
+                xs = [x for x, _ in polygon]
+                ys = [y for _, y in polygon]
+                x0, y0, x1, y1 = min(xs), min(ys), max(xs), max(ys)
+                if min(x1 - x0, y1 - y0) < min_width:
+                    violations.append({'rule': 'width', 'x': (x0 + x1) / 2, 'y': (y0 + y1) / 2,
+                                       'bbox': [x0, y0, x1, y1]})
+        except LayoutParseError as e:
+            print(f"{e}，略過 width 檢查")
+        if len(_violation_cache) >= 16:
+            _violation_cache.clear()
+        _violation_cache[key] = violations
+    return _violation_cache[key]
+
+
+def mock_violations(file_paths: List[str], compiled_rules: Dict, window: Optional[List[int]]) -> List[Dict]:
+    """
+    模擬模型找到的 violation：依 rule 中的 width 下限，回報與 window 相交的過窄多邊形
+
+    座標是 layout 的絕對座標；halo 內的多邊形會同時被相鄰的 tile 回報，合併時依代表座標去重。
+    """
+    widths = [r['value'] for r in compiled_rules.get('rules', [])
+              if r.get('type') == 'constraint' and r.get('check') == 'width']
+    if not widths:
+        return []
+    min_width = max(widths) * MODEL_CONFIG['dbu_per_um']
+    found = []
+    for path in file_paths:
+        for violation in _layout_violations(path, min_width):
+            vx0, vy0, vx1, vy1 = violation['bbox']
+            if window and (vx1 < window[0] or vx0 > window[2] or vy1 < window[1] or vy0 > window[3]):
+                continue
+            found.append(violation)
+    return sorted(found, key=lambda v: (v['x'], v['y']))
+
+
+class MockDRCModel:
+    """
+    模擬的 DRC 模型
+
+    load() 代表載入權重 (只做一次)，infer_batch() 一次處理多筆請求；
+    批次推論的成本為固定開銷加上每筆的處理時間，批次越大平均成本越低。
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        self.config = config or MODEL_CONFIG
+        self.loaded = False
+        self.stats = ModelStats()
+        # 真實模型通常不是 thread-safe，同一時間只允許一個批次推論
+        self._infer_lock = threading.Lock()
+
+    def load(self):
+        if self.loaded:
+            return
+        start = time.perf_counter()
+        print(f"[PID {os.getpid()}] 載入 AI 模型權重...")
+        time.sleep(self.config['load_seconds'])
+        self.loaded = True
+        self.stats.load_ms = (time.perf_counter() - start) * 1000
+        print(f"[PID {os.getpid()}] AI 模型載入完成 ({self.stats.load_ms:.0f} ms)")
+
+    def warmup(self):
+        """以一筆假資料跑一次推論，讓第一個真正的任務不必承擔初始化成本"""
+        self.load()
+        start = time.perf_counter()
+        self._run([{'file_paths': [], 'compiled_rules': {'rules': [], 'normalized_text': ''},
+                    'window': None, 'output_path': None}])
+        self.stats.warmup_ms = (time.perf_counter() - start) * 1000
+        print(f"[PID {os.getpid()}] AI 模型 warmup 完成 ({self.stats.warmup_ms:.0f} ms)")
+
+    def _run(self, requests: List[Dict]) -> List[Optional[str]]:
+        with self._infer_lock:
+            time.sleep(self.config['batch_overhead_seconds'] + self.config['per_item_seconds'] * len(requests))
+            outputs = []
+            for request in requests:
+                output_path = request.get('output_path')
+                if output_path:
+                    compiled_rules = request['compiled_rules']
+                    # 輸出只由輸入內容、規則與範圍決定 (不含時間與帶 task_id 的上傳路徑)，
+                    # 相同的工作重新送出時 SHA-256 相同，上傳到 Server B 時可以 upload by hash
+                    with open(output_path, 'w', encoding='utf-8') as f:
+                        f.write(f"AI 處理結果\n")
+                        f.write(f"輸入檔案: {[input_digest(path) for path in request['file_paths']]}\n")
+                        # 模型收到使用者原本的 rule 文字 (正規化的文字只用於快取 key 與結構化解析)
+                        f.write(f"規則: {compiled_rules.get('rule_text', compiled_rules['normalized_text'])}\n")
+                        f.write(f"規則 hash: {compiled_rules.get('hash')}\n")
+                        if request.get('window'):
+                            f.write(f"處理範圍: {request['window']}\n")
+                        # 每個 violation 一行 (VIOLATION + JSON)，Server B 轉成 manifest 的 violations
+                        for violation in mock_violations(request['file_paths'], compiled_rules, request.get('window')):
+                            f.write(f"VIOLATION {json.dumps(violation, sort_keys=True)}\n")
+                outputs.append(output_path)
+            return outputs
+
+    def infer_batch(self, requests: List[Dict]) -> List[Optional[str]]:
+        """批次推論，回傳每筆請求的輸出檔路徑"""
+        self.load()
+        start = time.perf_counter()
+        outputs = self._run(requests)
+        self.stats.record_batch(len(requests), (time.perf_counter() - start) * 1000)
+        return outputs
+
+
+# --- 每個行程一份的模型實例 ---
+_model: Optional[MockDRCModel] = None
+_model_lock = threading.Lock()
+
+
+def get_model() -> MockDRCModel:
+    """取得本行程的模型實例 (尚未載入時會先載入並 warmup)"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                model = MockDRCModel()
+                model.warmup()
+                _model = model
+    return _model
+
+
+def init_worker_model():
+    """worker_process_init 時呼叫：in_process 模式預先載入模型，socket 模式確認推論行程可連線"""
+    if MODEL_CONFIG['mode'] == 'socket':
+        try:
+            stats = ModelClient().stats()
+            print(f"[PID {os.getpid()}] 已連線到模型推論行程 (PID {stats['pid']})")
+        except OSError as e:
+            print(f"[PID {os.getpid()}] 無法連線到模型推論行程 {MODEL_CONFIG['socket_path']}: {e}")
+        return
+    get_model()
+
+
+class ModelClient:
+    """透過 Unix socket 呼叫常駐推論行程 (每行一個 JSON 訊息)"""
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: Optional[float] = None):
+        self.socket_path = socket_path or MODEL_CONFIG['socket_path']
+        self.timeout = timeout or MODEL_CONFIG['socket_timeout']
+
+    def _call(self, message: Dict) -> Dict:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+        if not line:
+            raise ConnectionError("模型推論行程未回應")
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(f"模型推論失敗: {response['error']}")
+        return response
+
+    def infer_batch(self, requests: List[Dict]) -> List[Optional[str]]:
+        return self._call({'op': 'infer', 'requests': requests})['outputs']
+
+    def stats(self) -> Dict:
+        return self._call({'op': 'stats'})['stats']
+
+
+def run_inference(requests: List[Dict]) -> List[Optional[str]]:
+    """依設定的模式執行推論"""
+    if MODEL_CONFIG['mode'] == 'socket':
+        return ModelClient().infer_batch(requests)
+    return get_model().infer_batch(requests)
+
+
+class _ModelRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                if message.get('op') == 'stats':
+                    response = {'stats': dict(self.server.model.stats.snapshot(),
+                                              batching=self.server.batcher.stats())}
+                else:
+                    # 每筆請求各自進入批次佇列，與其他連線的請求合併推論
+                    futures = [self.server.batcher.submit(r) for r in message['requests']]
+                    response = {'outputs': [f.result() for f in futures]}
+            except Exception as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+class ModelServer(socketserver.ThreadingUnixStreamServer):
+    """常駐推論行程：啟動時載入並 warmup 模型，之後處理所有 worker 的請求"""
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, model: Optional[MockDRCModel] = None,
+                 window_ms: Optional[float] = None, max_batch_size: Optional[int] = None):
+        Path(socket_path).unlink(missing_ok=True)
+        self.model = model or MockDRCModel()
+        self.model.warmup()
+        self.batcher = MicroBatcher(self.model.infer_batch, window_ms=window_ms, max_batch_size=max_batch_size)
+        super().__init__(socket_path, _ModelRequestHandler)
+        os.chmod(socket_path, 0o660)
+
+    def server_close(self):
+        self.batcher.close()
+        super().server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DRC AI model server")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='啟動常駐推論行程')
+    serve.add_argument('--socket', default=MODEL_CONFIG['socket_path'])
+    serve.add_argument('--window-ms', type=float, default=None, help='批次收集的最長等待時間')
+    serve.add_argument('--max-batch-size', type=int, default=None, help='單一批次的最大請求數')
+    stats = sub.add_parser('stats', help='查詢推論行程的延遲統計')
+    stats.add_argument('--socket', default=MODEL_CONFIG['socket_path'])
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        print(json.dumps(ModelClient(args.socket).stats(), indent=2))
+        return
+
+    server = ModelServer(args.socket, window_ms=args.window_ms, max_batch_size=args.max_batch_size)
+    print(f"模型推論行程已啟動，監聽 {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        Path(args.socket).unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+大型任務參數與結果的 Blob offload
+
+Celery 訊息 (broker) 與任務結果 (result backend) 都存在 Redis 中。當參數或結果
+(例如大量的 file_paths、tile 的 batch manifest) 序列化後超過 TASK_PAYLOAD_OFFLOAD_BYTES，
+改寫到 blob store，訊息中只放一個參考：
+
+    {"__blob__": "<sha256>", "size": <位元組數>}
+
+blob 以內容的 SHA-256 命名 (相同內容只存一份，例如所有 tile 共用的 compiled_rules)，
+存放在 web 與 worker 共用的 BLOB_DIR，超過 BLOB_TTL 秒後由結果清理任務刪除。
+由於 acks_late 的訊息可能被重新派送，blob 不會在讀取後立即刪除。
+
+所有 Celery 任務都以 OffloadingTask 為基底 (celery_app 的 task_cls)：送出任務時
+offload 大型參數，執行前還原，回傳值過大時也改存 blob。
+"""
+
+import os
+import time
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import msgpack
+from celery import Task
+
+BASE_DIR = Path(__file__).resolve().parent
+
+BLOB_CONFIG = {
+    'threshold_bytes': int(os.getenv('TASK_PAYLOAD_OFFLOAD_BYTES', str(64 * 1024))),
+    'blob_dir': Path(os.getenv('BLOB_DIR', str(BASE_DIR / "blobs"))),
+    # 必須大於任務在 bulk lane 中可能排隊的時間
+    'ttl_seconds': int(os.getenv('BLOB_TTL', str(3 * 24 * 3600))),
+}
+
+BLOB_KEY = '__blob__'
+
+
+def _blob_path(digest: str) -> Path:
+    return BLOB_CONFIG['blob_dir'] / digest[:2] / digest
+
+
+def is_blob_ref(value: Any) -> bool:
+    return isinstance(value, dict) and BLOB_KEY in value and len(value) <= 2
+
+
+def put_blob(data: bytes) -> str:
+    """寫入 blob (已存在則只更新 mtime)，回傳 digest"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(digest)
+    if path.exists():
+        os.utime(path)
+        return digest
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{digest}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return digest
+
+
+def get_blob(digest: str) -> bytes:
+    return _blob_path(digest).read_bytes()
+
+
+def offload_value(value: Any, threshold: Optional[int] = None) -> Any:
+    """序列化後超過門檻的值改存 blob，回傳參考；其他值原樣回傳"""
+    if not isinstance(value, (list, tuple, dict, str, bytes)) or is_blob_ref(value):
+        return value
+    threshold = BLOB_CONFIG['threshold_bytes'] if threshold is None else threshold
+    # 字串與 bytes 不需序列化即可判斷大小
+    if isinstance(value, (str, bytes)) and len(value) <= threshold:
+        return value
+    data = msgpack.packb(value, use_bin_type=True)
+    if len(data) <= threshold:
+        return value
+    return {BLOB_KEY: put_blob(data), 'size': len(data)}
+
+
+def resolve_value(value: Any) -> Any:
+    """還原 blob 參考 (包含 list 中的參考，例如 chord 回呼收到的各 tile 結果)"""
+    if is_blob_ref(value):
+        return msgpack.unpackb(get_blob(value[BLOB_KEY]), raw=False)
+    if isinstance(value, list):
+        return [resolve_value(item) for item in value]
+    return value
+
+
+def offload_args(args, kwargs) -> Tuple[tuple, Dict]:
+    args = tuple(offload_value(arg) for arg in (args or ()))
+    kwargs = {key: offload_value(value) for key, value in (kwargs or {}).items()}
+    return args, kwargs
+
+
+def resolve_args(args, kwargs) -> Tuple[tuple, Dict]:
+    args = tuple(resolve_value(arg) for arg in args)
+    kwargs = {key: resolve_value(value) for key, value in kwargs.items()}
+    return args, kwargs
+
+
+class OffloadingTask(Task):
+    """送出時 offload 大型參數、執行前還原；回傳值過大時改存 blob"""
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        args, kwargs = offload_args(args, kwargs)
+        return super().apply_async(args, kwargs, **options)
+
+    def __call__(self, *args, **kwargs):
+        args, kwargs = resolve_args(args, kwargs)
+        result = super().__call__(*args, **kwargs)
+        if self.request.called_directly or self.ignore_result:
+            return result
+        return offload_value(result)
+
+
+def sweep_blobs(now: Optional[float] = None) -> int:
+    """刪除超過 BLOB_TTL 秒沒被寫入的 blob (相同內容再次寫入時會更新 mtime)"""
+    now = now or time.time()
+    root = BLOB_CONFIG['blob_dir']
+    if not root.exists():
+        return 0
+    removed = 0
+    for path in root.glob('*/*'):
+        try:
+            if now - path.stat().st_mtime > BLOB_CONFIG['ttl_seconds']:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
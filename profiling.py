@@ -0,0 +1,222 @@
+"""
+內建的取樣式效能分析 (Sampling profiler) 與 event loop 阻塞偵測
+
+只有在 PROFILING_ENABLED=true 時才會啟用；關閉時不安裝 middleware、不啟動
+監控執行緒，對正常請求沒有任何額外成本。啟用後：
+
+  - 單一 HTTP 請求：帶 header `X-DRC-Profile: 1` (設定 PROFILING_TOKEN 時需帶相同的值)
+  - 單一任務：submit_task 時帶上述 header 或表單欄位 profile=true，任務會帶著
+    `profile` header 進入 Celery；或以 POST /admin/profiles/tasks/{task_id} 事先標記
+    某個 task_id。worker 在 task_prerun / task_postrun 時開始與結束取樣
+  - Web tier 的 event loop 會有一個 watchdog 執行緒，loop 被阻塞超過門檻時
+    記錄阻塞的時間區間與當下的呼叫堆疊
+
+Profile 以 folded stack 格式 (flamegraph.pl / speedscope 可直接讀取) 寫在
+PROFILES_DIR 底下，可透過 /admin/profiles 下載。
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+PROFILING_CONFIG = {
+    'enabled': os.getenv('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes'),
+    'token': os.getenv('PROFILING_TOKEN', ''),
+    'profiles_dir': Path(os.getenv('PROFILES_DIR', 'profiles')),
+    'interval_ms': float(os.getenv('PROFILING_INTERVAL_MS', '5')),
+    'loop_block_threshold_ms': float(os.getenv('LOOP_BLOCK_THRESHOLD_MS', '100')),
+    'loop_block_history': int(os.getenv('LOOP_BLOCK_HISTORY', '500')),
+    'key_prefix': os.getenv('PROFILING_KEY_PREFIX', 'drc:profile'),
+    'mark_ttl': int(os.getenv('PROFILING_MARK_TTL', '86400')),
+}
+
+PROFILE_HEADER = 'X-DRC-Profile'
+
+
+def profile_requested(value: Optional[str]) -> bool:
+    """判斷 header / 表單欄位是否要求 profiling"""
+    if not PROFILING_CONFIG['enabled'] or not value:
+        return False
+    if PROFILING_CONFIG['token']:
+        return value == PROFILING_CONFIG['token']
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def _format_stack(frame) -> str:
+    """將 frame 串成 folded stack 的一行 (最外層在前，以分號分隔)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{Path(code.co_filename).name}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """以固定間隔取樣指定執行緒的呼叫堆疊"""
+
+    def __init__(self, thread_id: Optional[int] = None, interval_ms: Optional[float] = None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = (interval_ms or PROFILING_CONFIG['interval_ms']) / 1000.0
+        self.samples: Counter = Counter()
+        self.started_at = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_format_stack(frame)] += 1
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="drc-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.duration = time.time() - self.started_at
+        return self
+
+    def write(self, name: str) -> Path:
+        """輸出 folded stack 檔案，回傳檔案路徑"""
+        profiles_dir = PROFILING_CONFIG['profiles_dir']
+        profiles_dir.mkdir(parents=True, exist_ok=True)
+        path = profiles_dir / f"{name}.folded"
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"已寫入 profile {path} ({sum(self.samples.values())} 個樣本, {self.duration:.2f} 秒)")
+        return path
+
+
+class LoopBlockMonitor:
+    """
+    偵測 event loop 被同步程式碼阻塞的時間區間
+
+    loop 中的 heartbeat coroutine 定期更新時間戳記；watchdog 執行緒發現時間戳記
+    超過門檻未更新時，取樣 loop 執行緒的堆疊，找出是哪段程式碼卡住了 loop。
+    """
+
+    def __init__(self, threshold_ms: Optional[float] = None):
+        self.threshold = (threshold_ms or PROFILING_CONFIG['loop_block_threshold_ms']) / 1000.0
+        self.blocks: deque = deque(maxlen=PROFILING_CONFIG['loop_block_history'])
+        self._heartbeat = time.perf_counter()
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+        self._current: Optional[Dict] = None
+        self._task = None
+        self._thread = None
+
+    async def _beat(self):
+        interval = self.threshold / 4
+        while True:
+            self._heartbeat = time.perf_counter()
+            await asyncio.sleep(interval)
+
+    def _watch(self):
+        interval = self.threshold / 4
+        while not self._stop.wait(interval):
+            lag = time.perf_counter() - self._heartbeat
+            if lag > self.threshold:
+                if self._current is None:
+                    frame = sys._current_frames().get(self._loop_thread_id)
+                    self._current = {
+                        'start': time.time() - lag,
+                        'stack': _format_stack(frame) if frame is not None else None,
+                    }
+            elif self._current is not None:
+                self._current['duration_ms'] = round((time.time() - self._current['start']) * 1000, 1)
+                self.blocks.append(self._current)
+                print(f"Event loop 被阻塞 {self._current['duration_ms']} ms: {self._current['stack']}")
+                self._current = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="drc-loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def snapshot(self) -> List[Dict]:
+        return list(self.blocks)
+
+    def write(self) -> Path:
+        profiles_dir = PROFILING_CONFIG['profiles_dir']
+        profiles_dir.mkdir(parents=True, exist_ok=True)
+        path = profiles_dir / "loop_blocking.json"
+        path.write_text(json.dumps(self.snapshot(), ensure_ascii=False, indent=2), encoding='utf-8')
+        return path
+
+
+# 以 task_id 為 key 的進行中 profiler (每個 worker 子行程一份)
+_task_profilers: Dict[str, SamplingProfiler] = {}
+
+
+def task_mark_key(task_id: str) -> str:
+    return f"{PROFILING_CONFIG['key_prefix']}:task:{task_id}"
+
+
+def task_profile_requested(task_request, redis_client=None) -> bool:
+    """任務是否要求 profiling：任務 header 帶有 profile，或 task_id 已被 admin 標記"""
+    if not PROFILING_CONFIG['enabled']:
+        return False
+    if getattr(task_request, 'profile', None):
+        return True
+    if redis_client is None:
+        return False
+    try:
+        return bool(redis_client.exists(task_mark_key(task_request.id)))
+    except Exception as e:
+        print(f"查詢 profiling 標記失敗: {e}")
+        return False
+
+
+def start_task_profile(task_id: str):
+    _task_profilers[task_id] = SamplingProfiler().start()
+
+
+def finish_task_profile(task_id: str) -> Optional[Path]:
+    profiler = _task_profilers.pop(task_id, None)
+    if profiler is None:
+        return None
+    return profiler.stop().write(f"task_{task_id}")
+
+
+def list_profiles() -> List[Dict]:
+    profiles_dir = PROFILING_CONFIG['profiles_dir']
+    if not profiles_dir.exists():
+        return []
+    return [
+        {'name': p.name, 'size': p.stat().st_size, 'modified': p.stat().st_mtime}
+        for p in sorted(profiles_dir.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+        if p.is_file()
+    ]
+
+
+def profile_path(name: str) -> Optional[Path]:
+    """回傳 profiles 目錄中的檔案路徑 (拒絕目錄跳脫)"""
+    profiles_dir = PROFILING_CONFIG['profiles_dir'].resolve()
+    path = (profiles_dir / name).resolve()
+    if path.parent != profiles_dir or not path.is_file():
+        return None
+    return path
@@ -0,0 +1,113 @@
+"""
+進度訊息的合併 (coalescing) 與節流
+
+模型與 Server B 的細粒度進度 (百分比、逐檔完成) 可能在短時間內大量產生，前端只需要
+每個任務最新的狀態。同一個任務 (key) 的進度訊息：
+  - 距離上次送出超過 interval 時立即送出
+  - 否則暫存，interval 內後到的訊息直接覆蓋 (latest value wins)，時間到時送出最新的一則
+  - 完成、錯誤或取消 (terminal) 訊息一律立即送出，並丟棄同一任務尚未送出的進度
+
+Worker 端以 ProgressCoalescer 在發布到 Redis 前合併 (PROGRESS_PUBLISH_INTERVAL_MS)，
+web 端的 WebSocketManager 在寫入 WebSocket 前再以相同規則節流 (PROGRESS_WS_INTERVAL_MS)。
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+PROGRESS_CONFIG = {
+    'publish_interval_ms': float(os.getenv('PROGRESS_PUBLISH_INTERVAL_MS', '250')),
+    'ws_interval_ms': float(os.getenv('PROGRESS_WS_INTERVAL_MS', '100')),
+}
+
+TERMINAL_STATUSES = ('completed', 'error', 'cancelled')
+
+
+def is_terminal(payload: Dict) -> bool:
+    return payload.get('status') in TERMINAL_STATUSES
+
+
+class ProgressCoalescer:
+    """
+    同步版本的合併器 (Celery worker 使用)
+
+    send(client_id, payload, terminal) 負責實際送出，在鎖內呼叫，確保同一任務的
+    訊息順序不會因 timer 執行緒與任務執行緒同時送出而顛倒。
+    """
+
+    def __init__(self, send: Callable[[str, Dict, bool], None], interval_ms: Optional[float] = None):
+        self.send = send
+        self.interval = (PROGRESS_CONFIG['publish_interval_ms'] if interval_ms is None else interval_ms) / 1000
+        self._init_state()
+        _coalescers.append(self)
+
+    def _init_state(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[str, Dict]] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def update(self, client_id: str, key: str, payload: Dict):
+        with self._lock:
+            if is_terminal(payload):
+                self._pending.pop(key, None)
+                self._last_sent.pop(key, None)
+                self._send(client_id, payload, True)
+                return
+            now = time.monotonic()
+            if self.interval <= 0 or (key not in self._pending
+                                      and now - self._last_sent.get(key, float('-inf')) >= self.interval):
+                self._last_sent[key] = now
+                self._send(client_id, payload, False)
+                return
+            self._pending[key] = (client_id, payload)
+            self._schedule(now)
+
+    def flush(self):
+        """送出所有暫存的進度 (任務結束時呼叫)"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+            self._last_sent.clear()
+            for client_id, payload in pending.values():
+                self._send(client_id, payload, False)
+
+    def _schedule(self, now: float):
+        if self._timer is not None or not self._pending:
+            return
+        due = min(self._last_sent.get(key, now - self.interval) + self.interval for key in self._pending)
+        self._timer = threading.Timer(max(0.0, due - now), self._flush_due)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_due(self):
+        with self._lock:
+            self._timer = None
+            now = time.monotonic()
+            for key in [k for k in self._pending
+                        if now - self._last_sent.get(k, float('-inf')) >= self.interval - 1e-3]:
+                client_id, payload = self._pending.pop(key)
+                self._last_sent[key] = now
+                self._send(client_id, payload, False)
+            self._schedule(now)
+
+    def _send(self, client_id: str, payload: Dict, terminal: bool):
+        try:
+            self.send(client_id, payload, terminal)
+        except Exception as e:
+            print(f"送出進度訊息失敗: {e}")
+
+
+_coalescers = []
+
+
+def _reset_after_fork():
+    # 子行程沒有父行程的 timer 執行緒，重新初始化狀態與鎖
+    for coalescer in _coalescers:
+        coalescer._init_state()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,181 @@
+"""
+共用的 Redis 連線設定與連線池
+
+web (main.py)、Celery (broker / result backend) 與 worker 內的 Redis 操作都從這裡取得連線，
+連線位置只由環境變數決定：
+  - REDIS_URL: 例如 redis://localhost:6379/0
+  - REDIS_UNIX_SOCKET: 設定後改走 Unix socket (同一台機器時省去 TCP 的開銷)，db 沿用 REDIS_URL 的設定
+
+連線池以行程為單位建立：Celery prefork 子行程 fork 後第一次使用時才建立自己的連線池，
+不會沿用父行程的 socket。連線閒置超過 REDIS_HEALTH_CHECK_INTERVAL 秒後使用前會先 PING，
+連線中斷或逾時時以指數退避重新連線並重試。
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import redis
+import redis.asyncio as aioredis
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+
+REDIS_CONFIG = {
+    'url': os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+    'unix_socket': os.getenv('REDIS_UNIX_SOCKET', ''),
+    'max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS', '32')),
+    'health_check_interval': int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', '30')),
+    'socket_timeout': float(os.getenv('REDIS_SOCKET_TIMEOUT', '5')),
+    'socket_connect_timeout': float(os.getenv('REDIS_SOCKET_CONNECT_TIMEOUT', '5')),
+    'retries': int(os.getenv('REDIS_RETRIES', '3')),
+    # 進度訊息在此時間窗內合併成一次 pipeline 送出，0 代表每則訊息立即 PUBLISH
+    'publish_batch_ms': float(os.getenv('REDIS_PUBLISH_BATCH_MS', '10')),
+    'publish_batch_size': int(os.getenv('REDIS_PUBLISH_BATCH_SIZE', '64')),
+}
+
+
+def redis_db() -> int:
+    path = urlparse(REDIS_CONFIG['url']).path.strip('/')
+    return int(path) if path.isdigit() else 0
+
+
+def redis_url() -> str:
+    """redis-py 使用的連線 URL"""
+    if REDIS_CONFIG['unix_socket']:
+        return f"unix://{REDIS_CONFIG['unix_socket']}?db={redis_db()}"
+    return REDIS_CONFIG['url']
+
+
+def celery_url() -> str:
+    """Celery broker 與 result backend 使用的 URL (Unix socket 的寫法與 redis-py 不同)"""
+    if REDIS_CONFIG['unix_socket']:
+        return f"redis+socket://{REDIS_CONFIG['unix_socket']}?virtual_host={redis_db()}"
+    return REDIS_CONFIG['url']
+
+
+def _connection_kwargs(overrides: Dict) -> Dict:
+    kwargs = {
+        'max_connections': REDIS_CONFIG['max_connections'],
+        'health_check_interval': REDIS_CONFIG['health_check_interval'],
+        'socket_timeout': REDIS_CONFIG['socket_timeout'],
+        'socket_connect_timeout': REDIS_CONFIG['socket_connect_timeout'],
+        'retry_on_error': [ConnectionError, TimeoutError],
+    }
+    kwargs.update(overrides)
+    return kwargs
+
+
+# --- 同步 client (Celery worker 與工具程式) ---
+_clients: Dict[bool, redis.Redis] = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+
+
+def get_redis(decode_responses: bool = False) -> redis.Redis:
+    """取得目前行程共用的 client；fork 後的子行程會建立自己的連線池"""
+    global _clients_pid
+    pid = os.getpid()
+    client = _clients.get(decode_responses)
+    if client is not None and _clients_pid == pid:
+        return client
+    with _clients_lock:
+        if _clients_pid != pid:
+            # 父行程的 socket 不能在子行程使用，也不能關閉 (會影響父行程)，直接丟棄
+            _clients.clear()
+            _clients_pid = pid
+        client = _clients.get(decode_responses)
+        if client is None:
+            client = new_redis(decode_responses=decode_responses)
+            _clients[decode_responses] = client
+        return client
+
+
+def new_redis(**overrides) -> redis.Redis:
+    """建立一個擁有獨立連線池的 client (例如需要關閉 socket_timeout 的長時間阻塞操作)"""
+    kwargs = _connection_kwargs(overrides)
+    kwargs['retry'] = Retry(ExponentialBackoff(cap=2, base=0.05), REDIS_CONFIG['retries'])
+    return redis.Redis(connection_pool=redis.ConnectionPool.from_url(redis_url(), **kwargs))
+
+
+# --- 非同步 client (FastAPI) ---
+def new_async_redis(**overrides) -> aioredis.Redis:
+    """建立 asyncio client；Pub/Sub 監聽請傳入 socket_timeout=None，避免沒有訊息時讀取逾時"""
+    kwargs = _connection_kwargs(overrides)
+    kwargs['retry'] = AsyncRetry(ExponentialBackoff(cap=2, base=0.05), REDIS_CONFIG['retries'])
+    return aioredis.Redis(connection_pool=aioredis.ConnectionPool.from_url(redis_url(), **kwargs))
+
+
+class BatchPublisher:
+    """
+    將短時間內連續的 PUBLISH 合併成一次 pipeline 送出
+
+    第一則訊息進來後等待 publish_batch_ms，期間的訊息依序放進同一個 pipeline；
+    累積到 publish_batch_size 則，或呼叫端要求 flush (例如任務完成或失敗的訊息) 時立即送出。
+    所有送出動作都在同一把鎖內，訊息順序與發布順序相同。
+    """
+
+    def __init__(self, window_ms: Optional[float] = None, max_batch: Optional[int] = None):
+        self.window = (REDIS_CONFIG['publish_batch_ms'] if window_ms is None else window_ms) / 1000
+        self.max_batch = max_batch or REDIS_CONFIG['publish_batch_size']
+        self._init_state()
+        _publishers.append(self)
+
+    def _init_state(self):
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, str]] = []
+        self._timer: Optional[threading.Timer] = None
+
+    def publish(self, channel: str, message: str, flush: bool = False):
+        if self.window <= 0:
+            get_redis().publish(channel, message)
+            return
+        with self._lock:
+            self._pending.append((channel, message))
+            if flush or len(self._pending) >= self.max_batch:
+                self._send()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._send()
+
+    def _send(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for channel, message in batch:
+                pipe.publish(channel, message)
+            pipe.execute()
+        except Exception as e:
+            print(f"發布 {len(batch)} 則 Redis 訊息失敗: {e}")
+
+
+_publishers: List[BatchPublisher] = []
+
+
+def _reset_publishers_after_fork():
+    # 子行程沒有父行程的 timer 執行緒，鎖也可能在 fork 當下被持有，重新初始化
+    for publisher in _publishers:
+        publisher._init_state()
+
+
+os.register_at_fork(after_in_child=_reset_publishers_after_fork)
+
+
+async def acheck_redis(client: aioredis.Redis) -> bool:
+    try:
+        return bool(await client.ping())
+    except Exception as e:
+        print(f"Redis 健康檢查失敗: {e}")
+        return False
@@ -0,0 +1,279 @@
+"""
+結果檔案的傳送層 (取代 /results 的 StaticFiles mount 與 /download 的 FileResponse)
+
+  - ETag 以檔案內容的 SHA-256 產生 (依 path / mtime / size 快取在記憶體中)
+  - 屬於單一任務的路徑 (results/{shard}/{task_id}/...) 內容不會再變動，
+    回應 `Cache-Control: public, max-age=31536000, immutable`，瀏覽器重新 render
+    訊息時不會再次請求同一張圖
+  - If-None-Match 相符時回應 304
+  - Range 請求 (單一區間) 回應 206，供大型 GDS / ZIP 續傳
+  - worker 產生結果後以 precompress_directory() 預先寫出 .gz 與 .zst (需安裝
+    zstandard 套件) 的 sidecar 檔，傳送時依 Accept-Encoding 直接送出壓縮後的檔案，
+    不在請求時壓縮
+"""
+
+import os
+import re
+import gzip
+import shutil
+import hashlib
+import mimetypes
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from async_io import run_io, accepted_encodings
+
+try:
+    import zstandard
+except ImportError:  # zstandard 為選用套件，未安裝時只產生 gzip
+    zstandard = None
+
+DELIVERY_CONFIG = {
+    # 這些副檔名的檔案會預先壓縮 (PNG / ZIP 已經是壓縮格式，不需要)
+    'compressible_suffixes': tuple(
+        s.strip() for s in os.getenv('PRECOMPRESS_SUFFIXES', '.gds,.gdsii,.txt,.json,.csv,.log').split(',') if s.strip()),
+    'min_bytes': int(os.getenv('PRECOMPRESS_MIN_BYTES', '1024')),
+    # 壓縮後小於原始大小的此比例才保留 sidecar
+    'max_ratio': float(os.getenv('PRECOMPRESS_MAX_RATIO', '0.9')),
+    'gzip_level': int(os.getenv('PRECOMPRESS_GZIP_LEVEL', '9')),
+    'zstd_level': int(os.getenv('PRECOMPRESS_ZSTD_LEVEL', '19')),
+    'etag_cache_size': int(os.getenv('ETAG_CACHE_SIZE', '10000')),
+    'immutable_max_age': int(os.getenv('RESULTS_MAX_AGE', str(365 * 24 * 3600))),
+}
+
+# Content-Encoding 與 sidecar 副檔名，依偏好排序
+ENCODINGS = (('zstd', '.zst'), ('gzip', '.gz'))
+SIDECAR_SUFFIXES = tuple(suffix for _, suffix in ENCODINGS)
+
+_TASK_FILE_RE = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}_')
+_CHUNK_SIZE = 256 * 1024
+
+
+# --- 預先壓縮 (worker 端) ---
+
+def _compress_file(path: Path) -> List[Path]:
+    size = path.stat().st_size
+    written = []
+    candidates = [('.gz', lambda src, dst: _gzip_copy(src, dst))]
+    if zstandard is not None:
+        candidates.insert(0, ('.zst', lambda src, dst: _zstd_copy(src, dst)))
+    for suffix, compress in candidates:
+        sidecar = path.with_name(path.name + suffix)
+        tmp = sidecar.with_name(sidecar.name + '.tmp')
+        with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+            compress(src, dst)
+        if tmp.stat().st_size <= size * DELIVERY_CONFIG['max_ratio']:
+            os.replace(tmp, sidecar)
+            written.append(sidecar)
+        else:
+            tmp.unlink()
+    return written
+
+
+def _gzip_copy(src, dst):
+    # mtime=0 讓相同內容產生相同的壓縮檔
+    with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=DELIVERY_CONFIG['gzip_level'], mtime=0) as gz:
+        shutil.copyfileobj(src, gz, _CHUNK_SIZE)
+
+
+def _zstd_copy(src, dst):
+    zstandard.ZstdCompressor(level=DELIVERY_CONFIG['zstd_level']).copy_stream(src, dst)
+
+
+def is_compressible(path: Path) -> bool:
+    return (path.suffix.lower() in DELIVERY_CONFIG['compressible_suffixes']
+            and path.stat().st_size >= DELIVERY_CONFIG['min_bytes'])
+
+
+def precompress_files(paths: Iterable[Path]) -> Dict[str, int]:
+    """為可壓縮的檔案寫出 .gz / .zst sidecar，回傳處理的檔案數、原始位元組數與 sidecar 數"""
+    stats = {'files': 0, 'original_bytes': 0, 'sidecars': 0}
+    for path in paths:
+        path = Path(path)
+        if not path.is_file() or path.suffix in SIDECAR_SUFFIXES or not is_compressible(path):
+            continue
+        try:
+            sidecars = _compress_file(path)
+        except Exception as e:
+            print(f"預先壓縮 {path} 失敗: {e}")
+            continue
+        stats['files'] += 1
+        stats['original_bytes'] += path.stat().st_size
+        stats['sidecars'] += len(sidecars)
+    return stats
+
+
+def precompress_directory(directory: Path) -> Dict[str, int]:
+    """預先壓縮目錄中所有可壓縮的檔案 (一個任務的結果與 manifest 都在同一個目錄)"""
+    paths = [p for p in directory.rglob('*') if p.is_file()] if directory.is_dir() else []
+    stats = precompress_files(paths)
+    if stats['files']:
+        print(f"已預先壓縮 {directory} 中的 {stats['files']} 個檔案 ({stats['sidecars']} 個壓縮版本)")
+    return stats
+
+
+# --- 傳送 (web 端) ---
+
+class _ETagCache:
+    """(path, mtime_ns, size) -> 內容 SHA-256 的 LRU 快取"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key) -> Optional[str]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value: str):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+_etag_cache = _ETagCache(DELIVERY_CONFIG['etag_cache_size'])
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def _stat_variants(path: Path) -> Tuple[Optional[os.stat_result], Dict[str, Path]]:
+    """回傳原始檔的 stat，以及存在且比原始檔新的壓縮版本"""
+    try:
+        st = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return None, {}
+    if not path.is_file():
+        return None, {}
+    variants = {}
+    for encoding, suffix in ENCODINGS:
+        sidecar = path.with_name(path.name + suffix)
+        try:
+            if sidecar.stat().st_mtime_ns >= st.st_mtime_ns:
+                variants[encoding] = sidecar
+        except FileNotFoundError:
+            continue
+    return st, variants
+
+
+def resolve_result_path(root: Path, rel_path: str) -> Optional[Path]:
+    """將 URL 路徑轉成 root 底下的檔案路徑，拒絕目錄跳脫與直接請求 sidecar"""
+    root = root.resolve()
+    path = (root / rel_path).resolve()
+    if root != path and root not in path.parents:
+        return None
+    if path.suffix in SIDECAR_SUFFIXES or path.name.endswith('.tmp'):
+        return None
+    return path
+
+
+def is_task_scoped(root: Path, path: Path) -> bool:
+    """任務目錄底下的檔案，或以 task_id 為前綴的檔案，內容不會再變動"""
+    rel = path.relative_to(root.resolve())
+    return len(rel.parts) > 1 or bool(_TASK_FILE_RE.match(rel.name))
+
+
+def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """解析單一區間的 Range header；多重區間或無法解析時回傳 None (改送整個檔案)"""
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first == '':
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if end < start:
+        return None
+    # start 超出檔案大小時由呼叫端回應 416
+    return start, min(end, size - 1)
+
+
+def _iter_range(path: Path, start: int, end: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def serve_result_file(request, root: Path, rel_path: str, download_name: Optional[str] = None):
+    """
+    傳送 root 底下的結果檔；找不到時回傳 None
+
+    download_name 有值時加上 Content-Disposition: attachment。
+    """
+    path = resolve_result_path(root, rel_path)
+    if path is None:
+        return None
+    st, variants = await run_io(_stat_variants, path)
+    if st is None:
+        return None
+
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    digest = _etag_cache.get(key)
+    if digest is None:
+        digest = await run_io(_hash_file, path)
+        _etag_cache.put(key, digest)
+
+    range_header = request.headers.get('range')
+    encoding = None
+    if not range_header:
+        accepted = accepted_encodings(request.headers.get('accept-encoding'))
+        encoding = next((enc for enc, _ in ENCODINGS if enc in variants and (enc in accepted or '*' in accepted)), None)
+
+    etag = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': (f"public, max-age={DELIVERY_CONFIG['immutable_max_age']}, immutable"
+                          if is_task_scoped(root, path) else 'no-cache'),
+    }
+    if variants:
+        headers['Vary'] = 'Accept-Encoding'
+    if download_name:
+        headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and (if_none_match.strip() == '*' or
+                          etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    if range_header:
+        if_range = request.headers.get('if-range')
+        byte_range = _parse_range(range_header, st.st_size) if not if_range or if_range == etag else None
+        if byte_range is not None:
+            start, end = byte_range
+            if start >= st.st_size:
+                return Response(status_code=416, headers={'Content-Range': f"bytes */{st.st_size}"})
+            headers['Content-Range'] = f"bytes {start}-{end}/{st.st_size}"
+            headers['Content-Length'] = str(end - start + 1)
+            return StreamingResponse(_iter_range(path, start, end), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        return FileResponse(variants[encoding], media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
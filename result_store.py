@@ -0,0 +1,301 @@
+"""
+結果檔案的存放位置與保留策略 (Retention)
+
+存放位置：每個任務的所有結果 (解壓縮的檔案、{task_id}_results.zip、
+{task_id}_manifest.json 與預先壓縮的版本) 都放在同一個目錄
+results/{task_id 前兩碼}/{task_id}/，單一目錄的項目數不會無限增加，
+刪除一個任務只需移除一個目錄。所有路徑與 URL 都應透過 task_dir / result_url 取得。
+
+保留策略：任務完成時以 register_task 把目錄大小記錄到 Redis 索引，
+web 端在結果被讀取時以 atouch_task 更新最後存取時間。Celery beat 定期執行 sweep：
+  1. 收編索引中沒有的目錄 (舊版未分層的結果、worker 中斷留下的目錄、Redis 資料遺失)
+  2. 建立超過 RESULTS_TTL 秒的任務直接刪除
+  3. 總用量超過 RESULTS_QUOTA_BYTES 時，依最後存取時間 (LRU) 刪除，直到低於 quota 的
+     RESULTS_LOW_WATERMARK 比例；最近 RESULTS_MIN_RESIDENT 秒內存取過的任務不會被刪除
+  4. uploads/ 中超過 UPLOADS_TTL 秒的暫存檔 (失敗任務留下的) 直接刪除
+
+Redis 索引：
+  drc:retention:size     hash  task_id -> 位元組數
+  drc:retention:atime    zset  task_id -> 最後存取時間
+  drc:retention:created  zset  task_id -> 建立時間
+  drc:retention:bytes    所有已登記任務的總位元組數
+  drc:retention:stats    hash  各原因刪除的任務數與釋放的位元組數
+"""
+
+import os
+import re
+import time
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent
+
+STORE_CONFIG = {
+    'results_root': Path(os.getenv('RESULTS_DIR', str(BASE_DIR / "results"))),
+    'uploads_root': Path(os.getenv('UPLOADS_DIR', str(BASE_DIR / "uploads"))),
+    'shard_chars': int(os.getenv('RESULTS_SHARD_CHARS', '2')),
+    'ttl_seconds': int(os.getenv('RESULTS_TTL', str(7 * 24 * 3600))),
+    'quota_bytes': int(os.getenv('RESULTS_QUOTA_BYTES', str(50 * 1024 ** 3))),
+    'low_watermark': float(os.getenv('RESULTS_LOW_WATERMARK', '0.9')),
+    'min_resident_seconds': int(os.getenv('RESULTS_MIN_RESIDENT', '300')),
+    'uploads_ttl_seconds': int(os.getenv('UPLOADS_TTL', str(24 * 3600))),
+    # 未登記的目錄至少要這麼舊才收編，避免動到還在寫入的任務
+    'orphan_grace_seconds': int(os.getenv('RESULTS_ORPHAN_GRACE', '3600')),
+    'sweep_interval_seconds': int(os.getenv('RESULTS_SWEEP_INTERVAL', '600')),
+    # web 端同一任務最多每隔幾秒寫一次存取時間
+    'touch_interval_seconds': int(os.getenv('RESULTS_TOUCH_INTERVAL', '60')),
+    'key_prefix': os.getenv('RETENTION_KEY_PREFIX', 'drc:retention'),
+}
+
+# 任務 id 是 uuid4 (main.py)，tile 的批次再加上 _tileNNN (tasks.py)
+_TASK_ID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(?:_tile\d+)?$')
+_LEGACY_FILE_RE = re.compile(r'^(?P<task_id>.+?)_(?:results\.zip|manifest\.json)(?:\.gz|\.zst)?$')
+
+
+# --- 存放位置 ---
+
+def task_shard(task_id: str) -> str:
+    return task_id[:STORE_CONFIG['shard_chars']].lower().ljust(STORE_CONFIG['shard_chars'], '_')
+
+
+def task_dir(task_id: str, create: bool = False) -> Path:
+    """任務的結果目錄 results/{shard}/{task_id}"""
+    path = STORE_CONFIG['results_root'] / task_shard(task_id) / task_id
+    if create:
+        path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def zip_name(task_id: str) -> str:
+    return f"{task_id}_results.zip"
+
+
+def manifest_name(task_id: str) -> str:
+    return f"{task_id}_manifest.json"
+
+
+def files_index_name(task_id: str) -> str:
+    return f"{task_id}_files.json"
+
+
+def result_url(task_id: str, filename: str) -> str:
+    return f"/results/{task_shard(task_id)}/{task_id}/{filename}"
+
+
+def task_id_from_path(rel_path: str) -> Optional[str]:
+    """由 /results 之後的相對路徑取出 task_id (shard/task_id/filename)"""
+    parts = Path(rel_path).parts
+    if len(parts) >= 3 and parts[0] == task_shard(parts[1]):
+        return parts[1]
+    return None
+
+
+def download_path(file_name: str) -> str:
+    """
+    /download/{file_name} 的相對路徑：舊版的 {task_id}_results.zip 等扁平檔名
+    對應到分層後的目錄，其他路徑維持原樣
+    """
+    match = _LEGACY_FILE_RE.match(file_name)
+    if match and '/' not in file_name:
+        task_id = match.group('task_id')
+        return f"{task_shard(task_id)}/{task_id}/{file_name}"
+    return file_name
+
+
+# --- Redis 索引 ---
+
+def _key(name: str) -> str:
+    return f"{STORE_CONFIG['key_prefix']}:{name}"
+
+
+def dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def register_task(redis_client, task_id: str, created_at: Optional[float] = None) -> int:
+    """任務結果寫入完成後呼叫 (同步 Redis client)，記錄大小並視為剛被存取"""
+    size = dir_size(task_dir(task_id))
+    created_at = created_at or time.time()
+    previous = redis_client.hget(_key('size'), task_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(_key('size'), task_id, size)
+    pipe.zadd(_key('created'), {task_id: created_at}, nx=True)
+    pipe.zadd(_key('atime'), {task_id: created_at})
+    pipe.incrby(_key('bytes'), size - int(previous or 0))
+    pipe.execute()
+    return size
+
+
+_last_touch: Dict[str, float] = {}
+
+
+async def atouch_task(redis_client, task_id: str):
+    """記錄任務最後存取時間 (非同步，供 web 端使用)；同一任務在 touch_interval 內只寫一次"""
+    now = time.time()
+    if now - _last_touch.get(task_id, 0.0) < STORE_CONFIG['touch_interval_seconds']:
+        return
+    _last_touch[task_id] = now
+    if len(_last_touch) > 10000:
+        _last_touch.clear()
+    try:
+        # XX：只更新已登記的任務，避免被刪除的任務因為 404 請求又出現在索引中
+        await redis_client.zadd(_key('atime'), {task_id: now}, xx=True)
+    except Exception as e:
+        print(f"更新結果存取時間失敗: {e}")
+
+
+def evict_task(redis_client, task_id: str, reason: str) -> int:
+    """刪除一個任務的結果目錄並移出索引，回傳釋放的位元組數"""
+    size = int(redis_client.hget(_key('size'), task_id) or 0)
+    shutil.rmtree(task_dir(task_id), ignore_errors=True)
+    pipe = redis_client.pipeline()
+    pipe.hdel(_key('size'), task_id)
+    pipe.zrem(_key('atime'), task_id)
+    pipe.zrem(_key('created'), task_id)
+    pipe.decrby(_key('bytes'), size)
+    pipe.hincrby(_key('stats'), f"evicted_{reason}", 1)
+    pipe.hincrby(_key('stats'), 'evicted_bytes', size)
+    pipe.execute()
+    print(f"已刪除任務 {task_id} 的結果 ({reason}, {size} bytes)")
+    return size
+
+
+# --- 定期清理 ---
+
+def _iter_task_dirs() -> Iterator[Tuple[str, Path]]:
+    root = STORE_CONFIG['results_root']
+    if not root.exists():
+        return
+    for shard in root.iterdir():
+        if not shard.is_dir() or len(shard.name) != STORE_CONFIG['shard_chars']:
+            continue
+        for path in shard.iterdir():
+            if path.is_dir() and task_shard(path.name) == shard.name:
+                yield path.name, path
+
+
+def _migrate_legacy(now: float) -> int:
+    """
+    將舊版 results/{task_id}/ 與 results/{task_id}_results.zip 等檔案搬進分層目錄
+
+    只搬名稱符合任務 id 的目錄，手動放進 results/ 或其他元件建立的目錄不會被當成任務。
+    """
+    root = STORE_CONFIG['results_root']
+    if not root.exists():
+        return 0
+    moved = 0
+    for path in list(root.iterdir()):
+        if now - path.stat().st_mtime < STORE_CONFIG['orphan_grace_seconds']:
+            continue
+        if path.is_dir() and _TASK_ID_RE.match(path.name):
+            task_id = path.name
+        elif path.is_file() and _LEGACY_FILE_RE.match(path.name):
+            task_id = _LEGACY_FILE_RE.match(path.name).group('task_id')
+        else:
+            continue
+        dest_dir = task_dir(task_id, create=True)
+        if path.is_dir():
+            for item in path.iterdir():
+                shutil.move(str(item), str(dest_dir / item.name))
+            path.rmdir()
+        else:
+            shutil.move(str(path), str(dest_dir / path.name))
+        moved += 1
+    return moved
+
+
+def _adopt_orphans(redis_client, now: float) -> int:
+    """登記索引中沒有的任務目錄 (以目錄的 mtime 作為建立與存取時間)"""
+    known = {_decode(k) for k in redis_client.hkeys(_key('size'))}
+    adopted = 0
+    for task_id, path in _iter_task_dirs():
+        if task_id in known:
+            continue
+        mtime = path.stat().st_mtime
+        if now - mtime < STORE_CONFIG['orphan_grace_seconds']:
+            continue
+        register_task(redis_client, task_id, created_at=mtime)
+        adopted += 1
+    return adopted
+
+
+def _sweep_uploads(now: float) -> int:
+    root = STORE_CONFIG['uploads_root']
+    if not root.exists():
+        return 0
+    removed = 0
+    for path in root.iterdir():
+        try:
+            if path.is_file() and now - path.stat().st_mtime > STORE_CONFIG['uploads_ttl_seconds']:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def sweep(redis_client, now: Optional[float] = None) -> Dict:
+    """執行一次清理 (同步 Redis client)；以 Redis lock 確保同時只有一個 sweeper 在執行"""
+    now = now or time.time()
+    lock_key = _key('sweep_lock')
+    if not redis_client.set(lock_key, os.getpid(), nx=True, ex=STORE_CONFIG['sweep_interval_seconds']):
+        return {'skipped': True}
+
+    stats = {'migrated': 0, 'adopted': 0, 'ttl': 0, 'lru': 0, 'uploads': 0, 'freed_bytes': 0}
+    try:
+        stats['migrated'] = _migrate_legacy(now)
+        stats['adopted'] = _adopt_orphans(redis_client, now)
+
+        # TTL：建立時間超過保留期限
+        for task_id in redis_client.zrangebyscore(_key('created'), '-inf', now - STORE_CONFIG['ttl_seconds']):
+            stats['freed_bytes'] += evict_task(redis_client, _decode(task_id), 'ttl')
+            stats['ttl'] += 1
+
+        # LRU：總用量超過 quota 時從最久沒被存取的任務開始刪除
+        total = int(redis_client.get(_key('bytes')) or 0)
+        quota = STORE_CONFIG['quota_bytes']
+        if quota and total > quota:
+            target = quota * STORE_CONFIG['low_watermark']
+            resident_after = now - STORE_CONFIG['min_resident_seconds']
+            while total > target:
+                oldest = redis_client.zrangebyscore(_key('atime'), '-inf', resident_after, start=0, num=50)
+                if not oldest:
+                    print(f"結果用量 {total} bytes 超過 quota，但其餘任務都在最近 "
+                          f"{STORE_CONFIG['min_resident_seconds']} 秒內被存取過")
+                    break
+                for task_id in oldest:
+                    freed = evict_task(redis_client, _decode(task_id), 'lru')
+                    stats['freed_bytes'] += freed
+                    stats['lru'] += 1
+                    total -= freed
+                    if total <= target:
+                        break
+
+        stats['uploads'] = _sweep_uploads(now)
+        stats['total_bytes'] = int(redis_client.get(_key('bytes')) or 0)
+        return stats
+    finally:
+        redis_client.delete(lock_key)
+
+
+async def get_retention_stats(redis_client) -> Dict:
+    """目前的總用量、任務數與累計刪除統計 (非同步，供 /metrics 使用)"""
+    stats = await redis_client.hgetall(_key('stats')) or {}
+    return {
+        'total_bytes': int(await redis_client.get(_key('bytes')) or 0),
+        'tasks': int(await redis_client.hlen(_key('size'))),
+        'quota_bytes': STORE_CONFIG['quota_bytes'],
+        'evicted': {_decode(k): int(v) for k, v in stats.items()},
+    }
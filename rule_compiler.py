@@ -0,0 +1,199 @@
+"""
+DRC Rule 描述編譯與快取
+
+使用者輸入的 rule_text 會先正規化 (去除獨立成行的註解、統一大小寫/空白/數值與單位寫法、
+排序)，再解析成結構化的 compiled 形式。compiled 結果以正規化文字的 SHA-256
+為 key 存放在 Redis，相同的 rule deck 之後再送進來時直接取用，不必重新解析。
+
+正規化只用於快取 key 與結構化解析；模型收到的 compiled 結果另外帶有原始的 rule_text
+(保留原本的大小寫、順序與行內的 # 等文字)，無法解析的自由文字 rule 以原文交給模型。
+
+快取命中/未命中次數與編譯耗時累計在 Redis hash `drc:rules:stats`。
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+from typing import Dict
+
+RULE_CACHE_CONFIG = {
+    'key_prefix': os.getenv('RULE_CACHE_PREFIX', 'drc:rules'),
+    'ttl': int(os.getenv('RULE_CACHE_TTL', str(7 * 24 * 3600))),  # 預設保留 7 天
+}
+
+# 編譯格式版本；解析邏輯改變時調整此值，舊的快取會自然失效
+COMPILER_VERSION = 2
+
+# 只有整行都是註解時才略過；行內的 # (例如 "color #3") 是 rule 的一部分
+_COMMENT_LINE_RE = re.compile(r'^\s*(#|//)')
+# 面積單位要排在長度單位前面，否則 um2 會被拆成 um 與 2
+_NUMBER_UNIT_RE = re.compile(
+    r'(?<![\w.])(-?(?:\d+(?:\.\d+)?|\.\d+))(?:\s*(um\^?2|µm\^?2|µm²|um²|nm\^?2|nm²|um|nm|µm|u))?(?![\w.])',
+    re.IGNORECASE)
+_NUMBER_RE = re.compile(r'-?(?:\d+(?:\.\d+)?|\.\d+)')
+_OPERATORS = ('>=', '<=', '==', '>', '<', '=')
+
+# 常見 rule 寫法的同義詞，統一成標準名稱
+_CHECK_ALIASES = {
+    'width': 'width', 'min_width': 'width', 'minwidth': 'width', 'w': 'width',
+    'space': 'spacing', 'spacing': 'spacing', 'min_space': 'spacing', 'minspace': 'spacing', 's': 'spacing',
+    'enclosure': 'enclosure', 'enc': 'enclosure', 'enclose': 'enclosure',
+    'area': 'area', 'min_area': 'area', 'minarea': 'area',
+    'extension': 'extension', 'ext': 'extension',
+    'overlap': 'overlap',
+    'density': 'density',
+}
+# 各種檢查的數值單位 (正規化後的數值都已換算成這個單位)
+_CHECK_UNITS = {'area': 'um2', 'density': 'ratio'}
+_FILLER_WORDS = {'min', 'minimum', 'must', 'be', 'is', 'should', 'of', 'to', 'the', 'rule', 'check',
+                 'between', 'by', 'and', 'than', 'with', 'from', 'on'}
+
+
+def _normalize_number(match: re.Match) -> str:
+    """數值統一換算成 um (面積為 um2) 並去除多餘的 0 (例如 0.100um、100nm、.1um 都變成 0.1)"""
+    value = float(match.group(1))
+    unit = (match.group(2) or '').lower()
+    if unit == 'nm':
+        value /= 1000.0
+    elif unit.startswith('nm'):
+        value /= 1000.0 * 1000.0
+    return f"{value:.6f}".rstrip('0').rstrip('.')
+
+
+def normalize_rule_text(rule_text: str) -> str:
+    """將 rule 描述轉成標準文字形式 (每行一條 rule，排序後合併)"""
+    lines = []
+    for raw_line in re.split(r'[\n;]+', rule_text or ''):
+        if _COMMENT_LINE_RE.match(raw_line):
+            continue
+        line = raw_line.strip().lower()
+        if not line:
+            continue
+        line = _NUMBER_UNIT_RE.sub(_normalize_number, line)
+        line = re.sub(r'\s*(>=|<=|==|>|<|=)\s*', r' \1 ', line)
+        line = ' '.join(line.split())
+        lines.append(line)
+    # rule deck 中的順序不影響語意，排序並去除重複行
+    return '\n'.join(sorted(set(lines)))
+
+
+def rule_hash(normalized_text: str) -> str:
+    return hashlib.sha256(f"v{COMPILER_VERSION}\n{normalized_text}".encode('utf-8')).hexdigest()
+
+
+def _parse_rule_line(line: str) -> Dict:
+    """
+    解析單行 rule；無法辨識的寫法保留為純文字，交給模型自行理解
+
+    數值取運算子後的第一個數字 (沒有運算子時取最後一個)；跟在 layer 名稱後面的整數
+    屬於 layer 名稱 ("metal 1" 為 METAL1)。
+    """
+    tokens = [t for t in line.split() if t not in _FILLER_WORDS]
+    numbers = [i for i, t in enumerate(tokens) if _NUMBER_RE.fullmatch(t)]
+    operator_at = next((i for i, t in enumerate(tokens) if t in _OPERATORS), None)
+    if operator_at is not None:
+        value_at = next((i for i in numbers if i > operator_at), None)
+    else:
+        value_at = numbers[-1] if numbers else None
+
+    check = None
+    layers = []
+    operator = None
+    value = None
+    previous_is_layer = False
+
+    for i, token in enumerate(tokens):
+        is_layer = False
+        if token in _OPERATORS:
+            operator = '>=' if token in ('=', '==') else token
+        elif token in _CHECK_ALIASES and check is None:
+            check = _CHECK_ALIASES[token]
+        elif i == value_at:
+            value = float(token)
+        elif _NUMBER_RE.fullmatch(token) and previous_is_layer and token.isdigit():
+            layers[-1] += token
+        elif not _NUMBER_RE.fullmatch(token):
+            layers.append(token.upper())
+            is_layer = True
+        previous_is_layer = is_layer
+
+    if check is None or value is None:
+        return {'type': 'text', 'text': line}
+
+    return {
+        'type': 'constraint',
+        'check': check,
+        'layers': layers,
+        'operator': operator or '>=',
+        'value': value,
+        'unit': _CHECK_UNITS.get(check, 'um'),
+    }
+
+
+def compile_rule_text(normalized_text: str) -> Dict:
+    """將正規化後的 rule 文字編譯成結構化形式"""
+    rules = [_parse_rule_line(line) for line in normalized_text.split('\n') if line]
+    return {
+        'version': COMPILER_VERSION,
+        'hash': rule_hash(normalized_text),
+        'normalized_text': normalized_text,
+        'rules': rules,
+        'layers': sorted({layer for r in rules for layer in r.get('layers', [])}),
+    }
+
+
+def get_compiled_rules(rule_text: str, redis_client=None) -> Dict:
+    """
+    取得 rule_text 的 compiled 形式，優先使用 Redis 快取
+
+    Redis 無法連線時直接在本地編譯，不影響任務流程。
+    回傳的 compiled 結果附上原始的 rule_text (不存入快取，正規化後相同的 rule deck 共用同一筆快取)。
+    """
+    normalized = normalize_rule_text(rule_text)
+    key = f"{RULE_CACHE_CONFIG['key_prefix']}:{rule_hash(normalized)}"
+    stats_key = f"{RULE_CACHE_CONFIG['key_prefix']}:stats"
+
+    if redis_client is not None:
+        try:
+            cached = redis_client.get(key)
+            if cached is not None:
+                redis_client.hincrby(stats_key, 'hits', 1)
+                return {**json.loads(cached), 'rule_text': rule_text}
+        except Exception as e:
+            print(f"讀取 rule 快取失敗，改為直接編譯: {e}")
+            redis_client = None
+
+    start = time.perf_counter()
+    compiled = compile_rule_text(normalized)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"Rule 編譯完成 ({len(compiled['rules'])} 條, {elapsed_ms:.2f} ms)")
+
+    if redis_client is not None:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.set(key, json.dumps(compiled, ensure_ascii=False), ex=RULE_CACHE_CONFIG['ttl'])
+            pipe.hincrby(stats_key, 'misses', 1)
+            pipe.hincrbyfloat(stats_key, 'compile_ms_total', elapsed_ms)
+            pipe.execute()
+        except Exception as e:
+            print(f"寫入 rule 快取失敗: {e}")
+
+    return {**compiled, 'rule_text': rule_text}
+
+
+async def get_rule_cache_stats(redis_client) -> Dict:
+    """讀取快取統計 (命中率與平均編譯耗時；非同步，供 /metrics 使用)"""
+    raw = await redis_client.hgetall(f"{RULE_CACHE_CONFIG['key_prefix']}:stats") or {}
+    stats = {(k.decode() if isinstance(k, bytes) else k): float(v) for k, v in raw.items()}
+    hits = int(stats.get('hits', 0))
+    misses = int(stats.get('misses', 0))
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+        'compile_ms_total': stats.get('compile_ms_total', 0.0),
+        'avg_compile_ms': stats.get('compile_ms_total', 0.0) / misses if misses else 0.0,
+    }
@@ -0,0 +1,177 @@
+"""
+任務優先權與公平排程
+
+任務分成兩條 lane (各自是一個 Celery queue)：
+  - interactive: 單次、小量的互動式 DRC 檢查，應該盡快開始
+  - bulk: 大量批次 (例如一次送出數百個 layout 的 sweep)
+
+submit_task 依每個 client 的 token bucket 決定 lane：interactive 的額度用完時
+自動降級到 bulk；bulk 的額度也用完時回傳 429，請 client 稍後重送，避免單一使用者
+塞滿整個佇列。token bucket 以 Redis Lua script 實作，多個 uvicorn worker 共用同一份狀態。
+
+每條 lane 的佇列深度、最舊訊息的等待時間，以及任務實際開始前的等待時間
+(由 worker 在 task_prerun 時回報) 可透過 get_lane_stats 查詢。
+"""
+
+import os
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+INTERACTIVE_LANE = 'interactive'
+BULK_LANE = 'bulk'
+LANES = (INTERACTIVE_LANE, BULK_LANE)
+
+SCHEDULING_CONFIG = {
+    # 檔案數超過此值的提交預設視為 bulk
+    'interactive_max_files': int(os.getenv('INTERACTIVE_MAX_FILES', '5')),
+    # 每個 client 的 token bucket：容量 (可瞬間送出的任務數) 與每秒補充速率
+    'interactive_capacity': float(os.getenv('INTERACTIVE_BUCKET_CAPACITY', '5')),
+    'interactive_refill_per_sec': float(os.getenv('INTERACTIVE_BUCKET_REFILL', '0.2')),
+    'bulk_capacity': float(os.getenv('BULK_BUCKET_CAPACITY', '50')),
+    'bulk_refill_per_sec': float(os.getenv('BULK_BUCKET_REFILL', '0.5')),
+    # 每條 lane 保留最近多少筆等待時間用於計算百分位數
+    'wait_samples': int(os.getenv('LANE_WAIT_SAMPLES', '1000')),
+    'key_prefix': os.getenv('SCHEDULING_KEY_PREFIX', 'drc:sched'),
+}
+
+# Redis transport 的 priority 子佇列以此分隔字元接在 queue 名稱之後
+_PRIORITY_SEP = '\x06\x16'
+_PRIORITY_STEPS = (3, 6, 9)
+
+# KEYS[1]=bucket key；ARGV = capacity, refill_per_sec, now, cost (cost 為負數時退還 token)
+# 回傳 {是否取得 token, 還需等待的秒數 (字串)}
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+    allowed = 1
+elseif rate > 0 then
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / math.max(rate, 0.001)) + 60)
+return {allowed, tostring(wait)}
+"""
+
+
+class RateLimited(Exception):
+    """client 的 bulk 額度已用完"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+async def _take_token(redis_client, client_id: str, lane: str, cost: int = 1) -> Tuple[bool, float]:
+    key = f"{SCHEDULING_CONFIG['key_prefix']}:bucket:{lane}:{client_id}"
+    allowed, wait = await redis_client.eval(
+        _TOKEN_BUCKET_LUA, 1, key,
+        SCHEDULING_CONFIG[f'{lane}_capacity'],
+        SCHEDULING_CONFIG[f'{lane}_refill_per_sec'],
+        time.time(), cost
+    )
+    return bool(int(allowed)), float(wait)
+
+
+async def choose_lane(redis_client, client_id: str, file_count: int, requested_lane: Optional[str] = None) -> str:
+    """
+    決定任務要進入的 lane，並扣除對應的 token
+
+    interactive 額度不足時降級為 bulk；bulk 額度也不足時拋出 RateLimited。
+    """
+    lane = requested_lane if requested_lane in LANES else None
+    if lane is None:
+        lane = INTERACTIVE_LANE if file_count <= SCHEDULING_CONFIG['interactive_max_files'] else BULK_LANE
+
+    if lane == INTERACTIVE_LANE:
+        allowed, _ = await _take_token(redis_client, client_id, INTERACTIVE_LANE)
+        if allowed:
+            return INTERACTIVE_LANE
+        print(f"Client {client_id} 的 interactive 額度已用完，降級為 bulk")
+
+    allowed, wait = await _take_token(redis_client, client_id, BULK_LANE)
+    if not allowed:
+        raise RateLimited(wait)
+    return BULK_LANE
+
+
+async def refund_token(redis_client, client_id: str, lane: str):
+    """退還 choose_lane 扣除的 token (任務最後沒有送出時使用，例如上傳檔案被拒絕)"""
+    try:
+        await _take_token(redis_client, client_id, lane, cost=-1)
+    except Exception as e:
+        print(f"退還 client {client_id} 的 {lane} token 失敗: {e}")
+
+
+def task_headers(lane: str) -> Dict:
+    """送出任務時附加的 header，worker 端據此計算排隊時間"""
+    return {'lane': lane, 'enqueued_at': time.time()}
+
+
+def record_queue_wait(redis_client, lane: str, wait_seconds: float):
+    """由 worker 在任務開始時呼叫 (同步 Redis client)，記錄該任務的排隊時間"""
+    key = f"{SCHEDULING_CONFIG['key_prefix']}:wait:{lane}"
+    pipe = redis_client.pipeline()
+    pipe.lpush(key, f"{wait_seconds:.3f}")
+    pipe.ltrim(key, 0, SCHEDULING_CONFIG['wait_samples'] - 1)
+    pipe.hincrby(f"{SCHEDULING_CONFIG['key_prefix']}:started", lane, 1)
+    pipe.execute()
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _queue_keys(lane: str) -> List[str]:
+    return [lane] + [f"{lane}{_PRIORITY_SEP}{step}" for step in _PRIORITY_STEPS]
+
+
+async def _oldest_message_age(redis_client, lane: str, now: float) -> float:
+    """Redis transport 以 LPUSH 放入、BRPOP 取出，最舊的訊息在 list 的最右端"""
+    oldest = 0.0
+    for key in _queue_keys(lane):
+        raw = await redis_client.lindex(key, -1)
+        if not raw:
+            continue
+        try:
+            enqueued_at = json.loads(raw).get('headers', {}).get('enqueued_at')
+        except (ValueError, AttributeError):
+            continue
+        if enqueued_at:
+            oldest = max(oldest, now - float(enqueued_at))
+    return oldest
+
+
+async def get_lane_stats(redis_client) -> Dict:
+    """每條 lane 的佇列深度、最舊訊息等待時間與近期排隊時間百分位數"""
+    now = time.time()
+    started = await redis_client.hgetall(f"{SCHEDULING_CONFIG['key_prefix']}:started") or {}
+    stats = {}
+    for lane in LANES:
+        depth = 0
+        for key in _queue_keys(lane):
+            depth += await redis_client.llen(key)
+        samples = [float(v) for v in await redis_client.lrange(
+            f"{SCHEDULING_CONFIG['key_prefix']}:wait:{lane}", 0, -1)]
+        stats[lane] = {
+            'depth': depth,
+            'oldest_age_seconds': round(await _oldest_message_age(redis_client, lane, now), 3),
+            'started_total': int(started.get(lane, 0)),
+            'wait_p50_seconds': round(_percentile(samples, 50), 3),
+            'wait_p95_seconds': round(_percentile(samples, 95), 3),
+            'wait_samples': len(samples),
+        }
+    return stats
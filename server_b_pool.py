@@ -0,0 +1,274 @@
+"""
+Server B 後端池
+
+API_SERVER_B_URLS 設定多台 Server B (以逗號分隔) 時，worker 依各台的負載分派工作：
+  - 上傳時選擇負載最低的一台：負載為 /health 回報的 active_tasks (+ queued_tasks)，
+    加上這個行程在下一次健康檢查前已經分派過去的工作數；/health 結果快取 SERVER_B_HEALTH_TTL 秒
+  - 斷路器：連續 SERVER_B_BREAKER_FAILURES 次連線錯誤或 5xx 後暫停使用該台
+    SERVER_B_BREAKER_OPEN_SECONDS 秒，時間到後先以 /health 探測，成功才恢復
+  - 工作與後端的對應 (affinity) 記在 Redis (drc:serverb:job:{job_id})，狀態查詢、下載與取消
+    一律送到當初接收上傳的那台，web 與其他 worker 也查得到
+  - SERVER_B_HEDGE_MS > 0 時，狀態查詢與下載在這麼久還沒有回應時對同一台再送一次請求，
+    先回應的勝出 (長輪詢與 SSE 本來就會等待，不做 hedge)
+
+只設定 API_SERVER_B_URL 時池中只有一台，行為與原本相同 (不做健康檢查)。
+"""
+
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+import requests
+
+SERVER_B_POOL_CONFIG = {
+    'health_ttl': float(os.getenv('SERVER_B_HEALTH_TTL', '2')),
+    'health_timeout': float(os.getenv('SERVER_B_HEALTH_TIMEOUT', '2')),
+    'breaker_failures': int(os.getenv('SERVER_B_BREAKER_FAILURES', '3')),
+    'breaker_open_seconds': float(os.getenv('SERVER_B_BREAKER_OPEN_SECONDS', '30')),
+    # 對應需保留到結果下載完成 (以及 Server B 清理任務) 為止
+    'affinity_ttl': int(os.getenv('SERVER_B_AFFINITY_TTL', str(2 * 24 * 3600))),
+    # 0 代表不做 hedged request
+    'hedge_ms': float(os.getenv('SERVER_B_HEDGE_MS', '0')),
+    'key_prefix': os.getenv('SERVER_B_POOL_KEY_PREFIX', 'drc:serverb'),
+}
+
+
+class ServerBUnavailable(Exception):
+    """池中沒有可以使用的 Server B"""
+
+
+def parse_urls(value: str) -> List[str]:
+    return [url.strip().rstrip('/') for url in value.split(',') if url.strip()]
+
+
+def _key(name: str) -> str:
+    return f"{SERVER_B_POOL_CONFIG['key_prefix']}:{name}"
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class Backend:
+    """單一 Server B 的負載與斷路器狀態 (由 ServerBPool 的鎖保護)"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.active_tasks = 0
+        # 上次健康檢查後由這個行程分派過去的工作數
+        self.assigned = 0
+        self.checked_at = float('-inf')
+        self.healthy = True
+        self.failures = 0
+        self.open_until = 0.0
+
+    def load(self) -> int:
+        return self.active_tasks + self.assigned
+
+
+class ServerBPool:
+    """
+    以行程為單位的 Server B 後端池 (Celery prefork 子行程各自持有一份負載與斷路器狀態)
+
+    redis_getter 回傳同步 Redis client，用來共享工作與後端的對應與統計；
+    Redis 無法使用時對應只保留在行程內。
+    """
+
+    def __init__(self, urls: Iterable[str], redis_getter: Callable):
+        self.backends: Dict[str, Backend] = {url: Backend(url) for url in urls}
+        if not self.backends:
+            raise ValueError("Server B pool needs at least one URL")
+        self.default_url = next(iter(self.backends))
+        self._redis_getter = redis_getter
+        self._lock = threading.Lock()
+        self._affinity: OrderedDict = OrderedDict()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid = None
+
+    # --- 健康檢查與選擇 ---
+
+    def _pool_executor(self) -> ThreadPoolExecutor:
+        # fork 後的子行程不能沿用父行程的執行緒
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.backends)),
+                                                thread_name_prefix="server-b-pool")
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _probe(self, backend: Backend):
+        try:
+            response = requests.get(f"{backend.url}/health", timeout=SERVER_B_POOL_CONFIG['health_timeout'])
+            response.raise_for_status()
+            health = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Server B 健康檢查失敗 ({backend.url}): {e}")
+            self.record_failure(backend.url)
+            with self._lock:
+                backend.checked_at = time.monotonic()
+            return
+        with self._lock:
+            backend.active_tasks = int(health.get('active_tasks', 0)) + int(health.get('queued_tasks', 0))
+            backend.assigned = 0
+            backend.checked_at = time.monotonic()
+            backend.healthy = True
+            backend.failures = 0
+            backend.open_until = 0.0
+
+    def _refresh(self, backends: List[Backend]):
+        if len(backends) == 1:
+            self._probe(backends[0])
+        elif backends:
+            list(self._pool_executor().map(self._probe, backends))
+
+    def choose(self, exclude: Iterable[str] = ()) -> str:
+        """選出負載最低且斷路器未打開的 Server B，並計入一筆分派"""
+        exclude = set(exclude)
+        candidates = [b for url, b in self.backends.items() if url not in exclude]
+        if not candidates:
+            raise ServerBUnavailable("所有 Server B 都已嘗試過")
+        if len(self.backends) == 1:
+            return candidates[0].url
+
+        now = time.monotonic()
+        with self._lock:
+            stale = [b for b in candidates
+                     if now - b.checked_at >= SERVER_B_POOL_CONFIG['health_ttl'] and b.open_until <= now]
+        self._refresh(stale)
+
+        now = time.monotonic()
+        with self._lock:
+            available = [b for b in candidates if b.healthy and b.open_until <= now]
+            if not available:
+                # 全部都不可用時不直接失敗：選斷路器最早到期的一台，讓實際請求充當探測
+                available = [min(candidates, key=lambda b: b.open_until)]
+            best = min(available, key=lambda b: (b.load(), random.random()))
+            best.assigned += 1
+        self._incr_stat(f"routed:{best.url}")
+        return best.url
+
+    # --- 斷路器 ---
+
+    def record_success(self, url: str):
+        backend = self.backends.get(url)
+        if backend is None:
+            return
+        with self._lock:
+            backend.failures = 0
+            backend.healthy = True
+            backend.open_until = 0.0
+
+    def record_failure(self, url: str):
+        backend = self.backends.get(url)
+        if backend is None:
+            return
+        with self._lock:
+            backend.failures += 1
+            opened = (backend.failures >= SERVER_B_POOL_CONFIG['breaker_failures']
+                      and backend.open_until <= time.monotonic())
+            if opened:
+                backend.healthy = False
+                backend.open_until = time.monotonic() + SERVER_B_POOL_CONFIG['breaker_open_seconds']
+        self._incr_stat(f"failures:{url}")
+        if opened:
+            print(f"Server B {url} 連續失敗 {backend.failures} 次，"
+                  f"暫停使用 {SERVER_B_POOL_CONFIG['breaker_open_seconds']:.0f} 秒")
+            self._incr_stat(f"breaker_opened:{url}")
+
+    def observe(self, url: str, response: Optional[requests.Response] = None, error: Optional[Exception] = None):
+        """依請求結果更新斷路器：連線錯誤、逾時與 5xx 算失敗，其他回應算成功"""
+        if error is not None or (response is not None and response.status_code >= 500):
+            self.record_failure(url)
+        else:
+            self.record_success(url)
+
+    # --- affinity ---
+
+    def assign(self, job_id: str, url: str):
+        """記錄 job 由哪一台 Server B 處理"""
+        with self._lock:
+            self._affinity[job_id] = url
+            self._affinity.move_to_end(job_id)
+            while len(self._affinity) > 10000:
+                self._affinity.popitem(last=False)
+        if len(self.backends) == 1:
+            return
+        try:
+            self._redis_getter().set(_key(f"job:{job_id}"), url, ex=SERVER_B_POOL_CONFIG['affinity_ttl'])
+        except Exception as e:
+            print(f"記錄 Server B 對應失敗: {e}")
+
+    def url_for(self, job_id: str) -> str:
+        """job 所在的 Server B；沒有紀錄時 (例如池啟用前送出的工作) 使用第一台"""
+        if len(self.backends) == 1:
+            return self.default_url
+        with self._lock:
+            url = self._affinity.get(job_id)
+        if url:
+            return url
+        try:
+            url = self._redis_getter().get(_key(f"job:{job_id}"))
+        except Exception as e:
+            print(f"讀取 Server B 對應失敗: {e}")
+            url = None
+        return _decode(url) if url else self.default_url
+
+    # --- hedged request ---
+
+    def hedged_get(self, url: str, **kwargs) -> requests.Response:
+        """
+        GET，超過 SERVER_B_HEDGE_MS 還沒有回應時再送一次，回傳先完成的回應
+
+        stream=True 時以收到 header 為準，落敗的回應會被關閉。
+        """
+        delay = SERVER_B_POOL_CONFIG['hedge_ms'] / 1000
+        if delay <= 0:
+            return requests.get(url, **kwargs)
+
+        executor = self._pool_executor()
+        futures = [executor.submit(requests.get, url, **kwargs)]
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            futures.append(executor.submit(requests.get, url, **kwargs))
+            self._incr_stat("hedged")
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    winner = future
+                    break
+                error = future.exception()
+            else:
+                continue
+            for other in futures:
+                if other is not winner:
+                    other.add_done_callback(_close_response)
+            if winner is not futures[0]:
+                self._incr_stat("hedge_wins")
+            return winner.result()
+        raise error
+
+    # --- 統計 ---
+
+    def _incr_stat(self, field: str):
+        try:
+            self._redis_getter().hincrby(_key('stats'), field, 1)
+        except Exception:
+            pass
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
+async def get_pool_stats(redis_client) -> Dict[str, int]:
+    """分派、失敗、斷路器與 hedged request 的累計統計 (非同步，供 /metrics 使用)"""
+    stats = await redis_client.hgetall(_key('stats')) or {}
+    return {_decode(k): int(v) for k, v in stats.items()}
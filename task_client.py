@@ -0,0 +1,100 @@
+"""
+web 端送出與取消任務用的輕量 client
+
+main.py 只需要送出任務、revoke 與取消 Server B 上的工作，不需要 worker 的程式碼；
+import tasks 會一併載入模型服務、tiling、FTPS 與 Server B 上傳等模組，每個 uvicorn worker
+都要付出這些 import 的時間與記憶體。這裡改以任務名稱 send_task 送出，web 行程不 import tasks：
+  - 任務名稱 (TASK_NAMES) 必須與 tasks.py 中 @celery_app.task 的名稱 (模組.函式) 相同；
+    send_task 不知道任務的 ignore_result 設定，需明確傳入 (否則每次送出都會訂閱結果頻道)
+  - 大型參數與 OffloadingTask.apply_async 相同，先以 payload_store.offload_args 轉成 blob 參考
+  - Celery app 與 Server B 池在第一次使用時才建立，import main 時不載入 celery / kombu
+
+以 fork 啟動多個 web worker 時 (gunicorn_conf.py，preload_app)，master 行程先呼叫 preload()
+載入這些模組再 fork，各 worker 以 copy-on-write 共用同一份記憶體。preload() 不建立任何連線，
+連線都在 fork 後由各 worker 自己建立。
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+TASK_NAMES = {
+    'process': 'tasks.run_ai_processing_task',
+}
+
+TASK_CLIENT_CONFIG = {
+    # 與 tasks.py 的 API_SERVER_B 使用相同的環境變數
+    'server_b_urls': os.getenv('API_SERVER_B_URLS', ''),
+    'server_b_url': os.getenv('API_SERVER_B_URL', 'http://your-server-b-hostname:8001'),
+    'server_b_key': os.getenv('API_SERVER_B_KEY', 'your-api-key'),
+    'cancel_endpoint': os.getenv('API_SERVER_B_CANCEL', '/api/v1/cancel'),
+    'timeout': int(os.getenv('API_TIMEOUT', '30')),
+}
+
+_lock = threading.Lock()
+_celery_app = None
+_server_b_pool = None
+
+
+def get_celery_app():
+    """第一次呼叫時才 import celery_app (連帶載入 celery、kombu 與 broker transport)"""
+    global _celery_app
+    if _celery_app is None:
+        with _lock:
+            if _celery_app is None:
+                from celery_app import celery_app
+                _celery_app = celery_app
+    return _celery_app
+
+
+def _get_server_b_pool():
+    """只用來查詢工作被分派到哪台 Server B (affinity 記在 Redis)"""
+    global _server_b_pool
+    if _server_b_pool is None:
+        with _lock:
+            if _server_b_pool is None:
+                from redis_pool import get_redis
+                from server_b_pool import ServerBPool, parse_urls
+                urls = (parse_urls(TASK_CLIENT_CONFIG['server_b_urls'])
+                        or parse_urls(TASK_CLIENT_CONFIG['server_b_url']))
+                _server_b_pool = ServerBPool(urls, get_redis)
+    return _server_b_pool
+
+
+def preload():
+    """
+    在 fork 出 worker 之前的 master 行程呼叫：載入送出任務與取消會用到的模組，讓各 worker 共用
+
+    只建立物件、不建立連線 (Redis 與 broker 的連線池都在第一次使用時才連線)。
+    """
+    app = get_celery_app()
+    # 訊息格式化 (amqp) 與 producer 設定是 lazy property，先建立起來
+    app.amqp
+    import kombu.transport.redis  # noqa: F401
+    import payload_store  # noqa: F401
+    import requests  # noqa: F401  (取消 Server B 上的工作時使用)
+    _get_server_b_pool()
+
+
+def send_processing_task(task_id: str, kwargs: Dict, queue: str, headers: Optional[Dict] = None):
+    """以任務名稱送出 run_ai_processing_task，回傳 AsyncResult"""
+    from payload_store import offload_args
+    _, kwargs = offload_args((), kwargs)
+    # run_ai_processing_task 以 ignore_result=True 宣告，進度與結果走 Redis Pub/Sub
+    return get_celery_app().send_task(TASK_NAMES['process'], kwargs=kwargs, task_id=task_id,
+                                      queue=queue, headers=headers or {}, ignore_result=True)
+
+
+def revoke(task_id: str):
+    """讓還在佇列中的任務不會開始 (對所有 worker 的廣播)"""
+    get_celery_app().control.revoke(task_id)
+
+
+def cancel_server_b_task(task_id: str) -> bool:
+    """取消 Server B 上的工作，送到接收上傳的那台 (已結束或不存在時回傳 False)"""
+    from cancellation import cancel_on_server_b
+    from redis_pool import get_redis
+
+    return cancel_on_server_b(get_redis(), _get_server_b_pool().url_for(task_id), task_id,
+                              {'Authorization': f"Bearer {TASK_CLIENT_CONFIG['server_b_key']}"},
+                              TASK_CLIENT_CONFIG['cancel_endpoint'], TASK_CLIENT_CONFIG['timeout'])
@@ -1,21 +1,49 @@
+import gc
 import time
 import os
+import uuid
 import json
+import shutil
+import hashlib
 import zipfile
 from pathlib import Path
-import redis
+from urllib.parse import urlparse
 import requests
-from typing import Dict
+from typing import Dict, Optional, List
+from celery import chord, group
+from celery.exceptions import WorkerShutdown
+from celery.signals import worker_init, worker_process_init, task_prerun, task_postrun, task_revoked
 from dotenv import load_dotenv
 
 from celery_app import celery_app
+from tiling import should_tile, layout_bbox, partition_layout, merge_tile_results
+from rule_compiler import get_compiled_rules
+from model_server import init_worker_model, run_inference
+from scheduling import record_queue_wait
+from result_delivery import precompress_directory
+from result_store import task_dir, result_url, zip_name, manifest_name, register_task, sweep
+from payload_store import sweep_blobs, resolve_value
+from redis_pool import get_redis, BatchPublisher
+from progress import ProgressCoalescer
+from batch_files import batch_summary, write_file_index
+from json_codec import dumps
+from ftps_transfer import download_file as ftps_download_file
+from server_b_pool import SERVER_B_POOL_CONFIG, ServerBPool, parse_urls
+from compressed_io import iter_compressed, iter_file, multipart_stream, upload_encoding
+from cancellation import (TaskCancelled, checkpoint, is_cancelled, record_cancelled,
+                          cancel_on_server_b, untrack_task)
+from profiling import task_profile_requested, start_task_profile, finish_task_profile
+from tracing import (init_tracing, set_trace, trace_span, trace_headers, record_span,
+                     record_server_b_timings, get_trace, summarize_trace, TRACE_CONFIG)
 
 # Load environment variables
 load_dotenv()
 
 # --- [新增] Redis Publisher ---
-# 建立一個標準的 (同步) Redis 客戶端，專門用來發布訊息
-redis_client = redis.from_url("redis://localhost:6379")
+# 不在 import 時建立連線：Celery 會在 import 之後 fork 子行程，每個子行程透過 get_redis()
+# 建立自己的連線池。短時間內連續的進度訊息合併成一次 pipeline 發布。
+progress_publisher = BatchPublisher()
+init_tracing(get_redis)
 
 # --- API Configuration for Server B ---
 API_SERVER_B = {
@@ -23,77 +51,264 @@ API_SERVER_B = {
     'upload_endpoint': os.getenv('API_SERVER_B_UPLOAD', '/api/v1/upload'),
     'status_endpoint': os.getenv('API_SERVER_B_STATUS', '/api/v1/status'),
     'download_endpoint': os.getenv('API_SERVER_B_DOWNLOAD', '/api/v1/download'),
+    'cancel_endpoint': os.getenv('API_SERVER_B_CANCEL', '/api/v1/cancel'),
     'api_key': os.getenv('API_SERVER_B_KEY', 'your-api-key'),
-    'timeout': int(os.getenv('API_TIMEOUT', '30'))
+    'timeout': int(os.getenv('API_TIMEOUT', '30')),
+    'poll_interval': float(os.getenv('API_POLL_INTERVAL', '10')),
+    'poll_max_wait': float(os.getenv('API_POLL_MAX_WAIT', '300')),
+    # 等待 Server B 完成的方式：poll (每 poll_interval 秒查詢一次)、longpoll (?wait= 長輪詢)
+    # 或 sse (訂閱狀態事件串流)；後兩者在任務完成的瞬間就會收到回應
+    'status_mode': os.getenv('API_SERVER_B_STATUS_MODE', 'longpoll'),
+    'long_poll_wait': float(os.getenv('API_LONG_POLL_WAIT', '30')),
+    # 結果 ZIP 的傳輸方式：http (Server B 的 download API) 或 ftps (ftps_transfer 的連線池與平行下載)
+    'transfer_backend': os.getenv('TRANSFER_BACKEND', 'http'),
+    # 上傳前先只送檔案的 SHA-256，Server B 已有相同內容時不再傳送檔案
+    'upload_dedupe': os.getenv('API_SERVER_B_UPLOAD_DEDUPE', 'true').lower() == 'true',
+    # 上傳檔案時的壓縮格式 (gzip、zstd 或 none)，Server B 收到後邊解壓縮邊寫入
+    'upload_encoding': os.getenv('API_SERVER_B_UPLOAD_ENCODING', 'gzip'),
+    'upload_level': int(os.getenv('API_SERVER_B_UPLOAD_LEVEL', '6'))
 }
 
+# API_SERVER_B_URLS 設定多台 Server B 時依負載分派；只有 API_SERVER_B_URL 時池中只有一台
+server_b_pool = ServerBPool(parse_urls(os.getenv('API_SERVER_B_URLS', '')) or parse_urls(API_SERVER_B['base_url']),
+                            get_redis)
+
+@worker_init.connect
+def freeze_preloaded_objects(**kwargs):
+    """
+    worker 主行程 fork 出 prefork 子行程之前：已載入的模組與物件移到 GC 的永久世代
+
+    子行程以 copy-on-write 共用這些記憶體；GC 掃描時會寫入物件的 header，讓共用的分頁
+    被複製成每個子行程各自一份。freeze 後子行程的 GC 不再掃描它們。
+    """
+    gc.freeze()
+    print(f"已凍結 {gc.get_freeze_count()} 個預先載入的物件，prefork 子行程以 copy-on-write 共用")
+
+@worker_init.connect
+def check_transfer_backend(**kwargs):
+    """
+    TRANSFER_BACKEND=ftps 時確認 Server B 以 file 模式打包結果
+
+    stream 模式的 Server B 不會寫出 ZIP 檔，FTPS 下載必定失敗；啟動時就停止 worker，
+    而不是每個任務都在下載階段失敗。Server B 暫時連不上時只記錄警告。
+    """
+    if API_SERVER_B['transfer_backend'] != 'ftps':
+        return
+    if os.getenv('SERVER_B_PACKAGING_MODE', '').lower() == 'stream':
+        raise WorkerShutdown("TRANSFER_BACKEND=ftps 需要 SERVER_B_PACKAGING_MODE=file")
+    for url in server_b_pool.backends:
+        try:
+            response = requests.get(f"{url}/health", timeout=SERVER_B_POOL_CONFIG['health_timeout'])
+            response.raise_for_status()
+            mode = response.json().get('packaging_mode')
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"無法確認 Server B ({url}) 的打包模式: {e}")
+            continue
+        if mode == 'stream':
+            raise WorkerShutdown(f"TRANSFER_BACKEND=ftps 需要 Server B 以 SERVER_B_PACKAGING_MODE=file 打包 ({url} 為 stream)")
+
+@worker_process_init.connect
+def load_model_on_worker_start(**kwargs):
+    """每個 prefork 子行程啟動時載入一次模型，任務執行時不再承擔載入成本"""
+    init_worker_model()
+
+@task_prerun.connect
+def record_lane_wait_time(task=None, **kwargs):
+    """任務開始時設定 trace id、視需要開始 profiling，並記錄它在 lane 中排隊等待的時間"""
+    set_trace(task.request.id)
+    if task_profile_requested(task.request, get_redis()):
+        start_task_profile(task.request.id)
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    lane = getattr(task.request, 'lane', None)
+    if not enqueued_at or not lane:
+        return
+    wait = max(0.0, time.time() - float(enqueued_at))
+    record_span('queue_wait', float(enqueued_at), wait, lane=lane)
+    try:
+        record_queue_wait(get_redis(), lane, wait)
+    except Exception as e:
+        print(f"記錄排隊時間失敗: {e}")
+
+@task_revoked.connect
+def report_revoked_task(sender=None, request=None, **kwargs):
+    """
+    還在佇列中就被取消 (revoke) 的主任務不會執行，由這裡刪除上傳檔、通知前端並記錄
+
+    request 是任務的 Context (任務名稱在 request.task，沒有 task_name)，以 sender 判斷是哪個任務；
+    kwargs 中的大型參數可能已 offload 成 blob 參考，使用前先還原。
+    """
+    if getattr(sender, 'name', None) != run_ai_processing_task.name:
+        return
+    task_kwargs = getattr(request, 'kwargs', None) or {}
+    client_id = resolve_value(task_kwargs.get('client_id'))
+    file_paths = resolve_value(task_kwargs.get('file_paths')) or []
+    untrack_task(get_redis(), client_id, request.id)
+    handle_cancelled_task(client_id, request.id, file_paths, 'queued')
+    progress_coalescer.flush()
+    progress_publisher.flush()
+
+@task_postrun.connect
+def write_task_profile(task_id=None, **kwargs):
+    """任務結束時送出還在合併或批次中的進度訊息，並停止取樣、輸出 profile (沒有啟用 profiling 的任務不做任何事)"""
+    progress_coalescer.flush()
+    progress_publisher.flush()
+    finish_task_profile(task_id)
+
+# Server B 上不會再改變的任務狀態
+SERVER_B_TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
 def get_api_headers() -> Dict[str, str]:
     """Get API headers with authentication"""
     return {
         'Authorization': f'Bearer {API_SERVER_B["api_key"]}',
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        **trace_headers()
     }
 
-def update_progress_via_redis(client_id: str, payload: dict):
-    """
-    [修改] 輔助函式，現在透過 Redis Pub/Sub 發送進度更新
-    """
+def _publish_progress(client_id: str, payload: dict, terminal: bool):
     message = {
         "client_id": client_id,
         "payload": payload
     }
-    # 將訊息發布到 'progress_updates' 頻道
-    redis_client.publish("progress_updates", json.dumps(message))
+    # 將訊息發布到 'progress_updates' 頻道；完成與錯誤訊息不等批次時間窗，立即送出
+    progress_publisher.publish("progress_updates", dumps(message), flush=terminal)
+
+# 同一任務的進度訊息在 PROGRESS_PUBLISH_INTERVAL_MS 內只發布最新一則，完成與錯誤訊息一律送出
+progress_coalescer = ProgressCoalescer(_publish_progress)
+
+def update_progress_via_redis(client_id: str, payload: dict, task_id: Optional[str] = None):
+    """
+    [修改] 輔助函式，現在透過 Redis Pub/Sub 發送進度更新
+
+    有 task_id 時附在訊息中，web 端與前端以它辨識同一任務的進度 (就地更新而非新增一則訊息)。
+    """
+    if task_id:
+        payload = {**payload, "task_id": task_id}
+    progress_coalescer.update(client_id, task_id or client_id, payload)
+
+def mock_ai_model(file_paths: list, compiled_rules: Dict, window: Optional[List[int]] = None,
+                  output_path: str = "AI_model_output.txt", task_id: Optional[str] = None,
+                  client_id: Optional[str] = None):
+    """
+    模擬 AI 模型處理過程
 
-def mock_ai_model(file_paths: list, rule_text: str):
-    """模擬 AI 模型處理過程"""
-    print(f"AI 模型開始處理... 檔案: {file_paths}, 規則: {rule_text}")
-    time.sleep(5) 
+    compiled_rules 為 rule_compiler 預先編譯好的 rule deck，模型不需再解析原始文字；
+    window 為 tile 的處理範圍，None 代表整個 layout；task_id/client_id 讓批次推論
+    能把結果對應回原本的任務。
+    """
+    print(f"AI 模型開始處理... 檔案: {file_paths}, 規則: {len(compiled_rules['rules'])} 條 "
+          f"({compiled_rules['hash'][:12]}), 範圍: {window or '全部'}")
     
-    # 創建實際的輸出檔案
-    output_path = "AI_model_output.txt"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(f"AI 處理結果\n")
-        f.write(f"輸入檔案: {file_paths}\n")
-        f.write(f"規則: {rule_text}\n")
-        f.write(f"處理時間: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    # 模型已在 worker 啟動時載入 (或由常駐推論行程持有)，這裡只做推論
+    start = time.perf_counter()
+    run_inference([{
+        'file_paths': file_paths,
+        'compiled_rules': compiled_rules,
+        'window': window,
+        'output_path': str(Path(output_path).resolve()),
+        'task_id': task_id,
+        'client_id': client_id
+    }])
     
-    print("AI 模型處理完成。")
+    print(f"AI 模型處理完成。({(time.perf_counter() - start) * 1000:.0f} ms)")
     return output_path
 
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _post_multipart(upload_url: str, headers: Dict, fields: Dict, filename: str, chunks) -> requests.Response:
+    """以 chunked 傳送 multipart 上傳，整個檔案不會載入記憶體"""
+    boundary = uuid.uuid4().hex
+    return requests.post(
+        upload_url,
+        data=multipart_stream(boundary, fields, 'file', filename, chunks),
+        headers={**headers, 'Content-Type': f'multipart/form-data; boundary={boundary}'},
+        timeout=API_SERVER_B['timeout']
+    )
+
+def post_upload(upload_url: str, model_output_path: str, task_id: str,
+                digest: Optional[str] = None) -> requests.Response:
+    """
+    送出上傳請求；有 digest 時先只送 SHA-256 (upload by hash)
+
+    Server B 已經有相同內容的 blob 時直接建立任務，不傳送檔案；回應 404 (沒有這個 blob)
+    或 422 (不支援 hash 上傳的舊版 Server B) 時再上傳完整檔案。完整檔案依 upload_encoding
+    邊讀邊壓縮後以 chunked 傳送；Server B 無法解壓縮這種格式 (415) 時改傳未壓縮的檔案。
+    """
+    data = {
+        'task_id': task_id,
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'filename': Path(model_output_path).name
+    }
+    headers = {
+        'Authorization': f'Bearer {API_SERVER_B["api_key"]}',
+        **trace_headers()
+    }
+    if digest:
+        data['sha256'] = digest
+        response = requests.post(upload_url, data=data, headers=headers, timeout=API_SERVER_B['timeout'])
+        if response.status_code not in (404, 422):
+            return response
+        response.close()
+    
+    filename = Path(model_output_path).name
+    encoding = upload_encoding(API_SERVER_B['upload_encoding'])
+    if encoding:
+        response = _post_multipart(upload_url, headers, {**data, 'encoding': encoding}, filename,
+                                   iter_compressed(model_output_path, encoding, API_SERVER_B['upload_level']))
+        if response.status_code != 415:
+            return response
+        print(f"Server B 不支援 {encoding} 壓縮的上傳，改傳未壓縮的檔案")
+        response.close()
+    
+    # 未壓縮的檔案同樣邊讀邊送
+    return _post_multipart(upload_url, headers, data, filename, iter_file(model_output_path))
+
 def upload_to_server_b(model_output_path: str, task_id: str) -> Dict:
-    """將結果透過 API 上傳到 Server B"""
+    """
+    將結果透過 API 上傳到負載最低的 Server B；連線失敗或 5xx 時改送池中的下一台
+
+    API_SERVER_B_UPLOAD_DEDUPE 開啟時先以 SHA-256 詢問，Server B 已有相同內容就不再傳送檔案。
+    """
+    tried = []
     try:
-        print(f"正在將 {model_output_path} 透過 API 上傳到 Server B...")
-        
-        upload_url = f"{API_SERVER_B['base_url']}{API_SERVER_B['upload_endpoint']}"
-        
-        # 準備上傳的檔案和資料
-        with open(model_output_path, 'rb') as file:
-            files = {
-                'file': (Path(model_output_path).name, file, 'application/octet-stream')
-            }
-            data = {
-                'task_id': task_id,
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            headers = {
-                'Authorization': f'Bearer {API_SERVER_B["api_key"]}'
-            }
+        digest = file_sha256(model_output_path) if API_SERVER_B['upload_dedupe'] else None
+        while True:
+            base_url = server_b_pool.choose(exclude=tried)
+            print(f"正在將 {model_output_path} 透過 API 上傳到 Server B ({base_url})...")
             
-            response = requests.post(
-                upload_url,
-                files=files,
-                data=data,
-                headers=headers,
-                timeout=API_SERVER_B['timeout']
-            )
+            upload_url = f"{base_url}{API_SERVER_B['upload_endpoint']}"
+            
+            try:
+                response = post_upload(upload_url, model_output_path, task_id, digest)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                server_b_pool.observe(base_url, error=e)
+                response, error = None, e
+            else:
+                server_b_pool.observe(base_url, response)
+                error = None
+            
+            if error is not None or response.status_code >= 500:
+                tried.append(base_url)
+                if len(tried) < len(server_b_pool.backends):
+                    print(f"Server B {base_url} 無法接收上傳，改送其他 Server B: {error or response.status_code}")
+                    continue
+                if error is not None:
+                    raise error
             
             response.raise_for_status()
             result = response.json()
+            # 之後的狀態查詢、下載與取消都送到同一台
+            server_b_pool.assign(task_id, base_url)
             
-        print(f"API 上傳完成。回應: {result}")
-        return result
+            if result.get('deduplicated'):
+                print(f"Server B 已有相同內容 ({digest[:12]})，未重新傳送檔案")
+            print(f"API 上傳完成。回應: {result}")
+            return result
         
     except requests.exceptions.RequestException as e:
         print(f"API 上傳失敗: {e}")
@@ -102,47 +317,144 @@ def upload_to_server_b(model_output_path: str, task_id: str) -> Dict:
         print(f"上傳過程發生錯誤: {e}")
         raise
 
-def wait_for_server_b_response(task_id: str) -> Dict:
-    """等待並下載 Server B 回傳批次結果"""
-    print(f"等待 Server B 回傳批次結果... (Task ID: {task_id})")
-    
-    # 確保 results 目錄存在
-    results_dir = Path("results")
-    results_dir.mkdir(exist_ok=True)
+def poll_task_status(task_id: str, deadline: float, long_poll: bool = False,
+                     cancel_id: Optional[str] = None) -> Dict:
+    """
+    查詢 Server B 的任務狀態直到完成或失敗
+
+    long_poll 時每次請求帶 ?wait=，由 Server B 保留請求直到狀態改變；否則每 poll_interval 秒查詢一次。
+    每次查詢之間確認 cancel_id 對應的任務是否已被取消。
+    """
+    base_url = server_b_pool.url_for(task_id)
+    status_url = f"{base_url}{API_SERVER_B['status_endpoint']}/{task_id}"
+    previous = None
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"等待 Server B 完成處理超時 ({API_SERVER_B['poll_max_wait']:.0f} 秒)")
+        checkpoint(get_redis(), cancel_id, 'server_b_wait')
+        attempt += 1
+        params, timeout = {}, API_SERVER_B['timeout']
+        if long_poll:
+            wait = min(API_SERVER_B['long_poll_wait'], remaining)
+            params['wait'] = f"{wait:.1f}"
+            timeout += wait
+        
+        started = time.monotonic()
+        # 長輪詢本來就會等待，只有一般查詢做 hedged request
+        get = requests.get if long_poll else server_b_pool.hedged_get
+        try:
+            response = get(status_url, headers=get_api_headers(), params=params, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            server_b_pool.observe(base_url, error=e)
+            raise
+        server_b_pool.observe(base_url, response)
+        response.raise_for_status()
+        status_data = response.json()
+        
+        status = status_data.get('status', 'unknown')
+        print(f"任務狀態: {status} (第 {attempt} 次查詢)")
+        if status in SERVER_B_TERMINAL_STATUSES:
+            return status_data
+        
+        # 狀態沒變卻立刻回應，代表 Server B 不支援 wait 參數，這一輪改為固定間隔
+        if not long_poll or (status == previous and time.monotonic() - started < 1):
+            time.sleep(max(0.0, min(API_SERVER_B['poll_interval'], deadline - time.monotonic())))
+        previous = status
+
+def watch_task_status(task_id: str, deadline: float, cancel_id: Optional[str] = None) -> Dict:
+    """
+    訂閱 Server B 的狀態事件串流 (SSE)，收到完成或失敗事件時回傳
+
+    連線中斷、讀取逾時或 5xx 時退避後重新訂閱，直到 deadline；Server B 不支援事件串流
+    (404/405/406/501，或回應不是 text/event-stream) 時改用長輪詢。
+    """
+    base_url = server_b_pool.url_for(task_id)
+    events_url = f"{base_url}{API_SERVER_B['status_endpoint']}/{task_id}/events"
+    headers = {**get_api_headers(), 'Accept': 'text/event-stream'}
+    retry = 0
+    while True:
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"等待 Server B 完成處理超時 ({API_SERVER_B['poll_max_wait']:.0f} 秒)")
+        checkpoint(get_redis(), cancel_id, 'server_b_wait')
+        try:
+            # Server B 會定期送出 keep-alive，讀取逾時只會發生在連線異常時
+            with requests.get(events_url, headers=headers, stream=True, timeout=API_SERVER_B['timeout']) as response:
+                server_b_pool.observe(base_url, response)
+                if (response.status_code in (404, 405, 406, 501)
+                        or response.ok and not response.headers.get('Content-Type', '').startswith('text/event-stream')):
+                    print(f"Server B 不支援狀態事件串流 (HTTP {response.status_code})，改用長輪詢")
+                    return poll_task_status(task_id, deadline, long_poll=True, cancel_id=cancel_id)
+                if response.status_code < 500:
+                    response.raise_for_status()
+                if response.ok:
+                    retry = 0
+                    for line in response.iter_lines(decode_unicode=True):
+                        if time.monotonic() >= deadline:
+                            raise TimeoutError(f"等待 Server B 完成處理超時 ({API_SERVER_B['poll_max_wait']:.0f} 秒)")
+                        # 每個事件與 keep-alive 之間確認任務是否已被取消
+                        checkpoint(get_redis(), cancel_id, 'server_b_wait')
+                        if not line or not line.startswith('data:'):
+                            continue
+                        status_data = json.loads(line[5:])
+                        if not status_data:
+                            raise Exception("Server B 上的任務已被刪除")
+                        status = status_data.get('status', 'unknown')
+                        print(f"任務狀態: {status}")
+                        if status in SERVER_B_TERMINAL_STATUSES:
+                            return status_data
+                    print("狀態事件串流中斷，重新連線...")
+                    continue
+                error = f"HTTP {response.status_code}"
+        except requests.exceptions.HTTPError:
+            # 4xx (例如 API key 錯誤) 重試也不會成功
+            raise
+        except requests.exceptions.RequestException as e:
+            server_b_pool.observe(base_url, error=e)
+            error = e
+        delay = min(2 ** retry * 0.5, 10, max(0.0, deadline - time.monotonic()))
+        retry += 1
+        print(f"狀態事件串流連線失敗 ({error})，{delay:.1f} 秒後重新連線...")
+        time.sleep(delay)
+
+def wait_for_server_b_response(task_id: str, cancel_id: Optional[str] = None) -> Dict:
+    """
+    等待並下載 Server B 回傳批次結果
+
+    cancel_id 為要檢查取消旗標的任務 (tile 的工作檢查原任務)；取消時一併取消 Server B 上的工作。
+    """
+    mode = API_SERVER_B['status_mode']
+    print(f"等待 Server B 回傳批次結果... (Task ID: {task_id}, 模式: {mode})")
     
-    max_retries = 30  # 最多等待30次 (每次10秒)
-    retry_interval = 10  # 每10秒檢查一次
+    # 預設最多等待 300 秒
+    deadline = time.monotonic() + API_SERVER_B['poll_max_wait']
     
     try:
-        for attempt in range(max_retries):
-            print(f"檢查 Server B 結果... (嘗試 {attempt + 1}/{max_retries})")
-            
-            # 檢查任務狀態
-            status_url = f"{API_SERVER_B['base_url']}{API_SERVER_B['status_endpoint']}/{task_id}"
-            headers = get_api_headers()
-            
-            response = requests.get(status_url, headers=headers, timeout=API_SERVER_B['timeout'])
-            response.raise_for_status()
-            status_data = response.json()
-            
-            print(f"任務狀態: {status_data.get('status', 'unknown')}")
-            
-            # 如果任務完成，下載結果
-            if status_data.get('status') == 'completed':
-                print("任務完成，開始下載結果...")
-                return download_results_from_server_b(task_id, status_data)
-            
-            # 如果任務失敗
-            elif status_data.get('status') == 'failed':
-                error_msg = status_data.get('error', '未知錯誤')
-                raise Exception(f"Server B 處理失敗: {error_msg}")
-            
-            # 如果還在處理中，等待後重試
-            time.sleep(retry_interval)
+        if mode == 'sse':
+            status_data = watch_task_status(task_id, deadline, cancel_id)
+        else:
+            status_data = poll_task_status(task_id, deadline, long_poll=(mode == 'longpoll'), cancel_id=cancel_id)
+        
+        if status_data.get('status') == 'cancelled':
+            checkpoint(get_redis(), cancel_id, 'server_b_wait')
+            raise Exception("Server B 上的工作已被取消")
+        
+        # 如果任務失敗
+        if status_data.get('status') == 'failed':
+            error_msg = status_data.get('error', '未知錯誤')
+            raise Exception(f"Server B 處理失敗: {error_msg}")
         
-        # 如果超過重試次數仍未完成
-        raise TimeoutError(f"等待 Server B 完成處理超時 ({max_retries * retry_interval} 秒)")
+        # 任務完成，下載結果
+        print("任務完成，開始下載結果...")
+        record_server_b_timings(status_data.get('timings', {}), time.time())
+        checkpoint(get_redis(), cancel_id, 'download')
+        return download_results_from_server_b(task_id, status_data)
         
+    except TaskCancelled:
+        cancel_on_server_b(get_redis(), server_b_pool.url_for(task_id), task_id, get_api_headers(),
+                           API_SERVER_B['cancel_endpoint'], API_SERVER_B['timeout'])
+        raise
     except requests.exceptions.RequestException as e:
         print(f"API 請求失敗: {e}")
         raise
@@ -153,21 +465,36 @@ def wait_for_server_b_response(task_id: str) -> Dict:
 def download_results_from_server_b(task_id: str, status_data: Dict) -> Dict:
     """從 Server B 下載處理結果"""
     try:
-        download_url = f"{API_SERVER_B['base_url']}{API_SERVER_B['download_endpoint']}/{task_id}"
+        base_url = server_b_pool.url_for(task_id)
+        download_url = f"{base_url}{API_SERVER_B['download_endpoint']}/{task_id}"
         headers = get_api_headers()
         
-        # 下載 ZIP 檔案
-        response = requests.get(download_url, headers=headers, timeout=API_SERVER_B['timeout'], stream=True)
-        response.raise_for_status()
-        
-        # 儲存下載的檔案
-        results_dir = Path("results")
-        zip_file_name = f"{task_id}_results.zip"
+        # 儲存下載的檔案 (任務的所有結果都放在同一個分層目錄中)
+        results_dir = task_dir(task_id, create=True)
+        zip_file_name = zip_name(task_id)
         zip_path = results_dir / zip_file_name
         
-        with open(zip_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        # 下載 ZIP 檔案
+        with trace_span('download', backend=API_SERVER_B['transfer_backend']):
+            if API_SERVER_B['transfer_backend'] == 'ftps':
+                # Server B 以 file 模式寫出的 ZIP，透過 FTPS 下載 (大檔切 range 平行下載，中斷時續傳)；
+                # 連到接收此任務的那台 Server B
+                ftps_download_file(status_data.get('zip_file') or zip_file_name, zip_path,
+                                   host=urlparse(base_url).hostname)
+            else:
+                try:
+                    response = server_b_pool.hedged_get(download_url, headers=headers,
+                                                        timeout=API_SERVER_B['timeout'], stream=True)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    server_b_pool.observe(base_url, error=e)
+                    raise
+                server_b_pool.observe(base_url, response)
+                
+                with response:
+                    response.raise_for_status()
+                    with open(zip_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=8192):
+                            f.write(chunk)
         
         print(f"已從 Server B 下載結果檔案: {zip_file_name}")
         
@@ -175,14 +502,16 @@ def download_results_from_server_b(task_id: str, status_data: Dict) -> Dict:
         if 'manifest' in status_data:
             manifest_data = status_data['manifest']
             # 創建臨時 manifest 檔案
-            manifest_path = results_dir / f"{task_id}_manifest.json"
+            manifest_path = results_dir / manifest_name(task_id)
             with open(manifest_path, 'w', encoding='utf-8') as f:
                 json.dump(manifest_data, f, ensure_ascii=False, indent=2)
             
-            return extract_and_process_batch_results(task_id, zip_path, manifest_path)
+            with trace_span('extract'):
+                return extract_and_process_batch_results(task_id, zip_path, manifest_path)
         else:
             # 否則解壓縮後自動偵測檔案
-            return extract_and_process_batch_results_auto(task_id, zip_path)
+            with trace_span('extract'):
+                return extract_and_process_batch_results_auto(task_id, zip_path)
             
     except requests.exceptions.RequestException as e:
         print(f"下載結果失敗: {e}")
@@ -195,20 +524,19 @@ def extract_and_process_batch_results_auto(task_id: str, zip_path: Path) -> Dict
     """自動偵測並處理批次結果檔案"""
     try:
         # 建立任務專用目錄
-        task_results_dir = Path("results") / task_id
-        task_results_dir.mkdir(exist_ok=True)
+        task_results_dir = task_dir(task_id, create=True)
         
         # 解壓縮 ZIP 檔案到任務目錄
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             zip_ref.extractall(task_results_dir)
         
-        # 自動偵測檔案類型
+        # 自動偵測檔案類型 (略過 ZIP 本身)
         extracted_files = []
         png_files = []
         gds_files = []
         
         for file_path in task_results_dir.iterdir():
-            if file_path.is_file():
+            if file_path.is_file() and file_path != zip_path:
                 filename = file_path.name
                 file_type = filename.split('.')[-1].lower() if '.' in filename else 'unknown'
                 
@@ -216,7 +544,7 @@ def extract_and_process_batch_results_auto(task_id: str, zip_path: Path) -> Dict
                     'filename': filename,
                     'type': file_type,
                     'description': f'{file_type.upper()} 檔案',
-                    'url': f"/results/{task_id}/{filename}"
+                    'url': result_url(task_id, filename)
                 })
                 
                 # 分類檔案
@@ -249,8 +577,7 @@ def extract_and_process_batch_results(task_id: str, zip_path: Path, manifest_pat
             manifest = json.load(f)
         
         # 建立任務專用目錄
-        task_results_dir = Path("results") / task_id
-        task_results_dir.mkdir(exist_ok=True)
+        task_results_dir = task_dir(task_id, create=True)
         
         # 解壓縮 ZIP 檔案到任務目錄
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
@@ -268,7 +595,7 @@ def extract_and_process_batch_results(task_id: str, zip_path: Path, manifest_pat
                     'filename': file_info['filename'],
                     'type': file_info['type'],
                     'description': file_info.get('description', ''),
-                    'url': f"/results/{task_id}/{file_info['filename']}"
+                    'url': result_url(task_id, file_info['filename'])
                 })
                 
                 # 分類檔案
@@ -293,40 +620,214 @@ def extract_and_process_batch_results(task_id: str, zip_path: Path, manifest_pat
         print(f"處理批次結果失敗: {e}")
         raise
 
-@celery_app.task(bind=True)
-def run_ai_processing_task(self, client_id: str, file_paths: list, rule_text: str):
-    """Celery 主任務，串聯整個處理流程"""
+def finalize_task_results(task_id: str, batch_results: Dict):
+    """結果寫入完成後：寫出分頁用的檔案清單、預先壓縮文字檔，並登記到保留策略的索引"""
+    write_file_index(task_id, batch_results)
+    # 預先壓縮 GDS / manifest 等文字檔，web 端依 Accept-Encoding 直接送出壓縮版本
+    with trace_span('precompress'):
+        precompress_directory(task_dir(task_id))
+    try:
+        register_task(get_redis(), task_id)
+    except Exception as e:
+        print(f"登記結果保留索引失敗: {e}")
+
+def build_completed_payload(batch_results: Dict, trace_id: Optional[str] = None) -> Dict:
+    """
+    組合任務完成時要推送給前端的訊息 (有 trace_id 時附帶各階段耗時)
+
+    只帶批次摘要與檔案清單的網址，完整清單由前端透過 /batches/{task_id}/files 分頁讀取，
+    數千個檔案的批次也不會產生數 MB 的 WebSocket frame。
+    """
+    summary = batch_summary(batch_results)
+    payload = {
+        "status": "completed",
+        "message": f"批次處理完成！共產生 {batch_results['total_count']} 個檔案",
+        "batch": summary,
+        "zip_url": summary['zip_url']
+    }
+    if trace_id:
+        try:
+            payload["timings"] = summarize_trace(get_trace(trace_id))
+        except Exception as e:
+            print(f"讀取 trace 失敗: {e}")
+    return payload
+
+def handle_cancelled_task(client_id: str, task_id: str, file_paths: list, stage: str,
+                          started_at: Optional[float] = None):
+    """任務被取消：刪除上傳檔與已下載的部分結果，記錄取消在哪個階段生效並通知前端"""
+    print(f"任務 {task_id} 已取消 (停在 {stage} 之前)")
+    for path in file_paths:
+        Path(path).unlink(missing_ok=True)
+    shutil.rmtree(task_dir(task_id), ignore_errors=True)
+    record_cancelled(get_redis(), stage, started_at)
+    update_progress_via_redis(client_id, {"status": "cancelled", "message": "任務已取消"}, task_id)
+
+def dispatch_tiled_processing(client_id: str, task_id: str, file_paths: list, compiled_rules: Dict,
+                              queue: Optional[str] = None, include_timings: bool = False) -> bool:
+    """
+    將大型 layout 切成 tiles，以 Celery chord 分派到所有 worker 平行處理，
+    全部完成後由 merge_tile_results_task 合併結果。tile 任務與原任務排在同一條 lane。
+    無法切 tile 時回傳 False。
+    """
+    layout_path = max(file_paths, key=lambda p: Path(p).stat().st_size)
+    bbox = layout_bbox(layout_path)
+    if bbox is None:
+        return False
+
+    tiles = partition_layout(bbox)
+    if len(tiles) < 2:
+        return False
+
+    print(f"Layout {layout_path} 外框 {bbox}，切成 {len(tiles)} 個 tiles 平行處理")
+    chord(
+        group(process_tile_task.s(task_id, file_paths, compiled_rules, tile).set(queue=queue) for tile in tiles)
+    )(
+        # 合併與 errback 也排在原任務的 lane，bulk 任務的合併不會佔用 interactive
+        merge_tile_results_task.s(client_id, task_id, file_paths, include_timings).set(queue=queue)
+        .on_error(notify_tile_failure.s(client_id, task_id, file_paths).set(queue=queue))
+    )
+    return True
+
+# 主任務、合併與 errback 都透過 Redis Pub/Sub 回報結果，回傳值沒有人讀取，不寫入 result backend
+@celery_app.task(bind=True, ignore_result=True)
+def run_ai_processing_task(self, client_id: str, file_paths: list, rule_text: str,
+                           include_timings: Optional[bool] = None):
+    """Celery 主任務，串聯整個處理流程 (include_timings 為 True 時完成訊息會附帶各階段耗時)"""
+    if include_timings is None:
+        include_timings = TRACE_CONFIG['include_in_payload']
+    started = time.time()
+    t0 = time.perf_counter()
+    # 分派成 tile 時由合併任務 (或 errback) 負責收尾
+    finished_here = True
     try:
         # 獲取當前任務的 task_id
         task_id = self.request.id
         print(f"開始處理任務 - Client ID: {client_id}, Task ID: {task_id}")
+        # 在佇列中被取消、但 revoke 沒有送達這個 worker 時，在開始前攔下
+        checkpoint(get_redis(), task_id, 'queued')
         
         # [修改] 所有進度更新都改為透過 Redis 發布
-        update_progress_via_redis(client_id, {"status": "processing", "message": "任務已開始，正在啟動 AI 模型..."})
+        update_progress_via_redis(client_id, {"status": "processing", "message": "任務已開始，正在啟動 AI 模型..."}, task_id)
+        
+        # 相同的 rule deck 只需編譯一次，之後直接從 Redis 取用 compiled 形式
+        with trace_span('rule_compile'):
+            compiled_rules = get_compiled_rules(rule_text, get_redis())
         
-        model_output_path = mock_ai_model(file_paths, rule_text)
-        update_progress_via_redis(client_id, {"status": "processing", "message": "AI 模型處理完成，準備傳送到 Server B..."})
+        # 大型 layout 改為分 tile 平行處理，後續進度由 tile 任務與合併任務回報
+        if should_tile(file_paths) and dispatch_tiled_processing(
+                client_id, task_id, file_paths, compiled_rules,
+                queue=(self.request.delivery_info or {}).get('routing_key'),
+                include_timings=include_timings):
+            finished_here = False
+            update_progress_via_redis(client_id, {"status": "processing", "message": "Layout 較大，已切成多個區塊分派給各 worker 平行處理..."}, task_id)
+            return "已分派 tile 任務"
         
-        upload_to_server_b(model_output_path, task_id)
-        update_progress_via_redis(client_id, {"status": "processing", "message": "檔案已傳送到 Server B，正在等待回傳批次結果..."})
+        checkpoint(get_redis(), task_id, 'model')
+        with trace_span('model'):
+            model_output_path = mock_ai_model(file_paths, compiled_rules, output_path=f"AI_model_output_{task_id}.txt",
+                                              task_id=task_id, client_id=client_id)
+        update_progress_via_redis(client_id, {"status": "processing", "message": "AI 模型處理完成，準備傳送到 Server B..."}, task_id)
         
-        batch_results = wait_for_server_b_response(task_id)  # 使用 task_id 而不是 client_id
+        try:
+            checkpoint(get_redis(), task_id, 'server_b_upload')
+            with trace_span('server_b_upload'):
+                upload_to_server_b(model_output_path, task_id)
+        finally:
+            Path(model_output_path).unlink(missing_ok=True)
+        update_progress_via_redis(client_id, {"status": "processing", "message": "檔案已傳送到 Server B，正在等待回傳批次結果..."}, task_id)
+        
+        batch_results = wait_for_server_b_response(task_id, cancel_id=task_id)  # 使用 task_id 而不是 client_id
+
+        checkpoint(get_redis(), task_id, 'finalize')
+        finalize_task_results(task_id, batch_results)
         
         # 清理上傳的暫存檔案
         for path in file_paths:
             Path(path).unlink(missing_ok=True)
 
-        final_payload = {
-            "status": "completed",
-            "message": f"批次處理完成！共產生 {batch_results['total_count']} 個檔案",
-            "batch_results": batch_results,
-            "zip_url": f"/results/{batch_results['zip_file']}",
-            "files": batch_results['files']
-        }
-        update_progress_via_redis(client_id, final_payload)
+        record_span('task_total', started, time.perf_counter() - t0)
+        update_progress_via_redis(client_id, build_completed_payload(batch_results, task_id if include_timings else None), task_id)
 
+    except TaskCancelled as e:
+        handle_cancelled_task(client_id, self.request.id, file_paths, e.stage, started)
     except Exception as e:
         print(f"任務失敗: {e}")
-        update_progress_via_redis(client_id, {"status": "error", "message": f"錯誤：{e}"})
+        update_progress_via_redis(client_id, {"status": "error", "message": f"錯誤：{e}"}, self.request.id)
+    finally:
+        if finished_here:
+            untrack_task(get_redis(), client_id, self.request.id)
+
+    return "任務流程結束"
+
+# tile 任務的結果由 chord 收集後交給合併任務，必須保留 (過大的結果會 offload 到 blob store)
+@celery_app.task
+def process_tile_task(task_id: str, file_paths: list, compiled_rules: Dict, tile: Dict) -> Dict:
+    """處理單一 tile：AI 模型只看 tile 的 window，再以獨立的 job id 送到 Server B"""
+    tile_job_id = f"{task_id}_tile{tile['index']:03d}"
+    print(f"開始處理 tile {tile['index']} (Job ID: {tile_job_id}, 範圍: {tile['window']})")
+    # tile 的各階段記錄在原任務的 trace 底下
+    set_trace(task_id)
+    # 原任務被取消時，尚未開始的 tile 直接結束 (chord 的 errback 負責通知前端)
+    checkpoint(get_redis(), task_id, 'tile')
+
+    with trace_span('model', tile=tile['index']):
+        model_output_path = mock_ai_model(
+            file_paths, compiled_rules,
+            window=tile['window'],
+            output_path=f"AI_model_output_{tile_job_id}.txt",
+            task_id=tile_job_id
+        )
+    try:
+        checkpoint(get_redis(), task_id, 'server_b_upload')
+        with trace_span('server_b_upload', tile=tile['index']):
+            upload_to_server_b(model_output_path, tile_job_id)
+    finally:
+        Path(model_output_path).unlink(missing_ok=True)
+
+    batch_results = wait_for_server_b_response(tile_job_id, cancel_id=task_id)
+    return {'tile': tile, 'batch_results': batch_results}
+
+@celery_app.task(ignore_result=True)
+def merge_tile_results_task(tile_results: list, client_id: str, task_id: str, file_paths: list,
+                            include_timings: bool = False):
+    """chord 的回呼：合併所有 tile 的結果並通知前端"""
+    set_trace(task_id)
+    try:
+        checkpoint(get_redis(), task_id, 'tile_merge')
+        with trace_span('tile_merge', tiles=len(tile_results)):
+            batch_results = merge_tile_results(task_id, tile_results)
+        finalize_task_results(task_id, batch_results)
+
+        for path in file_paths:
+            Path(path).unlink(missing_ok=True)
+
+        update_progress_via_redis(client_id, build_completed_payload(batch_results, task_id if include_timings else None), task_id)
+    except TaskCancelled as e:
+        handle_cancelled_task(client_id, task_id, file_paths, e.stage)
+    except Exception as e:
+        print(f"合併 tile 結果失敗: {e}")
+        update_progress_via_redis(client_id, {"status": "error", "message": f"錯誤：{e}"}, task_id)
+    finally:
+        untrack_task(get_redis(), client_id, task_id)
+
+    return "任務流程結束"
+
+@celery_app.task(ignore_result=True)
+def notify_tile_failure(request, exc, traceback, client_id: str, task_id: Optional[str] = None,
+                        file_paths: Optional[list] = None):
+    """任一 tile 失敗 (或原任務被取消) 時 chord 不會執行合併，改由此 errback 通知前端；取消時一併刪除上傳檔"""
+    if task_id and is_cancelled(get_redis(), task_id):
+        handle_cancelled_task(client_id, task_id, file_paths or [], 'tile')
+    else:
+        print(f"Tile 任務失敗 (Task ID: {request.id}): {exc}")
+        update_progress_via_redis(client_id, {"status": "error", "message": f"錯誤：{exc}"}, task_id)
+    untrack_task(get_redis(), client_id, task_id)
 
-    return "任務流程結束"
\ No newline at end of file
+@celery_app.task(ignore_result=True)
+def sweep_results_task():
+    """由 Celery beat 定期執行：依 TTL 與 quota 清理 results/ 與 uploads/，以及過期的 payload blob"""
+    stats = sweep(get_redis())
+    stats['blobs_removed'] = sweep_blobs()
+    if not stats.get('skipped'):
+        print(f"結果清理完成: {stats}")
+    return stats
@@ -4,6 +4,9 @@ import ssl
 from pathlib import Path
 from dotenv import load_dotenv
 
+# CustomFTP_TLS 已移到 ftps_transfer，這裡保留匯入讓既有的 `from test_ftp import CustomFTP_TLS` 繼續可用
+from ftps_transfer import CustomFTP_TLS  # noqa: F401
+
 # Load environment variables
 load_dotenv()
 
@@ -16,17 +19,6 @@ FTP_CONFIG = {
     'upload_dir': os.getenv('FTP_SERVER_B_UPLOAD_DIR'),
 }
 
-class CustomFTP_TLS(ftplib.FTP_TLS):
-    """Custom FTP_TLS class to handle TLS session reuse issues"""
-    
-    def ntransfercmd(self, cmd, rest=None):
-        conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
-        if self._prot_p:
-            conn = self.context.wrap_socket(conn,
-                                          server_hostname=self.host,
-                                          session=self.sock.session)  # Reuse TLS session
-        return conn, size
-
 def test_custom_ftp_tls():
     """Test with custom FTP_TLS that handles session reuse"""
     print("Testing with Custom FTP_TLS (session reuse)...")
@@ -0,0 +1,286 @@
+"""
+大型 Layout 分割 (Tiling) 工具
+
+把一個大型 GDS 依空間切成數個互相重疊的 tile，每個 tile 的外圍多留一圈
+halo 區域，讓跨越 tile 邊界的 DRC 檢查在任一側都能看到完整的鄰近圖形。
+各 tile 的結果合併時，每個 violation 只由「擁有」其位置的 tile 保留
+(依 tile 的核心區，不含 halo)，因此 halo 區內重複找到的 violation 會被去除。
+violation 的座標由模型輸出、Server B 寫在 manifest 的 violations 中；
+各 tile 的 PNG/GDS 輸出是整個 tile 範圍的結果，合併時全部保留 (加上 tile 前綴)。
+
+注意：tile 只記錄座標視窗，不會真的裁切 GDS 檔案，因此所有 worker
+(包含其他節點上的 worker) 必須能透過共享儲存讀到同一個上傳檔案。
+"""
+
+import os
+import json
+import math
+import shutil
+import struct
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from result_store import task_dir, result_url, zip_name, manifest_name
+
+# --- Tiling Configuration ---
+TILING_CONFIG = {
+    # 超過此大小 (bytes) 的 layout 才會切 tile，小檔案直接走原本的單一任務流程
+    'min_file_size': int(os.getenv('TILING_MIN_FILE_SIZE', str(50 * 1024 * 1024))),
+    # tile 邊長與 halo 寬度，單位為 layout 的資料庫單位 (DB units)
+    'tile_size': int(os.getenv('TILING_TILE_SIZE', '200000')),
+    'halo': int(os.getenv('TILING_HALO', '2000')),
+    # tile 數量上限；超過時會自動放大 tile 邊長
+    'max_tiles': int(os.getenv('TILING_MAX_TILES', '64')),
+}
+
+# GDSII record types
+_GDS_HEADER = 0x00
+_GDS_XY = 0x10
+
+BBox = Tuple[int, int, int, int]
+
+
+def _is_binary_gds(path: Path) -> bool:
+    """判斷檔案是否為二進位 GDSII (第一個 record 為 HEADER)"""
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    return len(head) == 4 and head[2] == _GDS_HEADER and head[3] == 0x02
+
+
+class LayoutParseError(ValueError):
+    """layout 中有無法解析的座標 (切 tile 時改走不切 tile 的流程)"""
+
+
+def _iter_binary_polygons(path: Path):
+    """逐一讀取二進位 GDSII 中的 XY record，每個 record 回傳一組座標點"""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return
+            length, record_type = struct.unpack('>HB', header[:3])
+            if length < 4:
+                return
+            data = f.read(length - 4)
+            if record_type == _GDS_XY:
+                count = len(data) // 4
+                coords = struct.unpack(f'>{count}i', data[:count * 4])
+                yield [(coords[i], coords[i + 1]) for i in range(0, count - 1, 2)]
+
+
+def _iter_text_polygons(path: Path):
+    """讀取文字格式 GDS (如 create_mock_results.py 產生的 mock GDS) 的 XY 座標，每行一組"""
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line_no, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts or parts[0] != 'XY':
+                continue
+            try:
+                values = [int(float(v)) for v in parts[1:]]
+            except ValueError:
+                raise LayoutParseError(f"{path} 第 {line_no} 行的座標無法解析: {line.strip()[:80]}") from None
+            yield [(values[i], values[i + 1]) for i in range(0, len(values) - 1, 2)]
+
+
+def iter_layout_polygons(path) -> Iterator[List[Tuple[int, int]]]:
+    """依檔案格式逐一讀取 layout 的 XY record (串流處理，不會整檔載入記憶體)"""
+    path = Path(path)
+    if _is_binary_gds(path):
+        return _iter_binary_polygons(path)
+    return _iter_text_polygons(path)
+
+
+def iter_layout_points(path) -> Iterator[Tuple[int, int]]:
+    """依檔案格式逐點讀取 layout 的座標"""
+    for polygon in iter_layout_polygons(path):
+        yield from polygon
+
+
+def layout_bbox(path) -> Optional[BBox]:
+    """計算 layout 的外框 (x0, y0, x1, y1)，沒有任何座標或座標無法解析時回傳 None"""
+    x0 = y0 = math.inf
+    x1 = y1 = -math.inf
+    try:
+        for x, y in iter_layout_points(path):
+            x0, y0 = min(x0, x), min(y0, y)
+            x1, y1 = max(x1, x), max(y1, y)
+    except LayoutParseError as e:
+        print(f"{e}，不切 tile")
+        return None
+    if x0 is math.inf:
+        return None
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def should_tile(file_paths: List[str]) -> bool:
+    """只要有任何一個輸入檔案超過門檻就啟用 tiling"""
+    for path in file_paths:
+        p = Path(path)
+        if p.exists() and p.stat().st_size >= TILING_CONFIG['min_file_size']:
+            return True
+    return False
+
+
+def partition_layout(bbox: BBox, tile_size: Optional[int] = None,
+                     halo: Optional[int] = None, max_tiles: Optional[int] = None) -> List[Dict]:
+    """
+    將 layout 外框切成網格狀的 tiles
+
+    每個 tile 包含:
+      - core: 此 tile 擁有的區域 (半開區間 [x0, x1) x [y0, y1)，最右/最上排包含邊界)
+      - window: core 向外擴張 halo 後的處理範圍 (會被裁切在 layout 外框內)
+    """
+    tile_size = tile_size or TILING_CONFIG['tile_size']
+    halo = TILING_CONFIG['halo'] if halo is None else halo
+    max_tiles = max_tiles or TILING_CONFIG['max_tiles']
+
+    x0, y0, x1, y1 = bbox
+    width = max(x1 - x0, 1)
+    height = max(y1 - y0, 1)
+
+    cols = max(1, math.ceil(width / tile_size))
+    rows = max(1, math.ceil(height / tile_size))
+    # tile 數量過多時等比例放大 tile 邊長
+    while cols * rows > max_tiles:
+        tile_size = int(tile_size * 1.5) + 1
+        cols = max(1, math.ceil(width / tile_size))
+        rows = max(1, math.ceil(height / tile_size))
+
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            cx0 = x0 + col * tile_size
+            cy0 = y0 + row * tile_size
+            cx1 = x1 if col == cols - 1 else cx0 + tile_size
+            cy1 = y1 if row == rows - 1 else cy0 + tile_size
+            tiles.append({
+                'index': len(tiles),
+                'row': row,
+                'col': col,
+                'last_col': col == cols - 1,
+                'last_row': row == rows - 1,
+                'core': [cx0, cy0, cx1, cy1],
+                'window': [max(x0, cx0 - halo), max(y0, cy0 - halo),
+                           min(x1, cx1 + halo), min(y1, cy1 + halo)],
+            })
+    return tiles
+
+
+def tile_owns_point(tile: Dict, x: float, y: float) -> bool:
+    """判斷座標點是否位於 tile 的核心區 (每個點只會屬於唯一一個 tile)"""
+    cx0, cy0, cx1, cy1 = tile['core']
+    in_x = cx0 <= x < cx1 or (tile['last_col'] and x == cx1)
+    in_y = cy0 <= y < cy1 or (tile['last_row'] and y == cy1)
+    return in_x and in_y
+
+
+def violation_anchor(violation: Dict) -> Tuple[float, float]:
+    """取得 violation 的代表座標 (優先使用 x/y，否則取 bbox 中心)"""
+    if 'x' in violation and 'y' in violation:
+        return violation['x'], violation['y']
+    vx0, vy0, vx1, vy1 = violation['bbox']
+    return (vx0 + vx1) / 2, (vy0 + vy1) / 2
+
+
+def _violation_key(violation: Dict) -> str:
+    return json.dumps(violation, sort_keys=True, ensure_ascii=False)
+
+
+def merge_violations(tile_violations: List[Tuple[Dict, List[Dict]]]) -> List[Dict]:
+    """
+    合併各 tile 找到的 violations
+
+    只保留代表座標落在該 tile 核心區的 violation，halo 區內的重複結果會由
+    擁有該位置的鄰近 tile 負責回報；最後再以內容做一次精確去重。
+    """
+    merged = []
+    seen = set()
+    for tile, violations in tile_violations:
+        for violation in violations:
+            x, y = violation_anchor(violation)
+            if not tile_owns_point(tile, x, y):
+                continue
+            key = _violation_key(violation)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(violation)
+    return merged
+
+
+def merge_tile_results(task_id: str, tile_results: List[Dict]) -> Dict:
+    """
+    將各 tile 的批次結果合併成單一批次結果
+
+    tile_results 中每一項為 {'tile': <tile>, 'batch_results': <extract_and_process_batch_results 的回傳值>}。
+    各 tile 的輸出檔會搬到任務的結果目錄並加上 tile 前綴，最後重新打包成
+    {task_id}_results.zip，回傳格式與 extract_and_process_batch_results 相同。
+    """
+    task_results_dir = task_dir(task_id, create=True)
+
+    extracted_files = []
+    png_files = []
+    gds_files = []
+    tile_violations = []
+
+    for item in sorted(tile_results, key=lambda r: r['tile']['index']):
+        tile = item['tile']
+        batch = item['batch_results']
+        tile_dir = task_dir(batch['batch_id'])
+        prefix = f"t{tile['index']:03d}_"
+
+        for file_info in batch['files']:
+            src = tile_dir / file_info['filename']
+            filename = prefix + file_info['filename']
+            if not src.exists():
+                # 缺少的檔案不列入結果，其他 tile 的結果仍然合併
+                print(f"Tile {tile['index']} 的結果缺少 {file_info['filename']}，略過")
+                continue
+            shutil.move(str(src), str(task_results_dir / filename))
+            extracted_files.append({
+                'filename': filename,
+                'type': file_info['type'],
+                'description': f"[Tile {tile['index']}] {file_info.get('description', '')}".strip(),
+                'url': result_url(task_id, filename)
+            })
+            if file_info['type'] == 'png':
+                png_files.append(filename)
+            elif file_info['type'] == 'gds':
+                gds_files.append(filename)
+
+        tile_violations.append((tile, batch.get('manifest', {}).get('violations', [])))
+
+        # 清理 tile 的暫存目錄 (包含 tile 的 ZIP 與 manifest)
+        shutil.rmtree(tile_dir, ignore_errors=True)
+
+    violations = merge_violations(tile_violations)
+    manifest = {
+        'batch_id': task_id,
+        'total_count': len(extracted_files),
+        'tile_count': len(tile_results),
+        'files': [{k: f[k] for k in ('filename', 'type', 'description')} for f in extracted_files],
+        'violations': violations,
+    }
+
+    manifest_path = task_results_dir / manifest_name(task_id)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    zip_path = task_results_dir / zip_name(task_id)
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for file_info in extracted_files:
+            zf.write(task_results_dir / file_info['filename'], file_info['filename'])
+        zf.write(manifest_path, manifest_path.name)
+
+    print(f"已合併 {len(tile_results)} 個 tile，共 {len(extracted_files)} 個檔案、{len(violations)} 個 violation")
+
+    return {
+        'batch_id': task_id,
+        'total_count': len(extracted_files),
+        'files': extracted_files,
+        'png_files': png_files,
+        'gds_files': gds_files,
+        'zip_file': zip_path.name,
+        'manifest': manifest
+    }
@@ -0,0 +1,217 @@
+"""
+端到端延遲追蹤 (Per-stage tracing) 與 Prometheus 格式的指標
+
+每個任務以 task_id 作為 trace id，流程中的每個階段 (upload、queue_wait、
+rule_compile、model、server_b_upload、server_b_queue、server_b_processing、
+poll_gap、download、extract ...) 會記錄一個 span：
+
+  - span 明細以 JSON 存在 Redis list `drc:trace:{task_id}` (保留 TRACE_TTL 秒)，
+    同時以一行 JSON 寫入 log，方便以 task_id 搜尋
+  - 各階段耗時累計到 Redis 中的 histogram，`/metrics` 端點讀取後輸出
+    Prometheus text format
+
+呼叫 Server B 時以 HTTP header (X-Trace-Id / X-Parent-Span) 傳遞 trace id，
+Server B 會把自己的階段時間放在 status 回應的 `timings` 中回傳。
+"""
+
+import os
+import json
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+TRACE_CONFIG = {
+    'key_prefix': os.getenv('TRACE_KEY_PREFIX', 'drc'),
+    'ttl': int(os.getenv('TRACE_TTL', str(24 * 3600))),
+    # 最終 WebSocket 訊息預設是否附帶各階段耗時
+    'include_in_payload': os.getenv('TRACE_IN_PAYLOAD', 'false').lower() in ('1', 'true', 'yes'),
+}
+
+TRACE_HEADER = 'X-Trace-Id'
+PARENT_SPAN_HEADER = 'X-Parent-Span'
+
+# histogram 的 bucket 上界 (秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+logger = logging.getLogger("drc.trace")
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('drc_trace_id', default=None)
+_current_stage: contextvars.ContextVar = contextvars.ContextVar('drc_trace_stage', default=None)
+_redis_getter = None
+
+
+def init_tracing(redis_getter):
+    """設定取得 (同步) Redis client 的函式，每次寫入時呼叫，讓 fork 後的子行程使用自己的連線"""
+    global _redis_getter
+    _redis_getter = redis_getter
+
+
+def _default_client():
+    return _redis_getter() if _redis_getter is not None else None
+
+
+def set_trace(trace_id: Optional[str]):
+    """設定目前執行中任務的 trace id (每個 Celery 任務開始時呼叫)"""
+    _current_trace.set(trace_id)
+
+
+def current_trace() -> Optional[str]:
+    return _current_trace.get()
+
+
+def trace_headers() -> Dict[str, str]:
+    """呼叫 Server B 時要附帶的 trace header"""
+    trace_id = _current_trace.get()
+    if not trace_id:
+        return {}
+    headers = {TRACE_HEADER: trace_id}
+    if _current_stage.get():
+        headers[PARENT_SPAN_HEADER] = _current_stage.get()
+    return headers
+
+
+def _trace_key(trace_id: str) -> str:
+    return f"{TRACE_CONFIG['key_prefix']}:trace:{trace_id}"
+
+
+def _histogram_key(stage: str) -> str:
+    return f"{TRACE_CONFIG['key_prefix']}:metrics:stage:{stage}"
+
+
+def _build_span(trace_id: str, stage: str, start: float, duration: float, attrs: Dict) -> Dict:
+    return {
+        'trace_id': trace_id,
+        'stage': stage,
+        'start': round(start, 6),
+        'duration_ms': round(duration * 1000, 3),
+        'pid': os.getpid(),
+        **attrs
+    }
+
+
+def _queue_span(pipe, span: Dict):
+    """將 span 明細與 histogram 更新加入 pipeline (同步與非同步 client 共用)"""
+    key = _trace_key(span['trace_id'])
+    pipe.rpush(key, json.dumps(span, ensure_ascii=False))
+    pipe.expire(key, TRACE_CONFIG['ttl'])
+
+    seconds = span['duration_ms'] / 1000
+    hkey = _histogram_key(span['stage'])
+    for bound in LATENCY_BUCKETS:
+        if seconds <= bound:
+            pipe.hincrby(hkey, f"le_{bound}", 1)
+    pipe.hincrby(hkey, 'count', 1)
+    pipe.hincrbyfloat(hkey, 'sum', seconds)
+    pipe.sadd(f"{TRACE_CONFIG['key_prefix']}:metrics:stages", span['stage'])
+
+
+def record_span(stage: str, start: float, duration: float, trace_id: Optional[str] = None,
+                redis_client=None, **attrs):
+    """記錄一個已量測好的 span (同步版本，供 Celery worker 使用)"""
+    trace_id = trace_id or _current_trace.get()
+    if not trace_id:
+        return
+    span = _build_span(trace_id, stage, start, duration, attrs)
+    logger.info(json.dumps(span, ensure_ascii=False))
+
+    client = redis_client or _default_client()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        _queue_span(pipe, span)
+        pipe.execute()
+    except Exception as e:
+        print(f"記錄 trace span 失敗: {e}")
+
+
+async def arecord_span(redis_client, stage: str, start: float, duration: float, trace_id: str, **attrs):
+    """記錄一個 span (非同步版本，供 FastAPI 使用)"""
+    span = _build_span(trace_id, stage, start, duration, attrs)
+    logger.info(json.dumps(span, ensure_ascii=False))
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        _queue_span(pipe, span)
+        await pipe.execute()
+    except Exception as e:
+        print(f"記錄 trace span 失敗: {e}")
+
+
+@contextmanager
+def trace_span(stage: str, **attrs):
+    """量測 with 區塊的耗時並記錄成 span；區塊內發出的 HTTP 呼叫會以此 stage 作為 parent"""
+    token = _current_stage.set(stage)
+    start = time.time()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_stage.reset(token)
+        if error:
+            attrs['error'] = error
+        record_span(stage, start, time.perf_counter() - t0, **attrs)
+
+
+def record_server_b_timings(timings: Dict, observed_at: float):
+    """
+    將 Server B 回報的階段時間轉成 span
+
+    timings 使用 epoch 秒 (received_at / started_at / processed_at / completed_at)；
+    poll_gap 為 Server B 完成到我們察覺之間的時間，兩台主機的時鐘誤差會反映在此值上。
+    """
+    received = timings.get('received_at')
+    started = timings.get('started_at')
+    processed = timings.get('processed_at')
+    completed = timings.get('completed_at')
+    if received and started:
+        record_span('server_b_queue', received, max(0.0, started - received))
+    if started and processed:
+        record_span('server_b_processing', started, max(0.0, processed - started))
+    if processed and completed:
+        record_span('server_b_packaging', processed, max(0.0, completed - processed))
+    if completed:
+        record_span('poll_gap', completed, max(0.0, observed_at - completed))
+
+
+def get_trace(trace_id: str, redis_client=None) -> List[Dict]:
+    client = redis_client or _default_client()
+    return [json.loads(item) for item in client.lrange(_trace_key(trace_id), 0, -1)]
+
+
+def summarize_trace(spans: List[Dict]) -> Dict[str, float]:
+    """彙整成 {stage: 總耗時 ms}，用於最終 WebSocket 訊息的 timings 區塊"""
+    summary: Dict[str, float] = {}
+    for span in spans:
+        summary[span['stage']] = round(summary.get(span['stage'], 0.0) + span['duration_ms'], 3)
+    return summary
+
+
+def render_histograms(name: str, help_text: str, histograms: Dict[str, Dict[str, float]]) -> List[str]:
+    """將 {stage: {le_x: count, count, sum}} 轉成 Prometheus histogram 文字格式"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for stage in sorted(histograms):
+        data = histograms[stage]
+        for bound in LATENCY_BUCKETS:
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{float(bound):g}"}} '
+                         f'{int(float(data.get(f"le_{bound}", 0)))}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {int(float(data.get("count", 0)))}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {float(data.get("sum", 0.0))}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {int(float(data.get("count", 0)))}')
+    return lines
+
+
+async def load_stage_histograms(redis_client) -> Dict[str, Dict[str, float]]:
+    """從 Redis 讀出所有階段的 histogram (非同步，供 /metrics 使用)"""
+    stages = await redis_client.smembers(f"{TRACE_CONFIG['key_prefix']}:metrics:stages")
+    histograms = {}
+    for stage in stages:
+        stage = stage.decode() if isinstance(stage, bytes) else stage
+        raw = await redis_client.hgetall(_histogram_key(stage))
+        histograms[stage] = {(k.decode() if isinstance(k, bytes) else k): float(v) for k, v in raw.items()}
+    return histograms
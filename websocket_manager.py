@@ -1,30 +1,115 @@
-from typing import Dict
+from typing import Dict, Optional, Tuple
 from fastapi import WebSocket
 import asyncio
 
+from progress import PROGRESS_CONFIG, is_terminal
+from json_codec import dumps
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+WS_FORMATS = ('json', 'msgpack') if msgpack is not None else ('json',)
+
 class WebSocketManager:
     """
     管理所有 WebSocket 連線的類別
     """
-    def __init__(self):
+    def __init__(self, progress_interval_ms: Optional[float] = None):
         # 使用 client_id 作為 key 來儲存連線
         self.active_connections: Dict[str, WebSocket] = {}
+        # 每個連線的訊息格式：json (text frame) 或 msgpack (binary frame)
+        self.formats: Dict[str, str] = {}
+        # 進度訊息的節流：每個 (client_id, task) 在 interval 內只寫入最新一則
+        self.progress_interval = (PROGRESS_CONFIG['ws_interval_ms'] if progress_interval_ms is None
+                                  else progress_interval_ms) / 1000
+        self._pending: Dict[str, Dict[str, dict]] = {}
+        self._last_sent: Dict[Tuple[str, str], float] = {}
+        self._flushers: Dict[str, asyncio.Task] = {}
+        self._send_locks: Dict[str, asyncio.Lock] = {}
 
-    async def connect(self, websocket: WebSocket, client_id: str):
-        """接受新的連線"""
+    async def connect(self, websocket: WebSocket, client_id: str, fmt: str = 'json'):
+        """接受新的連線 (不支援的格式退回 JSON)"""
         await websocket.accept()
         self.active_connections[client_id] = websocket
+        self.formats[client_id] = fmt if fmt in WS_FORMATS else 'json'
 
     def disconnect(self, client_id: str):
         """中斷連線"""
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+        self.formats.pop(client_id, None)
+        self._pending.pop(client_id, None)
+        self._send_locks.pop(client_id, None)
+        for key in [k for k in self._last_sent if k[0] == client_id]:
+            del self._last_sent[key]
+        flusher = self._flushers.pop(client_id, None)
+        if flusher:
+            flusher.cancel()
 
     async def send_personal_message(self, message: dict, client_id: str):
-        """向指定的 client_id 發送 JSON 訊息"""
+        """向指定的 client_id 發送訊息 (依連線的格式編碼為 JSON 或 msgpack)"""
         if client_id in self.active_connections:
             websocket = self.active_connections[client_id]
-            await websocket.send_json(message)
+            if self.formats.get(client_id) == 'msgpack':
+                await websocket.send_bytes(msgpack.packb(message, use_bin_type=True))
+            else:
+                await websocket.send_text(dumps(message))
+
+    async def send_progress(self, message: dict, client_id: str, key: Optional[str] = None):
+        """
+        發送任務進度：同一任務的進度在 interval 內合併為最新一則，完成或錯誤訊息立即送出
+
+        所有寫入都經過同一個 client 的鎖，延後送出的進度不會排到完成訊息之後。
+        """
+        if client_id not in self.active_connections:
+            return
+        key = key or message.get('task_id') or client_id
+        lock = self._send_locks.setdefault(client_id, asyncio.Lock())
+        async with lock:
+            pending = self._pending.setdefault(client_id, {})
+            if is_terminal(message):
+                pending.pop(key, None)
+                self._last_sent.pop((client_id, key), None)
+                await self.send_personal_message(message, client_id)
+                return
+            now = asyncio.get_running_loop().time()
+            if self.progress_interval <= 0 or (
+                    key not in pending
+                    and now - self._last_sent.get((client_id, key), float('-inf')) >= self.progress_interval):
+                self._last_sent[(client_id, key)] = now
+                await self.send_personal_message(message, client_id)
+                return
+            pending[key] = message
+            if client_id not in self._flushers:
+                self._flushers[client_id] = asyncio.create_task(self._flush_pending(client_id))
+
+    async def _flush_pending(self, client_id: str):
+        """在各任務的 interval 到期時送出暫存的最新進度"""
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending.get(client_id):
+                pending = self._pending[client_id]
+                due = min(self._last_sent.get((client_id, key), 0.0) + self.progress_interval for key in pending)
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                async with self._send_locks.setdefault(client_id, asyncio.Lock()):
+                    now = loop.time()
+                    for key in [k for k in pending
+                                if now - self._last_sent.get((client_id, k), 0.0) >= self.progress_interval - 1e-3]:
+                        message = pending.pop(key)
+                        self._last_sent[(client_id, key)] = now
+                        await self.send_personal_message(message, client_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"發送暫存的進度訊息失敗 (client {client_id}): {e}")
+        finally:
+            if self._flushers.get(client_id) is asyncio.current_task():
+                del self._flushers[client_id]
 
 # 建立一個全域共享的 manager 實例
 # 這樣 FastAPI 和 Celery 都能匯入並使用同一個實例